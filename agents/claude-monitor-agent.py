@@ -17,12 +17,15 @@ import psutil
 import threading
 import queue
 
+from terminal_dashboard import TerminalScreen, AdaptiveRefresh
+
 # Configuration
 BASE_DIR = "/home/jclee/app"
 SOCKET_DIR = "/home/jclee/.tmux/sockets"
 GRAFANA_URL = "http://grafana.jclee.me"
 LOKI_URL = f"{GRAFANA_URL}/loki/api/v1/push"
 CHECK_INTERVAL = 10  # seconds
+DISPLAY_MIN_INTERVAL = 1  # seconds
 HEALTH_CHECK_INTERVAL = 30  # seconds
 
 # Colors for terminal output
@@ -127,6 +130,8 @@ class ClaudeMonitorAgent:
             "total_memory": 0,
             "monitored_projects": []
         }
+        self.screen = TerminalScreen()
+        self.refresh = AdaptiveRefresh(min_interval=DISPLAY_MIN_INTERVAL, max_interval=CHECK_INTERVAL)
 
     def discover_projects(self) -> List[str]:
         """Discover all projects in base directory"""
@@ -167,22 +172,25 @@ class ClaudeMonitorAgent:
                 # Discover new sessions
                 self.discover_sessions()
 
-                # Reset stats
-                self.stats["active_sessions"] = 0
-                self.stats["dead_sessions"] = 0
-                self.stats["total_cpu"] = 0
-                self.stats["total_memory"] = 0
-                self.stats["monitored_projects"] = []
+                # Build fresh stats so the display thread never sees a half-reset cycle
+                stats = {
+                    "total_sessions": 0,
+                    "active_sessions": 0,
+                    "dead_sessions": 0,
+                    "total_cpu": 0,
+                    "total_memory": 0,
+                    "monitored_projects": []
+                }
 
                 # Check each session
                 for project_name, session in list(self.sessions.items()):
                     metrics = session.get_metrics()
 
                     if metrics.get("status") == "running":
-                        self.stats["active_sessions"] += 1
-                        self.stats["total_cpu"] += metrics.get("cpu_usage", 0)
-                        self.stats["total_memory"] += metrics.get("memory_usage", 0)
-                        self.stats["monitored_projects"].append(project_name)
+                        stats["active_sessions"] += 1
+                        stats["total_cpu"] += metrics.get("cpu_usage", 0)
+                        stats["total_memory"] += metrics.get("memory_usage", 0)
+                        stats["monitored_projects"].append(project_name)
 
                         # Queue metrics for Grafana
                         self.metrics_queue.put({
@@ -192,15 +200,13 @@ class ClaudeMonitorAgent:
                         })
 
                     elif metrics.get("status") in ["dead", "zombie"]:
-                        self.stats["dead_sessions"] += 1
+                        stats["dead_sessions"] += 1
                         print(f"{Colors.YELLOW}⚠ Dead session: {project_name}{Colors.NC}")
                         # Remove dead session
                         del self.sessions[project_name]
 
-                self.stats["total_sessions"] = len(self.sessions)
-
-                # Display status
-                self.display_status()
+                stats["total_sessions"] = len(self.sessions)
+                self.stats = stats
 
                 time.sleep(CHECK_INTERVAL)
 
@@ -208,9 +214,22 @@ class ClaudeMonitorAgent:
                 print(f"{Colors.RED}Monitor error: {e}{Colors.NC}")
                 time.sleep(CHECK_INTERVAL)
 
+    def display_loop(self):
+        """Redraw the status screen, refreshing faster while it is changing"""
+        while self.running:
+            try:
+                with self.screen.frame():
+                    self.display_status()
+                time.sleep(self.refresh.next_interval(self.screen.changed_rows))
+            except Exception as e:
+                print(f"{Colors.RED}Display error: {e}{Colors.NC}")
+                self.screen.invalidate()
+                time.sleep(CHECK_INTERVAL)
+
+        self.screen.close()
+
     def display_status(self):
         """Display current status"""
-        os.system('clear')
         print(f"{Colors.CYAN}═══════════════════════════════════════════════════{Colors.NC}")
         print(f"{Colors.CYAN}         Claude Process Monitor Agent{Colors.NC}")
         print(f"{Colors.CYAN}═══════════════════════════════════════════════════{Colors.NC}")
@@ -222,7 +241,7 @@ class ClaudeMonitorAgent:
 
         if self.sessions:
             print(f"\n{Colors.CYAN}Monitored Projects:{Colors.NC}")
-            for project_name, session in self.sessions.items():
+            for project_name, session in list(self.sessions.items()):
                 status_color = Colors.GREEN if session.status == "running" else Colors.YELLOW
                 uptime = ""
                 if session.start_time:
@@ -307,6 +326,11 @@ class ClaudeMonitorAgent:
         monitor_thread.daemon = True
         monitor_thread.start()
 
+        # Start display thread
+        display_thread = threading.Thread(target=self.display_loop)
+        display_thread.daemon = True
+        display_thread.start()
+
         # Start Grafana sender thread
         grafana_thread = threading.Thread(target=self.send_to_grafana)
         grafana_thread.daemon = True
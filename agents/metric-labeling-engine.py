@@ -2,15 +2,2096 @@
 
 import asyncio
 import aiohttp
+import bisect
 import json
 import numpy as np
-from datetime import datetime, timedelta
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.preprocessing import StandardScaler
+from datetime import datetime
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.ensemble import IsolationForest
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Callable, Dict, List, Tuple, Any, Optional
 import hashlib
+import heapq
+import os
 import re
+import signal
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import struct
+import time
+from aiohttp import web
+from contextlib import contextmanager
+import joblib
+
+# python-snappy is optional; remote_write bodies are decoded in pure Python without it
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# orjson is optional; it parses large query_range responses several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Prometheus metric names never need regex escaping inside a selector
+METRIC_NAME_PATTERN = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+
+# Per-metric statistics stored in label documents, and the extra features computed with them
+STATISTIC_NAMES = ['mean', 'median', 'std', 'min', 'max', 'p95', 'p99', 'cv']
+FEATURE_NAMES = STATISTIC_NAMES + ['volatility']
+
+# Bump when the on-disk model layout changes; older files are ignored
+ANOMALY_MODEL_FORMAT = 1
+
+# Bump when the persisted label state layout changes; older files are ignored
+LABEL_STATE_FORMAT = 1
+
+# Bump when the persisted streaming statistics layout changes; older files are ignored
+SERIES_STATS_FORMAT = 1
+
+# Bump when the persisted annotation regions layout changes; older files are ignored
+ANNOTATION_STATE_FORMAT = 1
+
+# Percentiles reported for each metric's long-window baseline
+BASELINE_QUANTILES = (0.5, 0.95, 0.99)
+
+# Compute worker processes when LABELING_COMPUTE_WORKERS is unset; each costs a full
+# interpreter with numpy/sklearn, so memory rather than cores is the limit
+DEFAULT_COMPUTE_WORKERS = 2
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def train_anomaly_model(metric_name: str, values: np.ndarray, path: Optional[str],
+                        contamination: float) -> Tuple[str, IsolationForest]:
+    """Fit an IsolationForest on a metric's history (runs in a worker process)"""
+    model = IsolationForest(n_estimators=50, contamination=contamination, random_state=42)
+    model.fit(np.asarray(values, dtype=np.float64).reshape(-1, 1))
+
+    if path:
+        temp_path = f"{path}.tmp"
+        joblib.dump(model, temp_path)
+        os.replace(temp_path, path)
+
+    return metric_name, model
+
+def score_anomalies(values: np.ndarray, model: Optional[IsolationForest] = None) -> Dict[str, Any]:
+    """Flag anomalies by z-score and, once a model is ready, by IsolationForest"""
+    if len(values) < 10:
+        return {'has_anomalies': False, 'anomaly_score': 0}
+
+    # Statistical method (Z-score)
+    std = np.std(values)
+    if std > 0:
+        statistical_anomalies = np.abs((values - np.mean(values)) / std) > 3
+    else:
+        statistical_anomalies = np.zeros(len(values), dtype=bool)
+
+    # Isolation Forest trained on the metric's own baseline.
+    # predict() is score_samples() thresholded at offset_; compute the scores only once
+    if model is not None:
+        isolation_scores = model.score_samples(values.reshape(-1, 1))
+        isolation_anomalies = isolation_scores < model.offset_
+    else:
+        isolation_scores = None
+        isolation_anomalies = np.zeros(len(values), dtype=bool)
+
+    # Combine results
+    combined_anomalies = statistical_anomalies | isolation_anomalies
+    anomaly_indices = np.where(combined_anomalies)[0].tolist()
+
+    result = {
+        'has_anomalies': len(anomaly_indices) > 0,
+        'anomaly_count': len(anomaly_indices),
+        'anomaly_indices': anomaly_indices,
+        'anomaly_score': len(anomaly_indices) / len(values),
+        'anomaly_values': values[anomaly_indices].tolist(),
+        'model_ready': model is not None
+    }
+    if isolation_scores is not None:
+        result['min_isolation_score'] = float(np.min(isolation_scores))
+
+    return result
+
+def analyze_behavior_batch(matrix: np.ndarray, volatility: np.ndarray,
+                           periodicity_threshold: float = 0.5) -> List[Dict[str, Any]]:
+    """Classify every row of a resampled (n_series, points) matrix in one pass
+
+    Rows share one time grid, with NaN for empty bins. Trend slopes (per grid
+    step) come from a masked closed-form least-squares fit. The detrended
+    rows go through a single rfft; a row is periodic when one frequency
+    holds at least `periodicity_threshold` of the non-DC spectral energy.
+    """
+    n, points = matrix.shape
+    finite = np.isfinite(matrix)
+    counts = finite.sum(axis=1)
+    weights = finite.astype(np.float64)
+    x = np.arange(points, dtype=np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = (weights * x).sum(axis=1) / counts
+        mean_y = np.where(finite, matrix, 0.0).sum(axis=1) / counts
+    dx = np.where(finite, x - mean_x[:, None], 0.0)
+    dy = np.where(finite, matrix - mean_y[:, None], 0.0)
+    sxx = (dx * dx).sum(axis=1)
+    slopes = np.divide((dx * dy).sum(axis=1), sxx, out=np.zeros(n), where=sxx > 0)
+
+    # Residuals around the trend; empty bins contribute nothing
+    residuals = dy - slopes[:, None] * dx
+    power = np.abs(np.fft.rfft(residuals, axis=1)[:, 1:]) ** 2
+    energy = power.sum(axis=1)
+    significant = energy > 1e-9 * (dy * dy).sum(axis=1)
+    peak_share = np.divide(power.max(axis=1, initial=0.0), energy, out=np.zeros(n), where=significant)
+    periodic = (counts > 10) & significant & (peak_share >= periodicity_threshold)
+
+    behaviors = []
+    for count, slope, is_periodic, row_volatility in zip(counts.tolist(), slopes.tolist(),
+                                                         periodic.tolist(), volatility.tolist()):
+        if count < 2:
+            behaviors.append({'pattern': 'insufficient_data'})
+            continue
+
+        pattern = 'stable'
+        if is_periodic:
+            pattern = 'periodic'
+        elif slope > 0.1:
+            pattern = 'increasing'
+        elif slope < -0.1:
+            pattern = 'decreasing'
+
+        behaviors.append({
+            'pattern': pattern,
+            'trend_slope': slope,
+            'volatility': row_volatility
+        })
+
+    return behaviors
+
+def resample_series(metrics: List[Dict[str, Any]], start: float, end: float, points: int) -> np.ndarray:
+    """Average every metric's samples into `points` equal time bins over [start, end]
+
+    Returns an (n_metrics, points) matrix; bins without finite samples are NaN.
+    """
+    lengths = [len(metric.get('values', [])) for metric in metrics]
+    matrix = np.full((len(metrics), points), np.nan)
+    if not sum(lengths):
+        return matrix
+
+    values = np.concatenate([np.asarray(metric.get('values', []), dtype=np.float64) for metric in metrics])
+    timestamps = np.concatenate([np.asarray(metric.get('timestamps', []), dtype=np.float64) for metric in metrics])
+    segments = np.repeat(np.arange(len(metrics)), lengths)
+
+    keep = np.isfinite(values) & (timestamps >= start) & (timestamps <= end)
+    span = max(end - start, 1e-9)
+    bins = np.minimum(((timestamps[keep] - start) / span * points).astype(np.int64), points - 1)
+    cells = segments[keep] * points + bins
+
+    sums = np.bincount(cells, weights=values[keep], minlength=matrix.size)
+    counts = np.bincount(cells, minlength=matrix.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix = np.where(counts > 0, sums / counts, np.nan).reshape(len(metrics), points)
+    return matrix
+
+def shape_vectors(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Z-normalize resampled rows into shape vectors; return (shapes, rows used)
+
+    Empty bins take the row mean (zero after normalization); rows without
+    any samples are left out, and flat rows become all zeros.
+    """
+    valid = np.isfinite(matrix).any(axis=1)
+    rows = matrix[valid]
+    if not len(rows):
+        return np.empty((0, matrix.shape[1])), valid
+
+    means = np.nanmean(rows, axis=1, keepdims=True)
+    rows = np.where(np.isfinite(rows), rows, means)
+    stds = rows.std(axis=1, keepdims=True)
+    shapes = np.divide(rows - means, stds, out=np.zeros_like(rows), where=stds > 0)
+    return shapes, valid
+
+def fit_shape_clusters(model: MiniBatchKMeans, shapes: np.ndarray,
+                       max_fit_rows: int) -> Tuple[MiniBatchKMeans, List[int]]:
+    """Update the streaming clusters with this cycle's shapes and assign every row
+
+    Runs in a worker process. The model is refined with partial_fit on at
+    most `max_fit_rows` sampled rows, so centroids (and their ids) drift
+    slowly across cycles instead of being refitted from scratch.
+    """
+    fit_rows = shapes
+    if len(shapes) > max_fit_rows:
+        fit_rows = shapes[np.random.default_rng().choice(len(shapes), max_fit_rows, replace=False)]
+
+    if len(fit_rows) >= model.n_clusters:
+        model.partial_fit(fit_rows)
+
+    if not hasattr(model, 'cluster_centers_'):
+        return model, []
+    return model, model.predict(shapes).tolist()
+
+def default_compute_workers() -> int:
+    """DEFAULT_COMPUTE_WORKERS, or fewer if this process may run on fewer CPUs"""
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    return max(1, min(DEFAULT_COMPUTE_WORKERS, available))
+
+# Models loaded by this worker process, keyed by file path (a new version is a new path)
+_worker_models: "OrderedDict[str, IsolationForest]" = OrderedDict()
+_worker_models_max = 2000
+
+def init_compute_worker(max_models: int):
+    """Compute pool initializer: cap the worker's model cache like the parent's store"""
+    global _worker_models_max
+    _worker_models_max = max_models
+
+def load_worker_model(path: str) -> Optional[IsolationForest]:
+    model = _worker_models.get(path)
+    if model is not None:
+        _worker_models.move_to_end(path)
+        return model
+
+    try:
+        model = joblib.load(path)
+    except Exception as e:
+        print(f"Error loading anomaly model {path}: {e}")
+        return None
+
+    _worker_models[path] = model
+    while len(_worker_models) > _worker_models_max:
+        _worker_models.popitem(last=False)
+    return model
+
+def label_series_chunk(shm_name: str, bounds: List[Tuple[int, int]],
+                       model_sources: List[Any]) -> List[Dict[str, Any]]:
+    """Score anomalies for a chunk of series (runs in a worker process)
+
+    Sample values are read from the shared memory block `shm_name`, where
+    series i occupies [start, end) of one flat float64 array, so only the
+    offsets and small per-series dicts cross the process boundary. Models
+    are given as file paths, or as the model itself when it is not persisted.
+    """
+    if not bounds:
+        return []
+
+    lo, hi = bounds[0][0], bounds[-1][1]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        flat = np.ndarray((hi,), dtype=np.float64, buffer=shm.buf)
+        chunk = flat[lo:hi].copy()
+        del flat
+    finally:
+        shm.close()
+
+    results = []
+    for (start, end), source in zip(bounds, model_sources):
+        model = load_worker_model(source) if isinstance(source, str) else source
+        results.append(score_anomalies(chunk[start - lo:end - lo], model))
+    return results
+
+class AnomalyModelStore:
+    """Per-metric anomaly models trained on long history in the background
+
+    Each metric keeps a bounded history of samples. Once it has enough, a
+    model is fitted in a worker process, persisted under `directory` with a
+    version number, and reused for cheap predict/score_samples calls until
+    it is older than `retrain_interval`. Only `max_loaded` models are kept in
+    memory; the rest are reloaded from disk on demand.
+    """
+
+    def __init__(self, directory: Optional[str], history_size: int = 1440, min_samples: int = 60,
+                 retrain_interval: int = 3600, max_loaded: int = 2000,
+                 max_jobs: int = 64, contamination: float = 0.1, executor=None):
+        self.directory = directory
+        self.history_size = history_size
+        self.min_samples = min_samples
+        self.retrain_interval = retrain_interval
+        self.max_loaded = max_loaded
+        self.max_jobs = max_jobs
+        self.contamination = contamination
+        self.executor = executor
+
+        self.history: Dict[str, array] = {}
+        self.last_timestamp: Dict[str, float] = {}
+        self.index: Dict[str, Dict[str, Any]] = {}  # name -> {version, trained_at, samples, file}
+        self.models: "OrderedDict[str, IsolationForest]" = OrderedDict()
+        self.training: Dict[str, asyncio.Future] = {}
+        self.index_dirty = False
+
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self.load_index()
+            except OSError as e:
+                print(f"Anomaly model persistence disabled: {e}")
+                self.directory = None
+
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def model_path(self, metric_name: str, version: int) -> Optional[str]:
+        if not self.directory:
+            return None
+        digest = hashlib.md5(metric_name.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.v{version}.joblib")
+
+    def load_index(self):
+        """Load model metadata written by a previous run"""
+        if not os.path.exists(self.index_path()):
+            return
+        try:
+            with open(self.index_path()) as f:
+                data = json.load(f)
+            if data.get('format') == ANOMALY_MODEL_FORMAT:
+                self.index = data.get('models', {})
+        except (OSError, ValueError) as e:
+            print(f"Error loading anomaly model index: {e}")
+
+    def save_index(self):
+        if not self.directory or not self.index_dirty:
+            return
+        try:
+            temp_path = f"{self.index_path()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'format': ANOMALY_MODEL_FORMAT, 'models': self.index}, f)
+            os.replace(temp_path, self.index_path())
+            self.index_dirty = False
+        except OSError as e:
+            print(f"Error saving anomaly model index: {e}")
+
+    def observe(self, metric_name: str, values, timestamps=None):
+        """Append samples newer than the last one seen to the metric's history"""
+        history = self.history.get(metric_name)
+        if history is None:
+            history = self.history[metric_name] = array('d')
+
+        values = np.asarray(values, dtype=np.float64)
+        if timestamps is not None and len(timestamps):
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            last = self.last_timestamp.get(metric_name, float('-inf'))
+            values = values[timestamps > last]
+            self.last_timestamp[metric_name] = max(last, float(timestamps.max()))
+
+        history.frombytes(values[~np.isnan(values)].tobytes())
+        excess = len(history) - self.history_size
+        if excess > 0:
+            del history[:excess]
+
+    def get_model(self, metric_name: str) -> Optional[IsolationForest]:
+        """Return the metric's model, loading it from disk if needed"""
+        model = self.models.get(metric_name)
+        if model is not None:
+            self.models.move_to_end(metric_name)
+            return model
+
+        entry = self.index.get(metric_name)
+        if not entry or not self.directory:
+            return None
+
+        try:
+            model = joblib.load(os.path.join(self.directory, entry['file']))
+        except Exception as e:
+            print(f"Error loading anomaly model for {metric_name}: {e}")
+            return None
+
+        self._cache(metric_name, model)
+        return model
+
+    def _cache(self, metric_name: str, model: IsolationForest):
+        self.models[metric_name] = model
+        self.models.move_to_end(metric_name)
+        while len(self.models) > self.max_loaded:
+            self.models.popitem(last=False)
+
+    def needs_training(self, metric_name: str, now: float) -> bool:
+        if metric_name in self.training:
+            return False
+        if len(self.history.get(metric_name, ())) < self.min_samples:
+            return False
+        entry = self.index.get(metric_name)
+        if entry is None:
+            return metric_name not in self.models
+        if not entry.get('file') and metric_name not in self.models:
+            # In-memory only model evicted from the cache; nothing to reload it from
+            return True
+        return now - entry['trained_at'] >= self.retrain_interval
+
+    def schedule_training(self):
+        """Submit due retraining jobs to the worker pool without waiting for them"""
+        loop = asyncio.get_running_loop()
+        now = datetime.utcnow().timestamp()
+        submitted = 0
+
+        for metric_name in list(self.history):
+            if len(self.training) >= self.max_jobs:
+                break
+            if not self.needs_training(metric_name, now):
+                continue
+
+            entry = self.index.get(metric_name, {})
+            version = entry.get('version', 0) + 1
+            values = np.frombuffer(self.history[metric_name], dtype=np.float64).copy()
+
+            future = loop.run_in_executor(
+                self.executor, train_anomaly_model, metric_name, values,
+                self.model_path(metric_name, version), self.contamination
+            )
+            self.training[metric_name] = future
+            future.add_done_callback(
+                lambda f, name=metric_name, v=version, n=len(values): self._install(f, name, v, n)
+            )
+            submitted += 1
+
+        return submitted
+
+    def _install(self, future: asyncio.Future, metric_name: str, version: int, samples: int):
+        self.training.pop(metric_name, None)
+        if future.cancelled() or metric_name not in self.history:
+            # Cancelled, or the metric was handed off to another shard meanwhile
+            return
+        if future.exception():
+            print(f"Error training anomaly model for {metric_name}: {future.exception()}")
+            return
+
+        _, model = future.result()
+        previous = self.index.get(metric_name)
+
+        if self.directory:
+            # Labeling workers load persisted models themselves; drop any stale copy here
+            self.models.pop(metric_name, None)
+            self.index[metric_name] = {
+                'version': version,
+                'trained_at': datetime.utcnow().timestamp(),
+                'samples': samples,
+                'file': os.path.basename(self.model_path(metric_name, version))
+            }
+            self.index_dirty = True
+
+            # Keep only the latest version on disk
+            if previous and previous['file'] != self.index[metric_name]['file']:
+                try:
+                    os.remove(os.path.join(self.directory, previous['file']))
+                except OSError:
+                    pass
+        else:
+            self._cache(metric_name, model)
+            self.index[metric_name] = {'version': version, 'trained_at': datetime.utcnow().timestamp(),
+                                       'samples': samples, 'file': None}
+
+    def export(self, metric_names) -> Dict[str, Dict[str, Any]]:
+        """Remove metrics from this store and return their history, index entry and model"""
+        exported = {}
+        for metric_name in metric_names:
+            if metric_name not in self.history and metric_name not in self.index:
+                continue
+            entry = self.index.get(metric_name)
+            exported[metric_name] = {
+                'history': self.history.pop(metric_name, array('d')),
+                'last_timestamp': self.last_timestamp.pop(metric_name, None),
+                'entry': entry,
+                'model': self.get_model(metric_name) if entry else None
+            }
+            self.index.pop(metric_name, None)
+            self.models.pop(metric_name, None)
+            self.index_dirty = True
+            if entry and entry.get('file') and self.directory:
+                try:
+                    os.remove(os.path.join(self.directory, entry['file']))
+                except OSError:
+                    pass
+        return exported
+
+    def import_state(self, exported: Dict[str, Dict[str, Any]]):
+        """Adopt metrics exported by another store, persisting their models here
+
+        History and models already held here win when they are at least as
+        recent, so a stale handoff cannot roll them back.
+        """
+        for metric_name, state in exported.items():
+            local_last = self.last_timestamp.get(metric_name)
+            if state['last_timestamp'] is not None and (local_last is None or state['last_timestamp'] > local_last):
+                self.history[metric_name] = state['history']
+                self.last_timestamp[metric_name] = state['last_timestamp']
+            elif metric_name not in self.history:
+                self.history[metric_name] = state['history']
+
+            entry, model = state['entry'], state['model']
+            if not entry or model is None:
+                continue
+            local_entry = self.index.get(metric_name)
+            if local_entry and local_entry.get('trained_at', 0) >= entry.get('trained_at', 0):
+                continue
+            path = self.model_path(metric_name, entry['version'])
+            if path:
+                try:
+                    joblib.dump(model, path)
+                except OSError as e:
+                    print(f"Error saving handed-off model for {metric_name}: {e}")
+                    continue
+                entry = {**entry, 'file': os.path.basename(path)}
+            else:
+                self._cache(metric_name, model)
+            self.index[metric_name] = entry
+            self.index_dirty = True
+
+    def model_source(self, metric_name: str) -> Any:
+        """What a labeling worker needs to score the metric
+
+        The path of the persisted model, which workers load and cache
+        themselves, or the in-memory model when persistence is unavailable.
+        """
+        entry = self.index.get(metric_name)
+        if not entry:
+            return None
+        if entry.get('file') and self.directory:
+            return os.path.join(self.directory, entry['file'])
+        return self.get_model(metric_name)
+
+class BulkLabelSink:
+    """Buffers label documents and writes them to Elasticsearch with _bulk
+
+    Documents are serialized to NDJSON on arrival and flushed when the buffer
+    reaches `max_docs` or `max_bytes`, or `flush_interval` seconds after the
+    last flush. Items the cluster rejects with a retryable status (429 or
+    5xx), and whole requests that fail, are re-queued up to `max_retries`
+    times; other item errors are counted and dropped. The backlog is capped
+    at `max_backlog` documents, dropping the oldest when exceeded. Documents
+    queued with a key are reported to `on_drop` when they are given up on,
+    including those still buffered at close.
+    """
+
+    RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, url: str, get_session, max_docs: int = 500, max_bytes: int = 5 * 1024 * 1024,
+                 flush_interval: float = 5.0, max_retries: int = 3, max_backlog: int = 50000,
+                 timeout: float = 30.0, telemetry: Optional["CycleTelemetry"] = None,
+                 on_drop: Optional[Callable[[List[str]], None]] = None):
+        self.url = url
+        self.get_session = get_session
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_backlog = max_backlog
+        self.timeout = timeout
+        self.telemetry = telemetry
+        self.on_drop = on_drop
+
+        # Each entry is (action + document NDJSON lines, attempts so far, key or None)
+        self.buffer: List[Tuple[bytes, int, Optional[str]]] = []
+        self.buffer_bytes = 0
+        self.flush_lock = asyncio.Lock()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.last_flush = 0.0
+        self.retry_after = 0.0
+
+        self.stats = {
+            'indexed': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+            'total_flush_latency': 0.0
+        }
+
+    async def add(self, document: Dict[str, Any], index: str, key: Optional[str] = None):
+        """Queue a document, flushing if the buffer is full"""
+        if self.flush_task is None or self.flush_task.done():
+            self.last_flush = asyncio.get_running_loop().time()
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+        entry = (json.dumps({'index': {'_index': index}}) + '\n' + json.dumps(document) + '\n').encode()
+        self._enqueue([(entry, 0, key)])
+
+        if ((len(self.buffer) >= self.max_docs or self.buffer_bytes >= self.max_bytes)
+                and asyncio.get_running_loop().time() >= self.retry_after):
+            await self.flush()
+
+    def _enqueue(self, entries: List[Tuple[bytes, int, Optional[str]]]):
+        self.buffer.extend(entries)
+        self.buffer_bytes += sum(len(entry) for entry, _, _ in entries)
+
+        excess = len(self.buffer) - self.max_backlog
+        if excess > 0:
+            dropped = self.buffer[:excess]
+            self.buffer_bytes -= sum(len(entry) for entry, _, _ in dropped)
+            del self.buffer[:excess]
+            self.stats['dropped'] += excess
+            self._report_dropped(dropped)
+
+    def _report_dropped(self, entries: List[Tuple[bytes, int, Optional[str]]]):
+        keys = [key for _, _, key in entries if key is not None]
+        if keys and self.on_drop:
+            self.on_drop(keys)
+
+    async def flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(0.1, self.last_flush + self.flush_interval - loop.time()))
+            if self.buffer and loop.time() - self.last_flush >= self.flush_interval:
+                await self.flush()
+            elif not self.buffer:
+                self.last_flush = loop.time()
+
+    async def flush(self):
+        """Send everything buffered, in requests of at most max_docs/max_bytes"""
+        async with self.flush_lock:
+            while self.buffer:
+                batch = []
+                batch_bytes = 0
+                for item in self.buffer:
+                    if batch and (len(batch) >= self.max_docs or batch_bytes + len(item[0]) > self.max_bytes):
+                        break
+                    batch.append(item)
+                    batch_bytes += len(item[0])
+
+                del self.buffer[:len(batch)]
+                self.buffer_bytes -= batch_bytes
+
+                retry = await self.send_batch(batch, batch_bytes)
+                if retry:
+                    self._enqueue(retry)
+                    # Leave failed items for the next timed flush instead of hammering the cluster
+                    if len(retry) == len(batch):
+                        self.retry_after = asyncio.get_running_loop().time() + self.flush_interval
+                        break
+
+            self.last_flush = asyncio.get_running_loop().time()
+
+    async def send_batch(self, batch: List[Tuple[bytes, int, Optional[str]]],
+                         batch_bytes: int) -> List[Tuple[bytes, int, Optional[str]]]:
+        """POST one _bulk request; return the entries that should be retried"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        body = b''.join(entry for entry, _, _ in batch)
+        items = None
+
+        try:
+            session = await self.get_session()
+            async with session.post(f"{self.url}/_bulk", data=body,
+                                    headers={'Content-Type': 'application/x-ndjson'},
+                                    timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    items = result.get('items', [])
+                else:
+                    error = f"HTTP {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            error = str(e) or type(e).__name__
+
+        latency = loop.time() - start
+        self.stats['flushes'] += 1
+        self.stats['last_flush_latency'] = latency
+        self.stats['max_flush_latency'] = max(self.stats['max_flush_latency'], latency)
+        self.stats['total_flush_latency'] += latency
+        if self.telemetry:
+            self.telemetry.observe_request('elasticsearch', latency, items is not None)
+
+        if items is None or len(items) != len(batch):
+            self.stats['flush_errors'] += 1
+            if items is not None:
+                error = f"{len(items)} results for {len(batch)} documents"
+            print(f"Bulk flush of {len(batch)} labels ({batch_bytes} bytes) failed: {error}")
+            return self._retryable(batch)
+
+        retry = []
+        rejected = []
+        first_error = None
+        for queued, item in zip(batch, items):
+            outcome = next(iter(item.values()), {})
+            status = outcome.get('status', 0)
+            if status < 300:
+                self.stats['indexed'] += 1
+            elif status in self.RETRYABLE_STATUSES:
+                retry.append(queued)
+            else:
+                rejected.append(queued)
+                first_error = first_error or outcome.get('error')
+
+        self.stats['failed'] += len(rejected)
+        self._report_dropped(rejected)
+
+        if first_error:
+            print(f"Bulk flush rejected labels: {first_error}")
+
+        return self._retryable(retry)
+
+    def _retryable(self, entries: List[Tuple[bytes, int, Optional[str]]]
+                   ) -> List[Tuple[bytes, int, Optional[str]]]:
+        retry = [(entry, attempts + 1, key) for entry, attempts, key in entries if attempts < self.max_retries]
+        self.stats['retried'] += len(retry)
+        self.stats['failed'] += len(entries) - len(retry)
+        self._report_dropped([queued for queued in entries if queued[1] >= self.max_retries])
+        return retry
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['backlog'] = len(self.buffer)
+        stats['backlog_bytes'] = self.buffer_bytes
+        stats['avg_flush_latency'] = (stats['total_flush_latency'] / stats['flushes']
+                                      if stats['flushes'] else 0.0)
+        del stats['total_flush_latency']
+        return stats
+
+    async def close(self):
+        """Stop the flush timer and write out what is left"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+        # Whatever the cluster did not take by now is lost
+        if self.buffer:
+            print(f"Discarding {len(self.buffer)} unsent labels at shutdown")
+            self.stats['dropped'] += len(self.buffer)
+            self._report_dropped(self.buffer)
+            self.buffer, self.buffer_bytes = [], 0
+
+class GrafanaAnnotationManager:
+    """One Grafana region annotation per high-severity episode of a metric
+
+    A metric entering one of `severities` (most severe first) opens a
+    region annotation; while it stays there the region's timeEnd is
+    extended with a PATCH at most every `extend_interval` seconds, and the
+    region is closed once the metric drops below. A metric that comes back
+    within `cooldown` seconds of its region closing reopens that region
+    instead of creating another, so flapping metrics leave one annotation.
+    Regions of metrics not seen for `expire_after` seconds are closed at
+    their last sighting. Writes are coalesced per metric and sent by
+    `flush()`, at most `concurrency` at a time over the shared session.
+    Known regions are persisted to `path` so restarts keep extending them.
+    """
+
+    def __init__(self, url: str, get_session, path: Optional[str] = None, api_key: Optional[str] = None,
+                 severities: Tuple[str, ...] = ('critical', 'high'), cooldown: float = 900,
+                 extend_interval: float = 300, expire_after: float = 180, concurrency: int = 8,
+                 timeout: float = 10.0, telemetry: Optional["CycleTelemetry"] = None):
+        self.url = url
+        self.get_session = get_session
+        self.path = path
+        self.severities = severities
+        self.cooldown = cooldown
+        self.extend_interval = extend_interval
+        self.expire_after = expire_after
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.telemetry = telemetry
+
+        self.headers = {'Content-Type': 'application/json'}
+        if api_key:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+
+        # metric name -> region (annotation id once created, times in ms, open flag, last sighting)
+        self.regions: Dict[str, Dict[str, Any]] = {}
+        self.pending: set = set()
+        self.dirty = False
+
+        self.stats = {'opened': 0, 'reopened': 0, 'extended': 0, 'closed': 0, 'coalesced': 0,
+                      'writes': 0, 'failed': 0}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('format') == ANNOTATION_STATE_FORMAT:
+                self.regions = data.get('regions', {})
+        except (OSError, ValueError) as e:
+            print(f"Error loading annotation state: {e}")
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'format': ANNOTATION_STATE_FORMAT,
+                           'regions': {name: region for name, region in self.regions.items()
+                                       if region['id'] is not None}}, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"Error saving annotation state: {e}")
+
+    def observe(self, labels: Dict[str, Any], now: float):
+        """Open, extend or close the metric's region for its latest severity"""
+        name = labels['metric_name']
+        severity = labels['severity']
+        region = self.regions.get(name)
+        now_ms = int(now * 1000)
+
+        if severity not in self.severities:
+            if region is not None and region['open']:
+                region.update(open=False, end=now_ms, closed_at=now)
+                self.pending.add(name)
+                self.stats['closed'] += 1
+            return
+
+        if region is None or (not region['open'] and now - region['closed_at'] > self.cooldown):
+            self.regions[name] = {'id': None, 'start': now_ms, 'end': now_ms, 'sent_end': None,
+                                  'severity': severity, 'tags': list(labels.get('auto_tags', [])),
+                                  'open': True, 'seen': now, 'closed_at': None}
+            self.pending.add(name)
+            self.stats['opened'] += 1
+            return
+
+        reopened = not region['open']
+        escalated = self.severities.index(severity) < self.severities.index(region['severity'])
+        region.update(open=True, end=now_ms, seen=now, closed_at=None)
+        if escalated:
+            region['severity'] = severity
+            region['tags'] = list(labels.get('auto_tags', []))
+
+        if (reopened or escalated or region['sent_end'] is None
+                or now_ms - region['sent_end'] >= self.extend_interval * 1000):
+            self.pending.add(name)
+            self.stats['reopened' if reopened else 'extended'] += 1
+        else:
+            self.stats['coalesced'] += 1
+
+    def expire(self, now: float):
+        """Close regions of metrics that stopped reporting; forget regions past their cooldown"""
+        for name, region in list(self.regions.items()):
+            if region['open'] and now - region['seen'] > self.expire_after:
+                region.update(open=False, end=int(region['seen'] * 1000), closed_at=now)
+                self.pending.add(name)
+                self.stats['closed'] += 1
+            elif (not region['open'] and name not in self.pending
+                  and now - region['closed_at'] > self.cooldown):
+                del self.regions[name]
+                self.dirty = True
+
+    async def flush(self, now: Optional[float] = None):
+        """Send the coalesced creates and timeEnd updates"""
+        self.expire(now or datetime.utcnow().timestamp())
+        if self.pending:
+            names, self.pending = list(self.pending), set()
+            session = await self.get_session()
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def write(name: str):
+                async with semaphore:
+                    if not await self.send(session, name, self.regions[name]):
+                        self.pending.add(name)
+
+            await asyncio.gather(*(write(name) for name in names if name in self.regions))
+        self.save()
+
+    async def send(self, session: aiohttp.ClientSession, name: str, region: Dict[str, Any]) -> bool:
+        """POST a new region or PATCH an existing one; False if it should be retried"""
+        end = region['end']
+        annotation = {
+            'timeEnd': end,
+            'tags': region['tags'],
+            'text': f"{name}: {region['severity']} severity detected"
+        }
+        if region['id'] is None:
+            annotation.update(dashboardId=0, panelId=0, time=region['start'])
+            method, url = 'POST', f"{self.url}/api/annotations"
+        else:
+            method, url = 'PATCH', f"{self.url}/api/annotations/{region['id']}"
+
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, json=annotation, headers=self.headers,
+                                       timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                status = response.status
+                result = await response.json(content_type=None) if status in (200, 201) else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            status, result = 0, None
+            error = str(e) or type(e).__name__
+        else:
+            error = f"HTTP {status}"
+
+        if self.telemetry:
+            self.telemetry.observe_request('grafana', time.perf_counter() - start, result is not None)
+        self.stats['writes'] += 1
+
+        if result is None:
+            self.stats['failed'] += 1
+            if status == 404 and region['id'] is not None:
+                # Deleted in Grafana; start a fresh region on the next flush
+                region.update(id=None, start=int(region['seen'] * 1000), sent_end=None)
+                return False
+            print(f"Annotation {method} for {name} failed: {error}")
+            # Connection errors, throttling and server errors are retried; other rejections are dropped
+            return not (status == 0 or status == 429 or status >= 500)
+
+        if region['id'] is None:
+            region['id'] = result.get('id')
+        region['sent_end'] = end
+        self.dirty = True
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['open'] = sum(1 for region in self.regions.values() if region['open'])
+        stats['pending'] = len(self.pending)
+        return stats
+
+class MetricNameClassifier:
+    """Keyword classifier for metric names, compiled once and memoized
+
+    All category, type and unit keywords are folded into one regex that is
+    tried at every position of the name via a lookahead, so a single scan
+    finds every keyword occurrence, overlapping ones included. The longest
+    keyword wins at each position; keywords contained in it are implied.
+    Results are cached per name in an LRU of `cache_size` entries.
+    """
+
+    def __init__(self, categories: Dict[str, List[str]],
+                 type_rules: List[Tuple[str, str, List[str]]],
+                 unit_rules: List[Tuple[str, List[str]]], cache_size: int = 50000):
+        self.categories = categories
+        self.type_rules = type_rules
+        self.unit_rules = unit_rules
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        keywords = set()
+        for words in categories.values():
+            keywords.update(words)
+        for _, _, words in type_rules:
+            keywords.update(words)
+        for _, words in unit_rules:
+            keywords.update(words)
+
+        # Longest first so the alternation prefers the longest keyword at each position
+        ordered = sorted(keywords, key=lambda word: (-len(word), word))
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(word) for word in ordered) + '))')
+        self.implied = {word: frozenset(other for other in keywords if other in word) for word in keywords}
+
+    def match_keywords(self, name_lower: str) -> set:
+        found = set()
+        for match in self.pattern.finditer(name_lower):
+            found |= self.implied[match.group(1)]
+        return found
+
+    def classify(self, metric_name: str) -> Dict[str, Any]:
+        cached = self.cache.get(metric_name)
+        if cached is not None:
+            self.cache.move_to_end(metric_name)
+            self.hits += 1
+        else:
+            self.misses += 1
+            cached = self._classify(metric_name)
+            self.cache[metric_name] = cached
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        # Callers get their own categories list; the cached entry stays untouched
+        return {**cached, 'categories': list(cached['categories'])}
+
+    def _classify(self, metric_name: str) -> Dict[str, Any]:
+        found = self.match_keywords(metric_name.lower())
+        classifications = {
+            'categories': [category for category, words in self.categories.items()
+                           if not found.isdisjoint(words)],
+            'type': 'unknown',
+            'unit': 'unknown',
+            'aggregation': 'avg'
+        }
+
+        for metric_type, aggregation, words in self.type_rules:
+            if not found.isdisjoint(words):
+                classifications['type'] = metric_type
+                classifications['aggregation'] = aggregation
+                break
+
+        for unit, words in self.unit_rules:
+            if not found.isdisjoint(words):
+                classifications['unit'] = unit
+                break
+
+        return classifications
+
+class LabelStateStore:
+    """Last emitted label state per metric, for change-only emission
+
+    A metric's labels are written again only when a material field changes
+    (severity, tags, behavior pattern, classification, anomaly flag or
+    cluster) or when `heartbeat_interval` seconds have passed since its last
+    emission. State is kept in memory and saved to `path` so a restart does
+    not re-emit everything. Metrics not emitted for two heartbeats are
+    assumed gone and pruned on save.
+    """
+
+    def __init__(self, path: Optional[str], heartbeat_interval: int = 3600):
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.state: Dict[str, Dict[str, Any]] = {}  # name -> {signature, emitted_at, severity}
+        self.dirty = False
+
+        self.cycle = {'new': 0, 'changed': 0, 'heartbeat': 0, 'suppressed': 0}
+        self.totals = dict(self.cycle)
+
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.load()
+            except OSError as e:
+                print(f"Label state persistence disabled: {e}")
+                self.path = None
+
+    @staticmethod
+    def signature(labels: Dict[str, Any]) -> str:
+        classifications = labels.get('classifications', {})
+        material = {
+            'severity': labels.get('severity'),
+            'tags': sorted(labels.get('auto_tags', [])),
+            'pattern': labels.get('behavior', {}).get('pattern'),
+            'categories': sorted(classifications.get('categories', [])),
+            'type': classifications.get('type'),
+            'unit': classifications.get('unit'),
+            'has_anomalies': labels.get('anomalies', {}).get('has_anomalies', False),
+            'cluster': labels.get('cluster')
+        }
+        return hashlib.md5(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('format') == LABEL_STATE_FORMAT:
+                self.state = data.get('metrics', {})
+        except (OSError, ValueError) as e:
+            print(f"Error loading label state: {e}")
+
+    def save(self, now: Optional[float] = None):
+        if not self.path or not self.dirty:
+            return
+        now = now or datetime.utcnow().timestamp()
+        cutoff = now - 2 * self.heartbeat_interval
+        self.state = {name: entry for name, entry in self.state.items() if entry['emitted_at'] >= cutoff}
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'format': LABEL_STATE_FORMAT, 'metrics': self.state}, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"Error saving label state: {e}")
+
+    def start_cycle(self):
+        self.cycle = {key: 0 for key in self.cycle}
+
+    def check(self, labels: Dict[str, Any], now: Optional[float] = None) -> Optional[str]:
+        """Return why labels should be emitted ('new', 'changed', 'heartbeat') or None to suppress
+
+        A non-None result records the labels as the metric's emitted state;
+        `discard` rolls that back if the emission is lost.
+        """
+        now = now or datetime.utcnow().timestamp()
+        name = labels['metric_name']
+        signature = self.signature(labels)
+        entry = self.state.get(name)
+
+        if entry is None:
+            reason = 'new'
+        elif entry['signature'] != signature:
+            reason = 'changed'
+        elif now - entry['emitted_at'] >= self.heartbeat_interval:
+            reason = 'heartbeat'
+        else:
+            self.cycle['suppressed'] += 1
+            self.totals['suppressed'] += 1
+            return None
+
+        self.state[name] = {'signature': signature, 'emitted_at': now, 'severity': labels.get('severity')}
+        self.dirty = True
+        self.cycle[reason] += 1
+        self.totals[reason] += 1
+        return reason
+
+    def discard(self, metric_names):
+        """Forget emissions that never reached the index, so the metrics are emitted again"""
+        for name in metric_names:
+            if self.state.pop(name, None) is not None:
+                self.dirty = True
+
+    def export(self, metric_names) -> Dict[str, Dict[str, Any]]:
+        exported = {name: self.state.pop(name) for name in metric_names if name in self.state}
+        self.dirty = self.dirty or bool(exported)
+        return exported
+
+    def import_state(self, exported: Dict[str, Dict[str, Any]]):
+        """Adopt exported label state unless the local emission is as recent"""
+        for name, state in exported.items():
+            local = self.state.get(name)
+            if local is None or state['emitted_at'] > local['emitted_at']:
+                self.state[name] = state
+                self.dirty = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        def with_ratio(counts):
+            total = sum(counts.values())
+            return {**counts, 'emitted': total - counts['suppressed'],
+                    'suppression_ratio': counts['suppressed'] / total if total else 0.0}
+
+        return {'cycle': with_ratio(self.cycle), 'total': with_ratio(self.totals), 'tracked': len(self.state)}
+
+def decode_json(body: bytes) -> Any:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Decode a little-endian base-128 varint; return (value, next position)"""
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint too long")
+
+def snappy_decompress(data: bytes) -> bytes:
+    """Decompress a raw snappy block (the format remote_write uses)"""
+    if snappy is not None:
+        return snappy.uncompress(data)
+
+    length, pos = read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+
+        if kind == 0:
+            # Literal; lengths >= 60 are stored in the next 1-4 bytes
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[pos:pos + extra], 'little')
+                pos += extra
+            size += 1
+            if pos + size > len(data):
+                raise ValueError("truncated literal")
+            out += data[pos:pos + size]
+            pos += size
+            continue
+
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 2], 'little')
+            pos += 2
+        else:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 4], 'little')
+            pos += 4
+
+        if offset == 0 or offset > len(out):
+            raise ValueError("invalid copy offset")
+        start = len(out) - offset
+        if offset >= size:
+            out += out[start:start + size]
+        else:
+            # Overlapping copy repeats the last `offset` bytes
+            pattern = out[start:]
+            out += (pattern * (size // offset + 1))[:size]
+
+    if len(out) != length:
+        raise ValueError(f"decompressed {len(out)} bytes, expected {length}")
+    return bytes(out)
+
+def iter_protobuf_fields(data: bytes):
+    """Yield (field number, wire type, value) from a protobuf message"""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            size, pos = read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        if pos > len(data):
+            raise ValueError("truncated field")
+        yield field, wire_type, value
+
+def parse_write_request(data: bytes) -> List[Tuple[Dict[str, str], List[float], List[float]]]:
+    """Decode a remote_write WriteRequest into (labels, timestamps in seconds, values) per series
+
+    Only the fields needed for labeling are read: WriteRequest.timeseries (1),
+    TimeSeries.labels (1) and samples (2), Label name/value, Sample value
+    (double) and timestamp (int64 milliseconds). Metadata and exemplars are skipped.
+    """
+    series = []
+    for field, wire_type, message in iter_protobuf_fields(data):
+        if field != 1 or wire_type != 2:
+            continue
+
+        labels: Dict[str, str] = {}
+        timestamps: List[float] = []
+        values: List[float] = []
+        for series_field, series_wire, payload in iter_protobuf_fields(message):
+            if series_wire != 2:
+                continue
+            if series_field == 1:
+                name = value = ''
+                for label_field, _, text in iter_protobuf_fields(payload):
+                    if label_field == 1:
+                        name = text.decode()
+                    elif label_field == 2:
+                        value = text.decode()
+                labels[name] = value
+            elif series_field == 2:
+                sample_value, sample_ts = float('nan'), 0
+                for sample_field, sample_wire, raw in iter_protobuf_fields(payload):
+                    if sample_field == 1 and sample_wire == 1:
+                        sample_value = struct.unpack('<d', raw)[0]
+                    elif sample_field == 2 and sample_wire == 0:
+                        sample_ts = raw - (1 << 64) if raw >= 1 << 63 else raw
+                timestamps.append(sample_ts / 1000.0)
+                values.append(sample_value)
+
+        if labels.get('__name__') and values:
+            series.append((labels, timestamps, values))
+    return series
+
+def series_key(labels: Dict[str, str]) -> str:
+    """Prometheus-style identity of one series, e.g. up{instance="a",job="b"}"""
+    pairs = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()) if key != '__name__')
+    return f"{labels.get('__name__', '')}{{{pairs}}}"
+
+class TDigest:
+    """Merging t-digest for streaming quantiles in bounded memory
+
+    New samples are buffered and folded into at most ~`compression`
+    weighted centroids, which stay small near the tails so extreme
+    percentiles keep their accuracy.
+    """
+
+    __slots__ = ('compression', 'means', 'weights', 'buffer')
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.buffer = array('d')
+
+    def update(self, values: np.ndarray):
+        self.buffer.frombytes(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        if len(self.buffer) >= 5 * self.compression:
+            self.compress()
+
+    def centroids(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All centroids plus buffered samples (weight 1), sorted by mean"""
+        means = np.concatenate([np.asarray(self.means, dtype=np.float64),
+                                np.frombuffer(self.buffer, dtype=np.float64)])
+        weights = np.concatenate([np.asarray(self.weights, dtype=np.float64), np.ones(len(self.buffer))])
+        order = np.argsort(means, kind='stable')
+        return means[order], weights[order]
+
+    def compress(self):
+        means, weights = self.centroids()
+        self.buffer = array('d')
+        if not len(means):
+            return
+
+        total = weights.sum()
+        scale = self.compression / (2 * np.pi)
+
+        def q_limit(q: float) -> float:
+            # Inverse of the k1 scale function at k(q) + 1
+            k = scale * np.arcsin(2 * min(max(q, 0.0), 1.0) - 1) + 1
+            return (np.sin(min(k / scale, np.pi / 2)) + 1) / 2
+
+        merged_means, merged_weights = [], []
+        current_mean, current_weight = float(means[0]), float(weights[0])
+        q0 = 0.0
+        limit = q_limit(q0)
+        for mean, weight in zip(means[1:].tolist(), weights[1:].tolist()):
+            if q0 + (current_weight + weight) / total <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                merged_means.append(current_mean)
+                merged_weights.append(current_weight)
+                q0 += current_weight / total
+                limit = q_limit(q0)
+                current_mean, current_weight = mean, weight
+        merged_means.append(current_mean)
+        merged_weights.append(current_weight)
+
+        self.means, self.weights = merged_means, merged_weights
+
+    @staticmethod
+    def quantiles(means: np.ndarray, weights: np.ndarray, qs) -> List[float]:
+        """Interpolate quantiles from sorted centroids"""
+        if not len(means):
+            return [float('nan')] * len(qs)
+        centers = np.cumsum(weights) - weights / 2
+        return np.interp(np.asarray(qs) * weights.sum(), centers, means).tolist()
+
+class SeriesState:
+    """Streaming statistics and the recent sample window of one series"""
+
+    __slots__ = ('last_timestamp', 'count', 'mean', 'm2', 'ewma', 'minimum', 'maximum',
+                 'first_timestamp', 'digest', 'window_timestamps', 'window_values')
+
+    def __init__(self, compression: float = 100.0):
+        self.last_timestamp = float('-inf')
+        self.first_timestamp = None
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.digest = TDigest(compression)
+        self.window_timestamps = array('d')
+        self.window_values = array('d')
+
+    def update(self, timestamps: np.ndarray, values: np.ndarray, window_start: float,
+               alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Fold in samples newer than the last one seen; return those (timestamps, values)"""
+        new = timestamps > self.last_timestamp
+        timestamps, values = timestamps[new], values[new]
+
+        if len(timestamps):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, values = timestamps[order], values[order]
+            self.last_timestamp = float(timestamps[-1])
+            if self.first_timestamp is None:
+                self.first_timestamp = float(timestamps[0])
+            self.window_timestamps.frombytes(timestamps.tobytes())
+            self.window_values.frombytes(values.tobytes())
+
+            finite = values[np.isfinite(values)]
+            if len(finite):
+                # Welford/Chan: merge the batch's count, mean and M2 into the running totals
+                batch_mean = float(finite.mean())
+                batch_m2 = float(((finite - batch_mean) ** 2).sum())
+                total = self.count + len(finite)
+                delta = batch_mean - self.mean
+                self.mean += delta * len(finite) / total
+                self.m2 += batch_m2 + delta * delta * self.count * len(finite) / total
+                self.count = total
+
+                # EWMA over samples in closed form: decay the old value, add weighted new ones
+                decay = (1 - alpha) ** np.arange(len(finite) - 1, -1, -1)
+                start = finite[0] if self.ewma is None else self.ewma
+                self.ewma = float(start * (1 - alpha) ** len(finite) + alpha * (decay * finite).sum())
+
+                self.minimum = min(self.minimum, float(finite.min()))
+                self.maximum = max(self.maximum, float(finite.max()))
+                self.digest.update(finite)
+
+        # Drop window samples that fell out of the labeling window
+        cut = bisect.bisect_left(self.window_timestamps, window_start)
+        if cut:
+            del self.window_timestamps[:cut]
+            del self.window_values[:cut]
+
+        return timestamps, values
+
+class StreamingStatsStore:
+    """Per-series streaming statistics that persist across cycles
+
+    Each series keeps Welford mean/variance, an EWMA, min/max and a
+    t-digest over everything it has ever reported, plus the samples of the
+    current labeling window. Each cycle only samples newer than the series'
+    last timestamp are ingested, and Prometheus is queried only from the
+    end of the previous successful fetch, so long-window baselines cost
+    O(new samples). Series idle for `retention` seconds are dropped.
+    """
+
+    def __init__(self, path: Optional[str], window: int = 300, ewma_alpha: float = 0.1,
+                 compression: float = 100.0, retention: int = 86400, save_interval: int = 300):
+        self.path = path
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.compression = compression
+        self.retention = retention
+        self.save_interval = save_interval
+
+        self.series: Dict[str, SeriesState] = {}
+        self.metric_series: Dict[str, List[str]] = {}
+        self.fetched_until: Dict[str, float] = {}
+        self.last_save = datetime.utcnow().timestamp()
+        self.ingested = 0
+
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.load()
+            except OSError as e:
+                print(f"Streaming statistics persistence disabled: {e}")
+                self.path = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = joblib.load(self.path)
+            if data.get('format') == SERIES_STATS_FORMAT:
+                self.series = data['series']
+                self.metric_series = data['metric_series']
+                self.fetched_until = data['fetched_until']
+        except Exception as e:
+            print(f"Error loading streaming statistics: {e}")
+
+    def save(self, force: bool = False):
+        now = datetime.utcnow().timestamp()
+        if not self.path or (not force and now - self.last_save < self.save_interval):
+            return
+
+        # Forget series that stopped reporting
+        cutoff = now - self.retention
+        self.series = {key: state for key, state in self.series.items() if state.last_timestamp >= cutoff}
+        self.metric_series = {
+            name: [key for key in keys if key in self.series]
+            for name, keys in self.metric_series.items()
+        }
+        self.metric_series = {name: keys for name, keys in self.metric_series.items() if keys}
+        self.fetched_until = {name: ts for name, ts in self.fetched_until.items() if name in self.metric_series}
+
+        try:
+            temp_path = f"{self.path}.tmp"
+            joblib.dump({'format': SERIES_STATS_FORMAT, 'series': self.series,
+                         'metric_series': self.metric_series, 'fetched_until': self.fetched_until}, temp_path)
+            os.replace(temp_path, self.path)
+            self.last_save = now
+        except OSError as e:
+            print(f"Error saving streaming statistics: {e}")
+
+    def export(self, metric_names) -> Dict[str, Any]:
+        """Remove metrics (with all their series) and return their state"""
+        exported = {}
+        for name in metric_names:
+            keys = self.metric_series.pop(name, None)
+            if keys is None:
+                continue
+            exported[name] = {
+                'series': {key: self.series.pop(key) for key in keys if key in self.series},
+                'fetched_until': self.fetched_until.pop(name, None)
+            }
+        return exported
+
+    def import_state(self, exported: Dict[str, Any]):
+        """Adopt exported metrics; series already seen up to the same or a later sample are kept"""
+        for name, state in exported.items():
+            keys = self.metric_series.setdefault(name, [])
+            for key, series_state in state['series'].items():
+                local = self.series.get(key)
+                if local is None:
+                    keys.append(key)
+                elif local.last_timestamp >= series_state.last_timestamp:
+                    continue
+                self.series[key] = series_state
+            if state['fetched_until'] is not None:
+                self.fetched_until[name] = max(state['fetched_until'], self.fetched_until.get(name, float('-inf')))
+
+    def fetch_start(self, metric_name: str, end: float) -> float:
+        """Earliest timestamp that still has to be fetched for a metric"""
+        return max(end - self.window, self.fetched_until.get(metric_name, float('-inf')))
+
+    def ingest(self, metric: Dict[str, Any], end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Fold a fetched delta into the metric's series state
+
+        The metric's values/timestamps are replaced by its full labeling
+        window. Returns the newly ingested (values, timestamps).
+        """
+        name = metric['name']
+        timestamps = np.asarray(metric.get('timestamps', []), dtype=np.float64)
+        values = np.asarray(metric.get('values', []), dtype=np.float64)
+        window_start = end - self.window
+
+        keys = self.metric_series.setdefault(name, [])
+        new_values, new_timestamps = [], []
+        offset = 0
+        for key, count in metric.get('series', [(name, len(values))]):
+            state = self.series.get(key)
+            if state is None:
+                state = self.series[key] = SeriesState(self.compression)
+                keys.append(key)
+            added_timestamps, added_values = state.update(
+                timestamps[offset:offset + count], values[offset:offset + count], window_start, self.ewma_alpha
+            )
+            new_timestamps.append(added_timestamps)
+            new_values.append(added_values)
+            offset += count
+            self.ingested += len(added_values)
+
+        self.fetched_until[name] = end
+        metric['values'], metric['timestamps'] = self.window_samples(name)
+
+        if not new_values:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(new_values), np.concatenate(new_timestamps)
+
+    def window_samples(self, metric_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Retained (values, timestamps) of all the metric's series, as float64 arrays"""
+        states = [self.series[key] for key in self.metric_series.get(metric_name, ()) if key in self.series]
+        if not states:
+            return np.empty(0), np.empty(0)
+        # frombuffer views are only alive inside concatenate, which copies them out
+        values = np.concatenate([np.frombuffer(state.window_values, dtype=np.float64) for state in states])
+        timestamps = np.concatenate([np.frombuffer(state.window_timestamps, dtype=np.float64)
+                                     for state in states])
+        return values, timestamps
+
+    def baseline(self, metric_name: str) -> Dict[str, Any]:
+        """Long-window statistics for a metric, combined over its series"""
+        states = [self.series[key] for key in self.metric_series.get(metric_name, ()) if key in self.series]
+        states = [state for state in states if state.count]
+        if not states:
+            return {}
+
+        count = sum(state.count for state in states)
+        mean = sum(state.mean * state.count for state in states) / count
+        m2 = sum(state.m2 + state.count * (state.mean - mean) ** 2 for state in states)
+        ewma = sum(state.ewma * state.count for state in states) / count
+
+        centroids = [state.digest.centroids() for state in states]
+        means = np.concatenate([c[0] for c in centroids])
+        weights = np.concatenate([c[1] for c in centroids])
+        order = np.argsort(means, kind='stable')
+        quantiles = TDigest.quantiles(means[order], weights[order], BASELINE_QUANTILES)
+
+        baseline = {
+            'count': count,
+            'mean': mean,
+            'std': float(np.sqrt(m2 / count)),
+            'ewma': ewma,
+            'min': min(state.minimum for state in states),
+            'max': max(state.maximum for state in states),
+            'since': datetime.utcfromtimestamp(min(state.first_timestamp for state in states)).isoformat()
+        }
+        for q, value in zip(BASELINE_QUANTILES, quantiles):
+            baseline[f"p{int(q * 100)}"] = value
+        return baseline
+
+def hash64(text: str) -> int:
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], 'big')
+
+class ConsistentHashRing:
+    """Maps keys to members so that adding or removing one member moves ~1/N of the keys"""
+
+    def __init__(self, members: List[str], vnodes: int = 128):
+        points = sorted((hash64(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self.members = sorted(set(members))
+        self.points = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, hash64(key)) % len(self.points)
+        return self.owners[index]
+
+class ShardMembership:
+    """Which metric names this engine instance owns when several run side by side
+
+    Members come from a static list or, when `directory` is set, from
+    heartbeat files that every instance refreshes under `directory/members`
+    (members that have not beaten for `ttl` seconds are dropped). The same
+    directory carries state handoffs: when ownership of a metric moves, the
+    old owner writes its state to `directory/handoff/<new owner>/`, and the
+    new owner imports it on its next cycle. Without a directory there is no
+    handoff, and state of metrics that moved away is kept rather than lost.
+    """
+
+    def __init__(self, instance_id: str, members: Optional[List[str]] = None,
+                 directory: Optional[str] = None, vnodes: int = 128, ttl: float = 180):
+        self.instance_id = instance_id
+        self.static_members = sorted(set(members or []))
+        if self.static_members and instance_id not in self.static_members:
+            raise ValueError(f"Shard id {instance_id!r} is not in the member list "
+                             f"{', '.join(self.static_members)}")
+        self.directory = directory
+        self.vnodes = vnodes
+        self.ttl = ttl
+        self.ring = ConsistentHashRing(self.static_members or [instance_id], vnodes)
+
+        if self.directory:
+            try:
+                os.makedirs(os.path.join(self.directory, "members"), exist_ok=True)
+                os.makedirs(self.handoff_dir(instance_id), exist_ok=True)
+            except OSError as e:
+                print(f"Shard coordination directory unavailable: {e}")
+                self.directory = None
+
+    def handoff_dir(self, member: str) -> str:
+        return os.path.join(self.directory, "handoff", member)
+
+    def heartbeat(self):
+        if not self.directory:
+            return
+        try:
+            with open(os.path.join(self.directory, "members", self.instance_id), 'w') as f:
+                f.write(str(datetime.utcnow().timestamp()))
+        except OSError as e:
+            print(f"Error writing shard heartbeat: {e}")
+
+    def live_members(self) -> List[str]:
+        if self.static_members:
+            return self.static_members
+
+        members = {self.instance_id}
+        if self.directory:
+            now = datetime.utcnow().timestamp()
+            members_dir = os.path.join(self.directory, "members")
+            try:
+                names = os.listdir(members_dir)
+            except OSError as e:
+                print(f"Error reading shard members: {e}")
+                names = []
+            for member in names:
+                try:
+                    if now - os.path.getmtime(os.path.join(members_dir, member)) <= self.ttl:
+                        members.add(member)
+                except OSError:
+                    # Heartbeat file removed while listing
+                    continue
+        return sorted(members)
+
+    def refresh(self) -> bool:
+        """Rebuild the ring if membership changed; return whether it did"""
+        members = self.live_members()
+        if members == self.ring.members:
+            return False
+        self.ring = ConsistentHashRing(members, self.vnodes)
+        return True
+
+    def owner(self, metric_name: str) -> Optional[str]:
+        return self.ring.owner(metric_name)
+
+    def owns(self, metric_name: str) -> bool:
+        return self.ring.owner(metric_name) == self.instance_id
+
+    def write_handoff(self, member: str, payload: Dict[str, Any]) -> bool:
+        if not self.directory:
+            return False
+        try:
+            target_dir = self.handoff_dir(member)
+            os.makedirs(target_dir, exist_ok=True)
+            path = os.path.join(target_dir, f"{self.instance_id}-{int(datetime.utcnow().timestamp() * 1000)}.joblib")
+            joblib.dump(payload, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            return True
+        except OSError as e:
+            print(f"Error handing off state to {member}: {e}")
+            return False
+
+    def read_handoffs(self):
+        """Yield and delete state handed to this instance"""
+        if not self.directory:
+            return
+        target_dir = self.handoff_dir(self.instance_id)
+        try:
+            filenames = sorted(os.listdir(target_dir))
+        except OSError as e:
+            print(f"Error reading shard handoffs: {e}")
+            return
+        for filename in filenames:
+            if not filename.endswith(".joblib"):
+                continue
+            path = os.path.join(target_dir, filename)
+            try:
+                payload = joblib.load(path)
+            except Exception as e:
+                print(f"Error reading handoff {filename}: {e}")
+                continue
+            finally:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            yield payload
+
+class EvaluationScheduler:
+    """Priority queue of metrics ordered by when they are next due for labeling
+
+    Critical, high and anomalous metrics, and metrics whose labels just
+    changed, are re-evaluated every `min_interval` seconds. Metrics whose
+    labels stay the same back off by `backoff` per evaluation, up to
+    `max_interval`. Metrics never seen before are always due. Entries
+    overdue by more than `expire_after` seconds (metric gone) are dropped.
+    """
+
+    URGENT_SEVERITIES = ('critical', 'high')
+
+    def __init__(self, min_interval: float = 60, max_interval: float = 1800, backoff: float = 2.0,
+                 expire_after: float = 86400):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.expire_after = expire_after
+
+        self.queue: List[Tuple[float, str]] = []  # (due, name), stale entries skipped lazily
+        self.schedule: Dict[str, Tuple[float, float]] = {}  # name -> (due, interval)
+
+    def take_due(self, candidates, now: float, limit: int = 0) -> List[str]:
+        """Names among `candidates` that are due, new ones first, then most overdue first
+
+        At most `limit` names are returned when limit > 0; the rest stay queued.
+        """
+        candidates = set(candidates)
+        taken = [name for name in candidates if name not in self.schedule]
+        if limit:
+            taken = taken[:limit]
+
+        skipped = []
+        while self.queue and self.queue[0][0] <= now and (not limit or len(taken) < limit):
+            due, name = heapq.heappop(self.queue)
+            entry = self.schedule.get(name)
+            if entry is None or entry[0] != due:
+                continue
+            if name in candidates:
+                taken.append(name)
+            elif now - due > self.expire_after:
+                del self.schedule[name]
+            else:
+                # Due, but no data in this batch; keep it queued
+                skipped.append((due, name))
+
+        for item in skipped:
+            heapq.heappush(self.queue, item)
+        return taken
+
+    def reschedule(self, labels: Dict[str, Any], changed: bool, now: float) -> float:
+        """Queue the metric's next evaluation based on its fresh labels; return the interval"""
+        name = labels['metric_name']
+        previous = self.schedule.get(name, (0, self.min_interval))[1]
+
+        if (labels.get('severity') in self.URGENT_SEVERITIES
+                or labels.get('anomalies', {}).get('has_anomalies') or changed):
+            interval = self.min_interval
+        else:
+            interval = min(self.max_interval, previous * self.backoff)
+
+        due = now + interval
+        self.schedule[name] = (due, interval)
+        heapq.heappush(self.queue, (due, name))
+        return interval
+
+    def get_stats(self) -> Dict[str, Any]:
+        intervals = [interval for _, interval in self.schedule.values()]
+        return {
+            'scheduled': len(intervals),
+            'at_min_interval': sum(1 for interval in intervals if interval <= self.min_interval),
+            'at_max_interval': sum(1 for interval in intervals if interval >= self.max_interval),
+            'mean_interval': sum(intervals) / len(intervals) if intervals else 0.0
+        }
+
+class RemoteWriteReceiver:
+    """Prometheus remote_write endpoint feeding the labeling engine
+
+    Pushed samples (snappy-compressed protobuf) are folded into the engine's
+    per-series windows as they arrive. Metrics that received data are
+    labeled in small batches every `label_interval` seconds, so labels
+    follow the data within seconds and Prometheus is not queried.
+    """
+
+    def __init__(self, engine: "MetricLabelingEngine", host: str = "0.0.0.0", port: int = 9201,
+                 path: str = "/api/v1/write", label_interval: float = 5.0,
+                 max_body_bytes: int = 32 * 1024 * 1024):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.path = path
+        self.label_interval = label_interval
+        self.max_body_bytes = max_body_bytes
+
+        self.pending: Dict[str, Dict[str, str]] = {}  # metric name -> merged labels
+        self.runner: Optional[web.AppRunner] = None
+        self.label_task: Optional[asyncio.Task] = None
+
+        self.stats = {'requests': 0, 'rejected': 0, 'series': 0, 'samples': 0, 'labeled': 0}
+
+    async def start(self):
+        app = web.Application(client_max_size=self.max_body_bytes)
+        app.router.add_post(self.path, self.handle_write)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.label_task = asyncio.create_task(self.label_loop())
+        print(f"Remote write receiver listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.label_task:
+            self.label_task.cancel()
+            try:
+                await self.label_task
+            except asyncio.CancelledError:
+                pass
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle_write(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        try:
+            body = await request.read()
+            if request.headers.get('Content-Encoding', 'snappy') == 'snappy':
+                body = snappy_decompress(body)
+            series = parse_write_request(body)
+        except Exception as e:
+            self.stats['rejected'] += 1
+            return web.Response(status=400, text=f"invalid write request: {e}")
+
+        now = datetime.utcnow().timestamp()
+        for name, labels in self.engine.ingest_pushed_series(series, now).items():
+            self.pending.setdefault(name, {}).update(labels)
+
+        self.stats['series'] += len(series)
+        self.stats['samples'] += sum(len(values) for _, _, values in series)
+        return web.Response(status=204)
+
+    async def label_loop(self):
+        while True:
+            await asyncio.sleep(self.label_interval)
+            if not self.pending:
+                continue
+
+            pending, self.pending = self.pending, {}
+            try:
+                labels = await self.engine.label_pushed_metrics(pending)
+                self.stats['labeled'] += len(labels)
+            except Exception as e:
+                print(f"Error labeling pushed metrics: {e}")
+
+class CycleTelemetry:
+    """Per-stage timings, counters and HTTP latency histograms of the labeling engine
+
+    Stage time accumulates over every call within a cycle (anomaly chunks,
+    stores and annotations interleave), so `last_cycle` holds each stage's
+    total for the most recent cycle next to running totals since start.
+    Queue and backlog depths are read from `gauges` at export time. Served
+    in Prometheus text format on `port` (/metrics, JSON on /metrics.json)
+    and dumped as JSON to `dump_path` after every cycle.
+    """
+
+    def __init__(self, gauges: Optional[Callable[[], Dict[str, float]]] = None,
+                 buckets: Tuple[float, ...] = HTTP_LATENCY_BUCKETS, dump_path: Optional[str] = None,
+                 host: str = "0.0.0.0", port: int = 0):
+        self.gauges = gauges
+        self.buckets = buckets
+        self.dump_path = dump_path
+        self.host = host
+        self.port = port
+        self.runner: Optional[web.AppRunner] = None
+
+        self.cycles = 0
+        self.overruns = 0
+        self.cycle_started: Optional[float] = None
+        self.last_cycle_seconds = 0.0
+        self.current: Dict[str, float] = {}
+        self.last_cycle: Dict[str, float] = {}
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.stage_items: Dict[str, int] = {}
+        self.counters: Dict[str, float] = {}
+
+        # backend -> per-bucket request counts (last slot is +Inf), summed on export
+        self.http_counts: Dict[str, List[int]] = {}
+        self.http_seconds: Dict[str, float] = {}
+        self.http_errors: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start, items)
+
+    def add_stage(self, name: str, seconds: float, items: int = 0):
+        self.current[name] = self.current.get(name, 0.0) + seconds
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+        self.stage_items[name] = self.stage_items.get(name, 0) + items
+
+    async def timed(self, name: str, iterator):
+        """Re-yield an async iterator's items, charging the time spent waiting for them to a stage"""
+        iterator = iterator.__aiter__()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    self.add_stage(name, time.perf_counter() - start)
+                    return
+                self.add_stage(name, time.perf_counter() - start, 1)
+                yield item
+        finally:
+            # Release the source now rather than whenever it is garbage collected
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+    def count(self, name: str, amount: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe_request(self, backend: str, seconds: float, ok: bool = True):
+        counts = self.http_counts.get(backend)
+        if counts is None:
+            counts = self.http_counts[backend] = [0] * (len(self.buckets) + 1)
+            self.http_seconds[backend] = 0.0
+            self.http_errors[backend] = 0
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.http_seconds[backend] += seconds
+        if not ok:
+            self.http_errors[backend] += 1
+
+    def start_cycle(self):
+        self.cycle_started = time.perf_counter()
+        self.current = {}
+
+    def end_cycle(self, budget: float) -> float:
+        """Close the cycle, dump the snapshot and return the cycle's duration"""
+        seconds = time.perf_counter() - self.cycle_started if self.cycle_started is not None else 0.0
+        self.cycles += 1
+        self.last_cycle_seconds = seconds
+        if seconds > budget:
+            self.overruns += 1
+        self.last_cycle, self.current = self.current, {}
+        self.cycle_started = None
+        self.dump()
+        return seconds
+
+    def slowest_stages(self, limit: int = 5) -> List[Tuple[str, float]]:
+        return sorted(self.last_cycle.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def snapshot(self) -> Dict[str, Any]:
+        http = {}
+        for backend, counts in self.http_counts.items():
+            cumulative = np.cumsum(counts).tolist()
+            http[backend] = {
+                'count': cumulative[-1],
+                'errors': self.http_errors[backend],
+                'seconds': self.http_seconds[backend],
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], cumulative))
+            }
+
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'last_cycle_seconds': self.last_cycle_seconds,
+            'stages': {name: {'last_cycle_seconds': self.last_cycle.get(name, 0.0),
+                              'seconds': seconds,
+                              'calls': self.stage_calls[name],
+                              'items': self.stage_items[name]}
+                       for name, seconds in self.stage_seconds.items()},
+            'counters': dict(self.counters),
+            'http': http,
+            'queues': self.gauges() if self.gauges else {}
+        }
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP labeling_cycles_total Completed labeling cycles",
+            "# TYPE labeling_cycles_total counter",
+            f"labeling_cycles_total {snapshot['cycles']}",
+            "# HELP labeling_cycle_overruns_total Cycles that exceeded the cycle interval",
+            "# TYPE labeling_cycle_overruns_total counter",
+            f"labeling_cycle_overruns_total {snapshot['overruns']}",
+            "# HELP labeling_last_cycle_seconds Duration of the most recent cycle",
+            "# TYPE labeling_last_cycle_seconds gauge",
+            f"labeling_last_cycle_seconds {snapshot['last_cycle_seconds']:.6f}"
+        ]
+
+        stage_metrics = [
+            ('labeling_stage_last_cycle_seconds', 'gauge', 'last_cycle_seconds',
+             "Time spent per stage in the most recent cycle"),
+            ('labeling_stage_seconds_total', 'counter', 'seconds', "Time spent per stage since start"),
+            ('labeling_stage_calls_total', 'counter', 'calls', "Stage invocations since start"),
+            ('labeling_stage_items_total', 'counter', 'items', "Items processed per stage since start")
+        ]
+        for metric, kind, key, help_text in stage_metrics:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{stage="{name}"}} {stage[key]:.6g}' for name, stage in snapshot['stages'].items()]
+
+        for name, value in snapshot['counters'].items():
+            lines += [f"# TYPE labeling_{name}_total counter", f"labeling_{name}_total {value:.6g}"]
+
+        lines += ["# HELP labeling_http_request_duration_seconds HTTP request latency per backend",
+                  "# TYPE labeling_http_request_duration_seconds histogram"]
+        for backend, http in snapshot['http'].items():
+            for bound, count in http['buckets'].items():
+                lines.append(f'labeling_http_request_duration_seconds_bucket{{backend="{backend}",le="{bound}"}} {count}')
+            lines.append(f'labeling_http_request_duration_seconds_sum{{backend="{backend}"}} {http["seconds"]:.6f}')
+            lines.append(f'labeling_http_request_duration_seconds_count{{backend="{backend}"}} {http["count"]}')
+        lines += ["# HELP labeling_http_request_errors_total Failed HTTP requests per backend",
+                  "# TYPE labeling_http_request_errors_total counter"]
+        lines += [f'labeling_http_request_errors_total{{backend="{backend}"}} {http["errors"]}'
+                  for backend, http in snapshot['http'].items()]
+
+        lines += ["# HELP labeling_queue_depth Items waiting in the engine's queues and backlogs",
+                  "# TYPE labeling_queue_depth gauge"]
+        lines += [f'labeling_queue_depth{{queue="{name}"}} {value}' for name, value in snapshot['queues'].items()]
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self):
+        if not self.dump_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.dump_path) or '.', exist_ok=True)
+            temp_path = f"{self.dump_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(temp_path, self.dump_path)
+        except OSError as e:
+            print(f"Error writing telemetry dump: {e}")
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/metrics.json', self.handle_json)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        print(f"Telemetry endpoint listening on {self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render_prometheus().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_json(self, request: web.Request) -> web.Response:
+        return web.json_response(self.snapshot())
 
 class MetricLabelingEngine:
     def __init__(self):
@@ -29,6 +2110,28 @@ class MetricLabelingEngine:
             'application': ['request', 'response', 'error', 'exception']
         }
 
+        # Metric type and unit keywords, first matching rule wins
+        self.type_rules = [
+            ('counter', 'sum', ['_total', '_count', 'counter']),
+            ('gauge', 'avg', ['_gauge', 'current', 'usage']),
+            ('histogram', 'percentile', ['_histogram', '_bucket']),
+            ('summary', 'percentile', ['_summary'])
+        ]
+        self.unit_rules = [
+            ('bytes', ['bytes', 'size']),
+            ('seconds', ['seconds', 'duration', 'time']),
+            ('percent', ['percent', 'ratio']),
+            ('count', ['count', 'total', 'number']),
+            ('rate', ['rate', 'per_second'])
+        ]
+
+        # Category tables may be overridden from a JSON file and are reloaded when it changes
+        self.categories_file = os.getenv("LABELING_CATEGORIES_FILE")
+        self.categories_mtime = None
+        self.classifier_cache_size = int(os.getenv("LABELING_CLASSIFIER_CACHE_SIZE", "50000"))
+        self.name_classifier = None
+        self.reload_categories()
+
         # Severity levels
         self.severity_levels = {
             'critical': {'threshold': 0.9, 'priority': 1},
@@ -38,115 +2141,389 @@ class MetricLabelingEngine:
             'info': {'threshold': 0, 'priority': 5}
         }
 
-        # ML models for classification
-        self.clustering_model = None
-        self.anomaly_model = None
-        self.scaler = StandardScaler()
-
-        # Label cache
-        self.label_cache = {}
-        self.pattern_cache = {}
+        # Persistent state (models, label state) lives under one directory
+        self.state_dir = os.getenv("LABELING_STATE_DIR", "/var/log/labeling/state")
+
+        # Streaming shape clustering: fixed-length z-normalized vectors, ids stable across cycles
+        self.shape_points = int(os.getenv("LABELING_SHAPE_POINTS", "32"))
+        self.shape_clusters = int(os.getenv("LABELING_SHAPE_CLUSTERS", "8"))
+        self.cluster_fit_rows = int(os.getenv("LABELING_CLUSTER_FIT_ROWS", "5000"))
+        self.clustering_model_path = os.path.join(self.state_dir, "shape-clusters.joblib")
+        self.clustering_model = self.load_clustering_model()
+
+        # Share of non-DC spectral energy in one frequency for a series to count as periodic
+        self.periodicity_threshold = float(os.getenv("LABELING_PERIODICITY_THRESHOLD", "0.5"))
+
+        # Per-metric anomaly models, retrained in background worker processes
+        max_loaded_models = int(os.getenv("LABELING_MODEL_MAX_LOADED", "2000"))
+        self.training_executor = ProcessPoolExecutor(
+            max_workers=int(os.getenv("LABELING_TRAINING_WORKERS", "2"))
+        )
+        self.anomaly_models = AnomalyModelStore(
+            os.path.join(self.state_dir, "anomaly-models"),
+            history_size=int(os.getenv("LABELING_MODEL_HISTORY", "1440")),
+            min_samples=int(os.getenv("LABELING_MODEL_MIN_SAMPLES", "60")),
+            retrain_interval=int(os.getenv("LABELING_MODEL_RETRAIN_INTERVAL", "3600")),
+            max_loaded=max_loaded_models,
+            executor=self.training_executor
+        )
+
+        # CPU-heavy labeling (anomaly scoring, FFT, clustering) runs in worker processes;
+        # the default is small and fixed, not the host core count (see DEFAULT_COMPUTE_WORKERS)
+        self.compute_workers = int(os.getenv("LABELING_COMPUTE_WORKERS", str(default_compute_workers())))
+        self.compute_chunk_size = int(os.getenv("LABELING_COMPUTE_CHUNK_SIZE", "256"))
+        # Start the shared memory tracker first so workers inherit it rather than each
+        # starting their own, which would unlink blocks this process still owns
+        resource_tracker.ensure_running()
+        self.compute_executor = ProcessPoolExecutor(
+            max_workers=self.compute_workers,
+            initializer=init_compute_worker,
+            initargs=(max_loaded_models,)
+        )
+
+        # Fetch tuning
+        self.cycle_interval = int(os.getenv("LABELING_CYCLE_INTERVAL", "60"))
+        self.fetch_concurrency = int(os.getenv("LABELING_FETCH_CONCURRENCY", "32"))
+        self.fetch_timeout = float(os.getenv("LABELING_FETCH_TIMEOUT", "10"))
+        self.fetch_retries = int(os.getenv("LABELING_FETCH_RETRIES", "2"))
+
+        # Severity-adaptive re-evaluation: fetched every cycle, labeled only when due
+        self.scheduler = EvaluationScheduler(
+            min_interval=float(os.getenv("LABELING_MIN_EVAL_INTERVAL", str(self.cycle_interval))),
+            max_interval=float(os.getenv("LABELING_MAX_EVAL_INTERVAL", "1800")),
+            backoff=float(os.getenv("LABELING_EVAL_BACKOFF", "2"))
+        )
+        self.max_evaluations = int(os.getenv("LABELING_MAX_EVALUATIONS", "0"))
+
+        # Sharding: with LABELING_SHARD_ID set, this instance only labels the metric names
+        # the consistent-hash ring assigns to it
+        self.shard: Optional[ShardMembership] = None
+        shard_id = os.getenv("LABELING_SHARD_ID")
+        if shard_id:
+            members = [m.strip() for m in os.getenv("LABELING_SHARD_MEMBERS", "").split(",") if m.strip()]
+            self.shard = ShardMembership(
+                shard_id, members=members,
+                directory=os.getenv("LABELING_SHARD_DIR"),
+                vnodes=int(os.getenv("LABELING_SHARD_VNODES", "128")),
+                ttl=float(os.getenv("LABELING_SHARD_TTL", str(3 * self.cycle_interval)))
+            )
+
+        # Batched range queries: window and step in seconds, plus per-query limits
+        self.query_window = int(os.getenv("LABELING_QUERY_WINDOW", "300"))
+        self.query_step = int(os.getenv("LABELING_QUERY_STEP", "15"))
+        self.max_selector_length = int(os.getenv("LABELING_MAX_SELECTOR_LENGTH", "4000"))
+        self.max_batch_samples = int(os.getenv("LABELING_MAX_BATCH_SAMPLES", "500000"))
+        self.series_cardinality: Dict[str, int] = {}
+
+        # Shared HTTP session (one connection pool for all backends)
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
+        # Labels are re-emitted only on material change or heartbeat
+        self.label_state = LabelStateStore(
+            os.path.join(self.state_dir, "label-state.json"),
+            heartbeat_interval=int(os.getenv("LABELING_LABEL_HEARTBEAT", "3600"))
+        )
+
+        # Long-window per-series statistics, fed only with samples newer than the last cycle
+        self.series_stats = StreamingStatsStore(
+            os.path.join(self.state_dir, "series-stats.joblib"),
+            window=self.query_window,
+            ewma_alpha=float(os.getenv("LABELING_EWMA_ALPHA", "0.1")),
+            compression=float(os.getenv("LABELING_DIGEST_COMPRESSION", "100")),
+            retention=int(os.getenv("LABELING_SERIES_RETENTION", "86400")),
+            save_interval=int(os.getenv("LABELING_STATS_SAVE_INTERVAL", "300"))
+        )
+
+        # Optional Prometheus remote_write receiver; pulling can be turned off when it is used
+        self.remote_write_port = int(os.getenv("LABELING_REMOTE_WRITE_PORT", "0"))
+        self.pull_enabled = os.getenv("LABELING_PULL_ENABLED", "true").lower() != "false"
+        self.remote_write: Optional[RemoteWriteReceiver] = None
+        if self.remote_write_port:
+            self.remote_write = RemoteWriteReceiver(
+                self, port=self.remote_write_port,
+                label_interval=float(os.getenv("LABELING_PUSH_LABEL_INTERVAL", "5"))
+            )
+        self.labeling_lock = asyncio.Lock()
+        self.deferred = 0
+        self.fetch_in_flight = 0
+
+        # Stage timings, HTTP latencies and queue depths, served on LABELING_TELEMETRY_PORT
+        # and dumped as JSON after every cycle
+        self.telemetry = CycleTelemetry(
+            gauges=self.telemetry_gauges,
+            dump_path=os.getenv("LABELING_TELEMETRY_FILE", os.path.join(self.state_dir, "telemetry.json")),
+            port=int(os.getenv("LABELING_TELEMETRY_PORT", "0"))
+        )
+
+        # Label documents are written to Elasticsearch in _bulk batches
+        self.label_sink = BulkLabelSink(
+            self.elasticsearch_url, self.get_http_session,
+            max_docs=int(os.getenv("LABELING_BULK_MAX_DOCS", "500")),
+            max_bytes=int(os.getenv("LABELING_BULK_MAX_BYTES", str(5 * 1024 * 1024))),
+            flush_interval=float(os.getenv("LABELING_BULK_FLUSH_INTERVAL", "5")),
+            max_retries=int(os.getenv("LABELING_BULK_MAX_RETRIES", "3")),
+            max_backlog=int(os.getenv("LABELING_BULK_MAX_BACKLOG", "50000")),
+            telemetry=self.telemetry,
+            # Labels the sink gives up on are forgotten so they are emitted again
+            on_drop=self.label_state.discard
+        )
+
+        # Critical/high metrics get one Grafana region annotation per episode, extended in place
+        self.annotations = GrafanaAnnotationManager(
+            self.grafana_url, self.get_http_session,
+            path=os.path.join(self.state_dir, "annotations.json"),
+            api_key=os.getenv("GRAFANA_API_KEY"),
+            cooldown=float(os.getenv("LABELING_ANNOTATION_COOLDOWN", "900")),
+            extend_interval=float(os.getenv("LABELING_ANNOTATION_EXTEND_INTERVAL", "300")),
+            expire_after=float(os.getenv("LABELING_ANNOTATION_EXPIRE", str(3 * self.scheduler.min_interval))),
+            concurrency=int(os.getenv("LABELING_ANNOTATION_CONCURRENCY", "8")),
+            timeout=self.fetch_timeout,
+            telemetry=self.telemetry
+        )
+
+    async def get_http_session(self) -> aiohttp.ClientSession:
+        """Return the long-lived HTTP session, creating it on first use"""
+        if self.http_session is None or self.http_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.fetch_concurrency, keepalive_timeout=60)
+            self.http_session = aiohttp.ClientSession(connector=connector)
+        return self.http_session
+
+    async def close(self):
+        """Flush pending labels, then release pooled connections and worker processes"""
+        if self.remote_write:
+            await self.remote_write.stop()
+        await self.telemetry.stop()
+        await self.annotations.flush()
+        await self.label_sink.close()
+        self.label_state.save()
+        self.series_stats.save(force=True)
+        if self.http_session and not self.http_session.closed:
+            await self.http_session.close()
+        self.anomaly_models.save_index()
+        self.training_executor.shutdown(wait=False, cancel_futures=True)
+        self.compute_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def fetch_json(self, session: aiohttp.ClientSession, url: str,
+                         params: Optional[Dict] = None, backend: str = 'prometheus') -> Optional[Dict]:
+        """GET a JSON document with a per-request timeout and retries"""
+        _, data = await self.request_json(session, url, params, backend)
+        return data
+
+    async def request_json(self, session: aiohttp.ClientSession, url: str, params: Optional[Dict] = None,
+                           backend: str = 'prometheus') -> Tuple[int, Optional[Dict]]:
+        """Like fetch_json, but also return the final HTTP status (0 on network errors)"""
+        timeout = aiohttp.ClientTimeout(total=self.fetch_timeout)
+        status = 0
+
+        for attempt in range(self.fetch_retries + 1):
+            start = time.perf_counter()
+            self.fetch_in_flight += 1
+            try:
+                async with session.get(url, params=params, timeout=timeout) as response:
+                    status = response.status
+                    if status == 200:
+                        body = await response.read()
+                        self.telemetry.observe_request(backend, time.perf_counter() - start)
+                        return status, decode_json(body)
+                    self.telemetry.observe_request(backend, time.perf_counter() - start, ok=False)
+                    if status < 500 and status != 429:
+                        print(f"Request to {url} failed: {status}")
+                        return status, None
+                    error = f"HTTP {status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.telemetry.observe_request(backend, time.perf_counter() - start, ok=False)
+                status = 0
+                error = str(e) or type(e).__name__
+            finally:
+                self.fetch_in_flight -= 1
+
+            if attempt < self.fetch_retries:
+                await asyncio.sleep(0.5 * (2 ** attempt))
+
+        print(f"Request to {url} failed after {self.fetch_retries + 1} attempts: {error}")
+        return status, None
+
+    def plan_fetch_batches(self, metric_names: List[str]) -> List[List[str]]:
+        """Group metric names into regex selectors that fit URL and sample limits"""
+        points_per_series = self.query_window // self.query_step + 1
+        batches = []
+        batch: List[str] = []
+        selector_length = 0
+        batch_samples = 0
+
+        for name in metric_names:
+            if not METRIC_NAME_PATTERN.match(name):
+                continue
+
+            # Cardinality learned from earlier cycles, one series if unseen
+            samples = self.series_cardinality.get(name, 1) * points_per_series
+
+            if batch and (selector_length + len(name) + 1 > self.max_selector_length
+                          or batch_samples + samples > self.max_batch_samples):
+                batches.append(batch)
+                batch, selector_length, batch_samples = [], 0, 0
+
+            batch.append(name)
+            selector_length += len(name) + 1
+            batch_samples += samples
+
+        if batch:
+            batches.append(batch)
+
+        return batches
 
     async def fetch_metrics(self) -> List[Dict[str, Any]]:
         """Fetch all metrics from Prometheus"""
         try:
-            async with aiohttp.ClientSession() as session:
-                # Get all metric names
-                url = f"{self.prometheus_url}/api/v1/label/__name__/values"
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        metric_names = data.get('data', [])
-
-                        metrics = []
-                        for name in metric_names[:50]:  # Limit for performance
-                            metric_data = await self.fetch_metric_data(session, name)
-                            if metric_data:
-                                metrics.append(metric_data)
-
-                        return metrics
+            session = await self.get_http_session()
+
+            # Get all metric names
+            url = f"{self.prometheus_url}/api/v1/label/__name__/values"
+            with self.telemetry.stage('names'):
+                data = await self.fetch_json(session, url)
+                if data is None:
+                    return []
+                metric_names = [name for name in data.get('data', []) if self.owns_metric(name)]
+
+                # One range query per batch, at most fetch_concurrency requests in flight
+                batches = self.plan_fetch_batches(metric_names)
+            semaphore = asyncio.Semaphore(self.fetch_concurrency)
+            end = datetime.utcnow().timestamp()
+
+            async def fetch_bounded(batch: List[str]) -> List[Dict]:
+                # Only what is missing since the batch's last successful fetch
+                start = min(self.series_stats.fetch_start(name, end) for name in batch)
+                async with semaphore:
+                    metrics = await self.fetch_metric_batch(session, batch, start, end)
+                for metric in metrics:
+                    metric['fetch_end'] = end
+                return metrics
+
+            start_time = datetime.utcnow()
+            with self.telemetry.stage('fetch', len(batches)):
+                results = await asyncio.gather(*(fetch_bounded(batch) for batch in batches))
+            metrics = [metric for batch_metrics in results for metric in batch_metrics]
+            self.telemetry.count('metrics_fetched', len(metrics))
+            self.telemetry.count('samples_fetched', sum(len(metric['values']) for metric in metrics))
+
+            fetch_time = (datetime.utcnow() - start_time).total_seconds()
+            print(f"Fetched {len(metrics)}/{len(metric_names)} metrics in {len(batches)} "
+                  f"batched queries, {fetch_time:.2f} seconds")
+
+            return metrics
         except Exception as e:
             print(f"Error fetching metrics: {e}")
         return []
 
-    async def fetch_metric_data(self, session: aiohttp.ClientSession, metric_name: str) -> Optional[Dict]:
-        """Fetch specific metric data with values"""
+    async def fetch_metric_batch(self, session: aiohttp.ClientSession, metric_names: List[str],
+                                 start: float, end: float) -> List[Dict]:
+        """Fetch a batch of metrics with one range query and split it per metric"""
         try:
-            url = f"{self.prometheus_url}/api/v1/query"
-            params = {'query': f'{metric_name}[5m]'}
+            url = f"{self.prometheus_url}/api/v1/query_range"
+            params = {
+                'query': '{__name__=~"' + '|'.join(metric_names) + '"}',
+                'start': f"{start:.3f}",
+                'end': f"{end:.3f}",
+                'step': f"{self.query_step}s"
+            }
 
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    results = data.get('data', {}).get('result', [])
-
-                    if results:
-                        values = []
-                        labels = {}
-
-                        for result in results:
-                            metric_labels = result.get('metric', {})
-                            metric_values = result.get('values', [])
-
-                            labels.update(metric_labels)
-                            values.extend([float(v[1]) for v in metric_values])
-
-                        return {
-                            'name': metric_name,
-                            'labels': labels,
-                            'values': values,
-                            'timestamp': datetime.utcnow().isoformat()
-                        }
+            status, data = await self.request_json(session, url, params)
+            if data is None:
+                # 422/400 usually means a sample or size limit: retry both halves separately
+                if status in (400, 413, 414, 422) and len(metric_names) > 1:
+                    middle = len(metric_names) // 2
+                    first, second = await asyncio.gather(
+                        self.fetch_metric_batch(session, metric_names[:middle], start, end),
+                        self.fetch_metric_batch(session, metric_names[middle:], start, end)
+                    )
+                    return first + second
+                return []
+
+            grouped: Dict[str, List[Dict]] = {}
+            for result in data.get('data', {}).get('result', []):
+                name = result.get('metric', {}).get('__name__')
+                if name:
+                    grouped.setdefault(name, []).append(result)
+
+            metrics = []
+            timestamp = datetime.utcnow().isoformat()
+
+            # Samples go straight into one preallocated pair of float64 buffers per batch,
+            # laid out metric by metric; each metric gets views of its slice
+            total = sum(len(result.get('values', ())) for results in grouped.values() for result in results)
+            batch_timestamps = np.empty(total, dtype=np.float64)
+            batch_values = np.empty(total, dtype=np.float64)
+            position = 0
+
+            for name, results in grouped.items():
+                self.series_cardinality[name] = len(results)
+
+                start_position = position
+                series = []
+                labels = {}
+
+                for result in results:
+                    metric_labels = result.get('metric', {})
+                    pairs = result.get('values', [])
+                    count = len(pairs)
+
+                    labels.update(metric_labels)
+                    batch_timestamps[position:position + count] = np.fromiter(
+                        (pair[0] for pair in pairs), dtype=np.float64, count=count)
+                    batch_values[position:position + count] = np.fromiter(
+                        (pair[1] for pair in pairs), dtype=np.float64, count=count)
+                    position += count
+                    series.append((series_key(metric_labels), count))
+
+                metrics.append({
+                    'name': name,
+                    'labels': labels,
+                    'values': batch_values[start_position:position],
+                    'timestamps': batch_timestamps[start_position:position],
+                    'series': series,
+                    'timestamp': timestamp
+                })
+
+            return metrics
         except Exception as e:
-            print(f"Error fetching metric {metric_name}: {e}")
-        return None
+            print(f"Error fetching metric batch of {len(metric_names)}: {e}")
+        return []
 
-    def classify_metric_by_name(self, metric_name: str) -> Dict[str, Any]:
-        """Classify metric based on name patterns"""
-        name_lower = metric_name.lower()
-        classifications = {
-            'categories': [],
-            'type': 'unknown',
-            'unit': 'unknown',
-            'aggregation': 'avg'
-        }
+    def reload_categories(self, force: bool = False) -> bool:
+        """(Re)build the name classifier, picking up changes to LABELING_CATEGORIES_FILE
 
-        # Determine categories
-        for category, keywords in self.categories.items():
-            if any(keyword in name_lower for keyword in keywords):
-                classifications['categories'].append(category)
-
-        # Determine metric type
-        if any(x in name_lower for x in ['_total', '_count', 'counter']):
-            classifications['type'] = 'counter'
-            classifications['aggregation'] = 'sum'
-        elif any(x in name_lower for x in ['_gauge', 'current', 'usage']):
-            classifications['type'] = 'gauge'
-            classifications['aggregation'] = 'avg'
-        elif any(x in name_lower for x in ['_histogram', '_bucket']):
-            classifications['type'] = 'histogram'
-            classifications['aggregation'] = 'percentile'
-        elif any(x in name_lower for x in ['_summary']):
-            classifications['type'] = 'summary'
-            classifications['aggregation'] = 'percentile'
-
-        # Determine unit
-        if any(x in name_lower for x in ['bytes', 'size']):
-            classifications['unit'] = 'bytes'
-        elif any(x in name_lower for x in ['seconds', 'duration', 'time']):
-            classifications['unit'] = 'seconds'
-        elif any(x in name_lower for x in ['percent', 'ratio']):
-            classifications['unit'] = 'percent'
-        elif any(x in name_lower for x in ['count', 'total', 'number']):
-            classifications['unit'] = 'count'
-        elif any(x in name_lower for x in ['rate', 'per_second']):
-            classifications['unit'] = 'rate'
+        The file is a JSON object that may contain 'categories' (category ->
+        keywords), 'type_rules' ([type, aggregation, keywords]) and
+        'unit_rules' ([unit, keywords]). Rebuilding drops the memoized results.
+        """
+        if self.categories_file:
+            try:
+                mtime = os.path.getmtime(self.categories_file)
+                if force or mtime != self.categories_mtime:
+                    with open(self.categories_file) as f:
+                        tables = json.load(f)
+                    self.categories = tables.get('categories', self.categories)
+                    self.type_rules = [tuple(rule) for rule in tables.get('type_rules', self.type_rules)]
+                    self.unit_rules = [tuple(rule) for rule in tables.get('unit_rules', self.unit_rules)]
+                    self.categories_mtime = mtime
+                    force = True
+            except (OSError, ValueError) as e:
+                print(f"Error loading categories from {self.categories_file}: {e}")
+
+        if self.name_classifier is None or force:
+            self.name_classifier = MetricNameClassifier(
+                self.categories, self.type_rules, self.unit_rules, self.classifier_cache_size
+            )
+            return True
+        return False
 
-        return classifications
+    def classify_metric_by_name(self, metric_name: str) -> Dict[str, Any]:
+        """Classify metric based on name patterns"""
+        return self.name_classifier.classify(metric_name)
 
     def calculate_metric_statistics(self, values: List[float]) -> Dict[str, float]:
         """Calculate statistical properties of metric values"""
-        if not values:
+        if len(values) == 0:
             return {}
 
         values_array = np.array(values)
@@ -162,81 +2539,134 @@ class MetricLabelingEngine:
             'cv': float(np.std(values_array) / np.mean(values_array)) if np.mean(values_array) != 0 else 0
         }
 
-    def detect_anomalies(self, values: List[float]) -> Dict[str, Any]:
+    def compute_features(self, metrics: List[Dict[str, Any]]) -> List[Dict[str, float]]:
+        """Compute FEATURE_NAMES for every metric in one vectorized pass
+
+        All values are concatenated into one flat array with a segment id per
+        sample, so series of any length are reduced together with bincount
+        and a single segmented sort instead of per-metric NumPy calls.
+        Non-finite samples are masked out. Metrics without usable values get
+        an empty dict, matching calculate_metric_statistics.
+        """
+        n = len(metrics)
+        if n == 0:
+            return []
+
+        arrays = [np.asarray(metric.get('values', ()), dtype=np.float64) for metric in metrics]
+        lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=n)
+        flat = np.concatenate(arrays) if lengths.sum() else np.empty(0)
+        segments = np.repeat(np.arange(n), lengths)
+
+        finite = np.isfinite(flat)
+        flat = flat[finite]
+        segments = segments[finite]
+        counts = np.bincount(segments, minlength=n)
+        present = counts > 0
+        safe_counts = np.maximum(counts, 1)
+
+        # Moments
+        mean = np.bincount(segments, weights=flat, minlength=n) / safe_counts
+        centered = flat - mean[segments]
+        std = np.sqrt(np.bincount(segments, weights=centered ** 2, minlength=n) / safe_counts)
+        cv = np.divide(std, mean, out=np.zeros(n), where=mean != 0)
+
+        # Order statistics from one sort grouped by segment
+        order = np.lexsort((flat, segments))
+        sorted_values = flat[order]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        last = starts + np.maximum(counts - 1, 0)
+
+        def percentile(q: float) -> np.ndarray:
+            # Linear interpolation, same as np.percentile's default
+            position = (counts - 1).clip(min=0) * (q / 100.0)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            low_values = sorted_values[np.minimum(starts + low, len(sorted_values) - 1)] if len(sorted_values) else np.zeros(n)
+            high_values = sorted_values[np.minimum(starts + high, len(sorted_values) - 1)] if len(sorted_values) else np.zeros(n)
+            return low_values + (high_values - low_values) * (position - low)
+
+        minimum = sorted_values[np.minimum(starts, len(sorted_values) - 1)] if len(sorted_values) else np.zeros(n)
+        maximum = sorted_values[np.minimum(last, len(sorted_values) - 1)] if len(sorted_values) else np.zeros(n)
+
+        # Volatility: std of consecutive differences within each series
+        same_series = segments[1:] == segments[:-1]
+        diff_segments = segments[1:][same_series]
+        diffs = np.diff(flat)[same_series]
+        diff_counts = np.bincount(diff_segments, minlength=n)
+        safe_diff_counts = np.maximum(diff_counts, 1)
+        diff_mean = np.bincount(diff_segments, weights=diffs, minlength=n) / safe_diff_counts
+        volatility = np.sqrt(np.bincount(diff_segments, weights=(diffs - diff_mean[diff_segments]) ** 2,
+                                         minlength=n) / safe_diff_counts)
+
+        matrix = np.column_stack([
+            mean, percentile(50), std, minimum, maximum, percentile(95), percentile(99),
+            cv, volatility
+        ])
+
+        return [
+            dict(zip(FEATURE_NAMES, row)) if has_values else {}
+            for row, has_values in zip(matrix.tolist(), present.tolist())
+        ]
+
+    def detect_anomalies(self, values: List[float], metric_name: Optional[str] = None) -> Dict[str, Any]:
         """Detect anomalies in metric values using multiple methods"""
-        if len(values) < 10:
-            return {'has_anomalies': False, 'anomaly_score': 0}
-
-        values_array = np.array(values).reshape(-1, 1)
-
-        # Statistical method (Z-score)
-        z_scores = np.abs((values_array - np.mean(values_array)) / np.std(values_array))
-        statistical_anomalies = (z_scores > 3).flatten()
+        model = self.anomaly_models.get_model(metric_name) if metric_name else None
+        return score_anomalies(np.asarray(values, dtype=np.float64), model)
 
-        # Isolation Forest
-        if not self.anomaly_model:
-            self.anomaly_model = IsolationForest(contamination=0.1, random_state=42)
-
-        isolation_predictions = self.anomaly_model.fit_predict(values_array)
-        isolation_anomalies = isolation_predictions == -1
-
-        # Combine results
-        combined_anomalies = statistical_anomalies | isolation_anomalies
-        anomaly_indices = np.where(combined_anomalies)[0].tolist()
+    def load_clustering_model(self) -> MiniBatchKMeans:
+        """Restore the shape clusters from the last run, or start fresh"""
+        try:
+            if os.path.exists(self.clustering_model_path):
+                model = joblib.load(self.clustering_model_path)
+                if (model.n_clusters == self.shape_clusters
+                        and model.cluster_centers_.shape[1] == self.shape_points):
+                    return model
+        except Exception as e:
+            print(f"Error loading clustering model: {e}")
+        return MiniBatchKMeans(n_clusters=self.shape_clusters, random_state=42, n_init=3)
 
-        return {
-            'has_anomalies': len(anomaly_indices) > 0,
-            'anomaly_count': len(anomaly_indices),
-            'anomaly_indices': anomaly_indices,
-            'anomaly_score': len(anomaly_indices) / len(values) if values else 0,
-            'anomaly_values': [float(values[i]) for i in anomaly_indices]
-        }
+    def save_clustering_model(self):
+        if not hasattr(self.clustering_model, 'cluster_centers_'):
+            return
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            temp_path = f"{self.clustering_model_path}.tmp"
+            joblib.dump(self.clustering_model, temp_path)
+            os.replace(temp_path, self.clustering_model_path)
+        except OSError as e:
+            print(f"Error saving clustering model: {e}")
+
+    def window_end(self, metrics: List[Dict[str, Any]]) -> float:
+        """End of the labeling window the metrics were fetched for"""
+        end = max((metric.get('fetch_end', 0) for metric in metrics), default=0)
+        return end or datetime.utcnow().timestamp()
+
+    def metric_shapes(self, metrics: List[Dict[str, Any]]) -> Tuple[List[str], np.ndarray]:
+        """Metric names and shape vectors over the current labeling window"""
+        end = self.window_end(metrics)
+        matrix = resample_series(metrics, end - self.query_window, end, self.shape_points)
+        shapes, valid = shape_vectors(matrix)
+        metric_names = [metric['name'] for metric, keep in zip(metrics, valid.tolist()) if keep]
+        return metric_names, shapes
+
+    def group_clusters(self, metric_names: List[str], assignments: List[int]) -> Dict[str, List[str]]:
+        cluster_groups = {}
+        for metric_name, cluster_id in zip(metric_names, assignments):
+            cluster_groups.setdefault(f"cluster_{cluster_id}", []).append(metric_name)
+        return cluster_groups
 
     def cluster_metrics(self, metrics: List[Dict[str, Any]]) -> Dict[str, List[str]]:
-        """Cluster similar metrics together"""
-        if len(metrics) < 2:
+        """Cluster metrics with similar shapes together"""
+        metric_names, shapes = self.metric_shapes(metrics)
+        if not len(shapes):
             return {}
 
-        # Extract features for clustering
-        features = []
-        metric_names = []
-
-        for metric in metrics:
-            if metric.get('values'):
-                stats = self.calculate_metric_statistics(metric['values'])
-                feature_vector = [
-                    stats.get('mean', 0),
-                    stats.get('std', 0),
-                    stats.get('cv', 0),
-                    len(metric['values'])
-                ]
-                features.append(feature_vector)
-                metric_names.append(metric['name'])
-
-        if len(features) < 2:
-            return {}
-
-        # Scale features
-        features_scaled = self.scaler.fit_transform(features)
-
-        # Determine optimal number of clusters
-        n_clusters = min(5, len(features) // 2)
-
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        clusters = kmeans.fit_predict(features_scaled)
-
-        # Group metrics by cluster
-        cluster_groups = {}
-        for i, cluster_id in enumerate(clusters):
-            cluster_key = f"cluster_{cluster_id}"
-            if cluster_key not in cluster_groups:
-                cluster_groups[cluster_key] = []
-            cluster_groups[cluster_key].append(metric_names[i])
-
-        return cluster_groups
+        self.clustering_model, assignments = fit_shape_clusters(self.clustering_model, shapes,
+                                                                self.cluster_fit_rows)
+        return self.group_clusters(metric_names, assignments)
 
-    def assign_severity(self, metric: Dict[str, Any], anomaly_info: Dict[str, Any]) -> str:
+    def assign_severity(self, metric: Dict[str, Any], anomaly_info: Dict[str, Any],
+                        stats: Optional[Dict[str, float]] = None) -> str:
         """Assign severity level based on metric characteristics"""
         severity_score = 0
 
@@ -245,15 +2675,16 @@ class MetricLabelingEngine:
             severity_score += anomaly_info['anomaly_score'] * 50
 
         # Check metric statistics
-        if metric.get('values'):
-            stats = self.calculate_metric_statistics(metric['values'])
+        if len(metric.get('values', ())):
+            if stats is None:
+                stats = self.calculate_metric_statistics(metric['values'])
 
             # High coefficient of variation indicates instability
-            if stats['cv'] > 1:
+            if stats and stats['cv'] > 1:
                 severity_score += 20
 
             # Check if near limits (assuming percentage metrics)
-            if 'percent' in metric['name'].lower():
+            if stats and 'percent' in metric['name'].lower():
                 if stats['max'] > 90:
                     severity_score += 30
                 elif stats['max'] > 75:
@@ -275,22 +2706,29 @@ class MetricLabelingEngine:
 
         return 'info'
 
-    def generate_labels(self, metric: Dict[str, Any]) -> Dict[str, Any]:
+    def generate_labels(self, metric: Dict[str, Any],
+                        features: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
         """Generate comprehensive labels for a metric"""
-        # Get basic classification
-        classifications = self.classify_metric_by_name(metric['name'])
+        # Calculate statistics (shared with every labeler below)
+        if features is None:
+            features = self.compute_features([metric])[0]
 
-        # Calculate statistics
-        stats = self.calculate_metric_statistics(metric.get('values', []))
+        # Detect anomalies and behavior
+        anomaly_info = self.detect_anomalies(metric.get('values', []), metric['name'])
+        behavior = self.analyze_behavior(metric.get('values', []), features)
 
-        # Detect anomalies
-        anomaly_info = self.detect_anomalies(metric.get('values', []))
+        return self.build_labels(metric, features, anomaly_info, behavior)
 
-        # Assign severity
-        severity = self.assign_severity(metric, anomaly_info)
+    def build_labels(self, metric: Dict[str, Any], features: Dict[str, float],
+                     anomaly_info: Dict[str, Any], behavior: Dict[str, Any],
+                     cluster: Optional[str] = None) -> Dict[str, Any]:
+        """Assemble the label document from precomputed anomaly and behavior results"""
+        # Get basic classification
+        classifications = self.classify_metric_by_name(metric['name'])
+        stats = {name: features[name] for name in STATISTIC_NAMES} if features else {}
 
-        # Generate behavior label
-        behavior = self.analyze_behavior(metric.get('values', []))
+        # Assign severity
+        severity = self.assign_severity(metric, anomaly_info, stats)
 
         # Create comprehensive labels
         labels = {
@@ -301,51 +2739,37 @@ class MetricLabelingEngine:
             'anomalies': anomaly_info,
             'severity': severity,
             'behavior': behavior,
+            'cluster': cluster,
+            'baseline': self.series_stats.baseline(metric['name']),
             'original_labels': metric.get('labels', {}),
-            'auto_tags': self.generate_auto_tags(metric, classifications, anomaly_info),
-            'recommendations': self.generate_recommendations(metric, classifications, anomaly_info, severity)
+            'auto_tags': self.generate_auto_tags(metric, classifications, anomaly_info, stats),
+            'recommendations': self.generate_recommendations(metric, classifications, anomaly_info, severity, stats)
         }
 
         return labels
 
-    def analyze_behavior(self, values: List[float]) -> Dict[str, Any]:
+    def analyze_behavior(self, values: List[float],
+                         features: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
         """Analyze metric behavior patterns"""
-        if len(values) < 2:
-            return {'pattern': 'insufficient_data'}
-
-        values_array = np.array(values)
-
-        # Calculate trend
-        x = np.arange(len(values))
-        z = np.polyfit(x, values_array, 1)
-        slope = z[0]
-
-        # Determine pattern
-        pattern = 'stable'
-        if slope > 0.1:
-            pattern = 'increasing'
-        elif slope < -0.1:
-            pattern = 'decreasing'
-
-        # Check for periodicity (simple FFT)
-        if len(values) > 10:
-            fft = np.fft.fft(values_array)
-            frequencies = np.fft.fftfreq(len(values))
-
-            # Find dominant frequency
-            dominant_freq_idx = np.argmax(np.abs(fft[1:len(fft)//2])) + 1
-            dominant_freq = frequencies[dominant_freq_idx]
-
-            if np.abs(fft[dominant_freq_idx]) > np.mean(np.abs(fft)) * 2:
-                pattern = 'periodic'
-
-        return {
-            'pattern': pattern,
-            'trend_slope': float(slope),
-            'volatility': float(np.std(np.diff(values_array))) if len(values) > 1 else 0
-        }
-
-    def generate_auto_tags(self, metric: Dict, classifications: Dict, anomaly_info: Dict) -> List[str]:
+        values_array = np.asarray(values, dtype=np.float64)
+        if features:
+            volatility = features['volatility']
+        else:
+            volatility = float(np.std(np.diff(values_array))) if len(values_array) > 1 else 0.0
+        return analyze_behavior_batch(values_array[None, :], np.array([volatility]),
+                                      self.periodicity_threshold)[0]
+
+    def analyze_behaviors(self, metrics: List[Dict[str, Any]],
+                          features: List[Dict[str, float]]) -> List[Dict[str, Any]]:
+        """Behavior of every metric from one resampled matrix over the labeling window"""
+        end = self.window_end(metrics)
+        points = max(4, self.query_window // self.query_step)
+        matrix = resample_series(metrics, end - self.query_window, end, points)
+        volatility = np.array([row.get('volatility', 0.0) if row else 0.0 for row in features])
+        return analyze_behavior_batch(matrix, volatility, self.periodicity_threshold)
+
+    def generate_auto_tags(self, metric: Dict, classifications: Dict, anomaly_info: Dict,
+                           stats: Optional[Dict[str, float]] = None) -> List[str]:
         """Generate automatic tags based on analysis"""
         tags = []
 
@@ -365,17 +2789,19 @@ class MetricLabelingEngine:
                 tags.append('high_anomaly_rate')
 
         # Add behavior tags
-        if metric.get('values'):
-            stats = self.calculate_metric_statistics(metric['values'])
-            if stats['cv'] > 1:
+        if len(metric.get('values', ())):
+            if stats is None:
+                stats = self.calculate_metric_statistics(metric['values'])
+            if stats and stats['cv'] > 1:
                 tags.append('high_variability')
-            if stats['max'] > stats['mean'] * 2:
+            if stats and stats['max'] > stats['mean'] * 2:
                 tags.append('has_spikes')
 
         return list(set(tags))
 
     def generate_recommendations(self, metric: Dict, classifications: Dict,
-                                anomaly_info: Dict, severity: str) -> List[str]:
+                                anomaly_info: Dict, severity: str,
+                                stats: Optional[Dict[str, float]] = None) -> List[str]:
         """Generate actionable recommendations"""
         recommendations = []
 
@@ -391,9 +2817,10 @@ class MetricLabelingEngine:
             if 'memory' in classifications.get('categories', []):
                 recommendations.append("Check for memory leaks or increase memory allocation")
 
-        if classifications.get('type') == 'counter' and metric.get('values'):
-            stats = self.calculate_metric_statistics(metric['values'])
-            if stats['mean'] > 1000:
+        if classifications.get('type') == 'counter' and len(metric.get('values', ())):
+            if stats is None:
+                stats = self.calculate_metric_statistics(metric['values'])
+            if stats and stats['mean'] > 1000:
                 recommendations.append("High counter rate detected - verify if within expected range")
 
         if anomaly_info.get('anomaly_score', 0) > 0.3:
@@ -402,70 +2829,295 @@ class MetricLabelingEngine:
         return recommendations
 
     async def store_labels(self, labels: Dict[str, Any]):
-        """Store generated labels in Elasticsearch"""
-        try:
-            async with aiohttp.ClientSession() as session:
-                index_name = f"metric-labels-{datetime.utcnow().strftime('%Y.%m.%d')}"
-                url = f"{self.elasticsearch_url}/{index_name}/_doc"
+        """Queue generated labels for bulk indexing in Elasticsearch"""
+        index_name = f"metric-labels-{datetime.utcnow().strftime('%Y.%m.%d')}"
+        await self.label_sink.add(labels, index_name, labels.get('metric_name'))
+
+    def share_series(self, metrics: List[Dict[str, Any]]) -> Tuple[shared_memory.SharedMemory, List[Tuple[int, int]]]:
+        """Copy all series into one shared float64 block; return it with each series' [start, end)"""
+        ends = np.cumsum([len(metric.get('values', [])) for metric in metrics]).tolist()
+        bounds = list(zip([0] + ends[:-1], ends))
+        total = ends[-1] if ends else 0
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, total * 8))
+        flat = np.ndarray((total,), dtype=np.float64, buffer=shm.buf)
+        for metric, (start, end) in zip(metrics, bounds):
+            if end > start:
+                flat[start:end] = metric['values']
+        del flat
+
+        return shm, bounds
+
+    async def score_metrics(self, metrics: List[Dict[str, Any]]):
+        """Yield (index, anomaly_info) per metric as worker chunks complete"""
+        if not metrics:
+            return
 
-                async with session.post(url, json=labels) as response:
-                    if response.status not in [200, 201]:
-                        print(f"Failed to store labels: {response.status}")
-        except Exception as e:
-            print(f"Error storing labels: {e}")
+        chunk_size = max(1, min(self.compute_chunk_size, -(-len(metrics) // self.compute_workers)))
+        shm, bounds = self.share_series(metrics)
 
-    async def create_grafana_annotations(self, labels: Dict[str, Any]):
-        """Create Grafana annotations for important events"""
-        if labels['severity'] not in ['critical', 'high']:
-            return
+        offsets = range(0, len(metrics), chunk_size)
+        futures = [
+            self.compute_executor.submit(
+                label_series_chunk, shm.name, bounds[offset:offset + chunk_size],
+                [self.anomaly_models.model_source(metric['name']) for metric in metrics[offset:offset + chunk_size]]
+            )
+            for offset in offsets
+        ]
 
+        async def run_chunk(offset: int, future):
+            return offset, await asyncio.wrap_future(future)
+
+        tasks = [asyncio.ensure_future(run_chunk(offset, future)) for offset, future in zip(offsets, futures)]
         try:
-            async with aiohttp.ClientSession() as session:
-                annotation = {
-                    'dashboardId': 0,
-                    'panelId': 0,
-                    'time': int(datetime.utcnow().timestamp() * 1000),
-                    'timeEnd': 0,
-                    'tags': labels['auto_tags'],
-                    'text': f"{labels['metric_name']}: {labels['severity']} severity detected",
-                    'userId': 0
-                }
-
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': 'Bearer YOUR_API_KEY'  # Replace with actual API key
-                }
-
-                url = f"{self.grafana_url}/api/annotations"
-                async with session.post(url, json=annotation, headers=headers) as response:
-                    if response.status not in [200, 201]:
-                        print(f"Failed to create annotation: {response.status}")
-        except Exception as e:
-            print(f"Error creating annotation: {e}")
+            for next_chunk in asyncio.as_completed(tasks):
+                offset, results = await next_chunk
+                for i, anomaly_info in enumerate(results):
+                    yield offset + i, anomaly_info
+        finally:
+            # Workers attach to the block by name, so it may only go once no chunk can still
+            # run: drop queued chunks, then wait for the ones already running
+            for task in tasks:
+                task.cancel()
+            for future in futures:
+                future.cancel()
+            running = [future for future in futures if not future.done()]
+            try:
+                if running:
+                    await asyncio.wait([asyncio.wrap_future(future) for future in running])
+                for future in running:
+                    if not future.cancelled() and future.exception() is not None:
+                        print(f"Abandoned anomaly scoring chunk failed: {future.exception()}")
+            finally:
+                shm.close()
+                shm.unlink()
 
     async def process_metrics(self):
         """Main processing loop for metric labeling"""
         print("Starting metric labeling process...")
 
+        if self.reload_categories():
+            print("Reloaded metric category tables")
+
+        self.rebalance_shards()
+
         # Fetch metrics
         metrics = await self.fetch_metrics()
         print(f"Fetched {len(metrics)} metrics")
 
-        # Generate labels for each metric
-        all_labels = []
-        for metric in metrics:
-            labels = self.generate_labels(metric)
-            all_labels.append(labels)
+        # Fold new samples into the streaming statistics and rebuild each metric's labeling
+        # window from them; model baselines are extended with the same new samples
+        with self.telemetry.stage('stats', len(metrics)):
+            for metric in metrics:
+                new_values, new_timestamps = self.series_stats.ingest(metric, metric.get('fetch_end', 0))
+                self.anomaly_models.observe(metric['name'], new_values, new_timestamps)
+
+        all_labels = await self.label_metrics(metrics)
+        self.telemetry.count('metrics_deferred', self.deferred)
+
+        schedule = self.scheduler.get_stats()
+        print(f"Evaluated {len(all_labels)} of {len(metrics)} metrics, {self.deferred} deferred; "
+              f"{schedule['at_min_interval']} at the minimum interval, mean interval "
+              f"{schedule['mean_interval']:.0f}s")
+
+        emission = self.label_state.get_stats()['cycle']
+        print(f"Label emission: {emission['emitted']} emitted ({emission['new']} new, "
+              f"{emission['changed']} changed, {emission['heartbeat']} heartbeat), "
+              f"{emission['suppressed']} suppressed ({emission['suppression_ratio']:.1%})")
+
+        sink = self.label_sink.get_stats()
+        print(f"Label sink: {sink['indexed']} indexed, {sink['failed']} failed, {sink['retried']} retried, "
+              f"backlog {sink['backlog']} docs; flush latency avg {sink['avg_flush_latency'] * 1000:.0f}ms, "
+              f"max {sink['max_flush_latency'] * 1000:.0f}ms")
+
+        annotations = self.annotations.get_stats()
+        print(f"Annotations: {annotations['open']} open regions, {annotations['opened']} opened, "
+              f"{annotations['extended']} extended, {annotations['closed']} closed, "
+              f"{annotations['coalesced']} coalesced, {annotations['writes']} writes")
 
-            # Store labels
-            await self.store_labels(labels)
+        # Generate summary
+        summary = self.generate_summary(all_labels)
+        print(f"Summary: {json.dumps(summary, indent=2)}")
+
+        return all_labels
+
+    def telemetry_gauges(self) -> Dict[str, float]:
+        """Current queue and backlog depths for the telemetry export"""
+        sink = self.label_sink.get_stats()
+        return {
+            'fetch_in_flight': self.fetch_in_flight,
+            'label_sink_docs': sink['backlog'],
+            'label_sink_bytes': sink['backlog_bytes'],
+            'remote_write_pending': len(self.remote_write.pending) if self.remote_write else 0,
+            'annotation_writes': len(self.annotations.pending),
+            'training_jobs': len(self.anomaly_models.training),
+            'scheduled_metrics': len(self.scheduler.schedule),
+            'deferred_metrics': self.deferred
+        }
+
+    def owns_metric(self, metric_name: str) -> bool:
+        return self.shard is None or self.shard.owns(metric_name)
+
+    def rebalance_shards(self):
+        """Import state handed to this instance, then hand off metrics it no longer owns"""
+        if self.shard is None:
+            return
+
+        self.shard.heartbeat()
+        for payload in self.shard.read_handoffs():
+            try:
+                self.series_stats.import_state(payload.get('series_stats', {}))
+                self.anomaly_models.import_state(payload.get('anomaly_models', {}))
+                self.label_state.import_state(payload.get('label_state', {}))
+            except (AttributeError, KeyError, TypeError) as e:
+                print(f"Error importing shard handoff: {e}")
+                continue
+            print(f"Imported state for {len(payload.get('series_stats', {}))} metrics from another shard")
+
+        if not self.shard.refresh():
+            return
+        if not self.shard.directory:
+            # Nowhere to hand state to; keep it in case the metrics move back
+            print(f"Shard members: {', '.join(self.shard.ring.members)}; no handoff directory, state kept")
+            return
 
-            # Create annotations for critical metrics
-            await self.create_grafana_annotations(labels)
+        known = (set(self.series_stats.metric_series) | set(self.anomaly_models.history)
+                 | set(self.anomaly_models.index) | set(self.label_state.state))
+        moved: Dict[str, List[str]] = {}
+        for metric_name in known:
+            owner = self.shard.owner(metric_name)
+            if owner != self.shard.instance_id:
+                moved.setdefault(owner, []).append(metric_name)
+
+        for owner, names in moved.items():
+            payload = {
+                'series_stats': self.series_stats.export(names),
+                'anomaly_models': self.anomaly_models.export(names),
+                'label_state': self.label_state.export(names)
+            }
+            if not self.shard.write_handoff(owner, payload):
+                print(f"Dropped state for {len(names)} metrics now owned by {owner}")
+
+        print(f"Shard members: {', '.join(self.shard.ring.members)}; handed off "
+              f"{sum(len(names) for names in moved.values())} of {len(known)} metrics")
+
+    def ingest_pushed_series(self, series: List[Tuple[Dict[str, str], List[float], List[float]]],
+                             now: float) -> Dict[str, Dict[str, str]]:
+        """Fold remote_write samples into the series windows; return labels per metric touched"""
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for labels, timestamps, values in series:
+            name = labels['__name__']
+            if not self.owns_metric(name):
+                continue
+            metric = grouped.setdefault(name, {'name': name, 'labels': {}, 'values': [],
+                                               'timestamps': [], 'series': []})
+            metric['labels'].update(labels)
+            metric['values'].extend(values)
+            metric['timestamps'].extend(timestamps)
+            metric['series'].append((series_key(labels), len(values)))
+
+        for name, metric in grouped.items():
+            new_values, new_timestamps = self.series_stats.ingest(metric, now)
+            self.anomaly_models.observe(name, new_values, new_timestamps)
+
+        return {name: metric['labels'] for name, metric in grouped.items()}
+
+    async def label_pushed_metrics(self, pending: Dict[str, Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Label metrics that received remote_write data since the last batch"""
+        now = datetime.utcnow().timestamp()
+        timestamp = datetime.utcnow().isoformat()
+        metrics = []
+        for name, labels in pending.items():
+            values, timestamps = self.series_stats.window_samples(name)
+            if len(values):
+                metrics.append({'name': name, 'labels': labels, 'values': values, 'timestamps': timestamps,
+                                'timestamp': timestamp, 'fetch_end': now})
+
+        return await self.label_metrics(metrics, store_clusters=False)
+
+    async def label_metrics(self, metrics: List[Dict[str, Any]],
+                            store_clusters: bool = True) -> List[Dict[str, Any]]:
+        """Label the due metrics among those given, emitting changed labels"""
+        # Pull cycles and remote_write batches share the clustering model, label state and schedule
+        async with self.labeling_lock:
+            # Next due times count from here; a little slack keeps metrics due just after
+            # this point from slipping a whole cycle
+            now = datetime.utcnow().timestamp()
+            due = set(self.scheduler.take_due((metric['name'] for metric in metrics),
+                                              now + min(5.0, self.cycle_interval / 10), self.max_evaluations))
+            self.deferred = len(metrics) - len(due)
+            return await self._label_metrics([metric for metric in metrics if metric['name'] in due],
+                                             store_clusters, now)
+
+    async def _label_metrics(self, metrics: List[Dict[str, Any]], store_clusters: bool,
+                             started: float) -> List[Dict[str, Any]]:
+        scheduled = self.anomaly_models.schedule_training()
+        if scheduled:
+            print(f"Scheduled {scheduled} anomaly model trainings")
+
+        telemetry = self.telemetry
+
+        # Compute the shared feature matrix once per cycle
+        with telemetry.stage('stats', len(metrics)):
+            features = self.compute_features(metrics)
+
+        loop = asyncio.get_running_loop()
+
+        # Behavior for all metrics at once over a common time grid
+        with telemetry.stage('behavior', len(metrics)):
+            behaviors = self.analyze_behaviors(metrics, features)
+
+        # Clustering only needs the shape vectors, so it runs alongside labeling
+        with telemetry.stage('clustering'):
+            metric_names, shapes = self.metric_shapes(metrics)
+            cluster_future = None
+            if len(shapes):
+                cluster_future = loop.run_in_executor(self.compute_executor, fit_shape_clusters,
+                                                      self.clustering_model, shapes, self.cluster_fit_rows)
+
+        # Store labels as worker chunks finish, while the rest are still computing
+        self.label_state.start_cycle()
+        all_labels = [None] * len(metrics)
+        clusters: Dict[str, List[str]] = {}
+        cluster_of: Dict[str, str] = {}
+        # Closed explicitly so an error here cannot leave scoring chunks queued behind it
+        scores = telemetry.timed('anomaly', self.score_metrics(metrics))
+        try:
+            async for index, anomaly_info in scores:
+                # Clustering was queued first, so it is normally done by the first chunk
+                if cluster_future is not None:
+                    with telemetry.stage('clustering', len(metric_names)):
+                        self.clustering_model, assignments = await cluster_future
+                        clusters = self.group_clusters(metric_names, assignments)
+                        cluster_of = {name: key for key, names in clusters.items() for name in names}
+                    cluster_future = None
+
+                with telemetry.stage('labels', 1):
+                    metric = metrics[index]
+                    labels = self.build_labels(metric, features[index], anomaly_info, behaviors[index],
+                                               cluster_of.get(metric['name']))
+                    all_labels[index] = labels
+
+                    # Skip metrics whose labels have not materially changed since the last emission
+                    reason = self.label_state.check(labels)
+                    self.scheduler.reschedule(labels, reason in ('new', 'changed'), started)
+
+                # Annotation regions follow every evaluation, not just emitted labels
+                with telemetry.stage('annotate'):
+                    self.annotations.observe(labels, started)
+                if not reason:
+                    telemetry.count('labels_suppressed')
+                    continue
+                telemetry.count('labels_emitted')
+
+                # Store labels
+                with telemetry.stage('store', 1):
+                    await self.store_labels(labels)
+        finally:
+            await scores.aclose()
 
         # Cluster metrics
-        if metrics:
-            clusters = self.cluster_metrics(metrics)
+        if metrics and store_clusters:
             print(f"Created {len(clusters)} metric clusters")
 
             # Store cluster information
@@ -476,9 +3128,14 @@ class MetricLabelingEngine:
             }
             await self.store_labels({'type': 'cluster_analysis', 'data': cluster_info})
 
-        # Generate summary
-        summary = self.generate_summary(all_labels)
-        print(f"Summary: {json.dumps(summary, indent=2)}")
+        with telemetry.stage('annotate', len(self.annotations.pending)):
+            await self.annotations.flush(started)
+
+        with telemetry.stage('store'):
+            self.anomaly_models.save_index()
+            self.label_state.save()
+            self.series_stats.save()
+            self.save_clustering_model()
 
         return all_labels
 
@@ -514,26 +3171,66 @@ class MetricLabelingEngine:
         """Main execution loop"""
         print("Metric Labeling Engine started")
 
-        while True:
+        # SIGTERM/SIGINT end the loop after the current cycle so buffered labels get flushed
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
             try:
-                start_time = datetime.utcnow()
-
-                # Process metrics
-                await self.process_metrics()
-
-                # Calculate processing time
-                processing_time = (datetime.utcnow() - start_time).total_seconds()
-                print(f"Processing completed in {processing_time:.2f} seconds")
-
-                # Wait before next iteration
-                await asyncio.sleep(60)  # Run every minute
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
 
-            except KeyboardInterrupt:
-                print("Shutting down Metric Labeling Engine")
-                break
-            except Exception as e:
-                print(f"Error in main loop: {e}")
-                await asyncio.sleep(30)
+        try:
+            # Join the shard ring before accepting pushes
+            self.rebalance_shards()
+            if self.remote_write:
+                await self.remote_write.start()
+            await self.telemetry.start()
+
+            while not stop.is_set():
+                try:
+                    self.telemetry.start_cycle()
+
+                    # Process metrics (pushed metrics are labeled by the receiver as they arrive)
+                    if self.pull_enabled:
+                        await self.process_metrics()
+                    else:
+                        self.reload_categories()
+                        self.rebalance_shards()
+                        self.series_stats.save()
+                        stats = self.remote_write.stats if self.remote_write else {}
+                        print(f"Remote write: {stats.get('requests', 0)} requests, {stats.get('samples', 0)} "
+                              f"samples, {stats.get('labeled', 0)} metrics labeled")
+
+                    # Calculate processing time
+                    processing_time = self.telemetry.end_cycle(self.cycle_interval)
+                    print(f"Processing completed in {processing_time:.2f} seconds")
+                    slowest = self.telemetry.slowest_stages()
+                    if slowest:
+                        print("Slowest stages: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest))
+                    if processing_time > self.cycle_interval:
+                        print(f"Warning: cycle exceeded {self.cycle_interval}s budget")
+
+                    # Wait out the rest of the cycle
+                    delay = max(0, self.cycle_interval - processing_time)
+                except Exception as e:
+                    print(f"Error in main loop: {e}")
+                    delay = 30
+
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            print("Shutting down Metric Labeling Engine")
+        finally:
+            # Also reached when the task is cancelled, e.g. by asyncio.run on Ctrl+C
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            await self.close()
 
 async def main():
     engine = MetricLabelingEngine()
@@ -12,8 +12,15 @@ import struct
 from datetime import datetime
 import sys
 import signal
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
+from array import array
 import os
+import mmap
+import bisect
+import queue
+import zlib
+
+from terminal_dashboard import TerminalScreen, AdaptiveRefresh
 
 # Colors
 class Colors:
@@ -27,23 +34,262 @@ class Colors:
     WHITE = '\033[1;37m'
     NC = '\033[0m'
 
+# Upper bound on the number of sessions tracked individually
+SESSION_TRACKER_CAPACITY = 256
+
+# How long one `ss` listing of the port's connections is reused
+CONNECTION_CACHE_TTL = 2.0
+
+# Frame direction relative to the packet server
+DIRECTION_UNKNOWN = 0
+DIRECTION_REQUEST = 1
+DIRECTION_RESPONSE = 2
+RESPONSE_TYPES = ('res', 'ack', 'error')
+
+class SessionHeavyHitters:
+    """Space-Saving top-K tracker for per-session packet counts and bytes
+
+    Memory is fixed at `capacity` entries regardless of how many session ids
+    are seen. Counts live in a stream-summary (count -> sessions) so every
+    update and eviction is O(1). Counts of evicted-and-replaced sessions are
+    overestimated by at most `error`; byte volume is counted from the moment
+    a session started being tracked.
+    """
+
+    def __init__(self, capacity=SESSION_TRACKER_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.bytes = {}
+        self.rtt = {}  # session_id -> [count, total]
+        self.buckets = {}  # count -> {session_id: None}, insertion ordered
+        self.min_count = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, session_id):
+        return session_id in self.counts
+
+    def _bucket_add(self, session_id, count):
+        self.buckets.setdefault(count, {})[session_id] = None
+
+    def _bucket_remove(self, session_id, count):
+        bucket = self.buckets[count]
+        del bucket[session_id]
+        if not bucket:
+            del self.buckets[count]
+
+    def add(self, session_id, size=0):
+        """Record one packet of `size` bytes for a session"""
+        count = self.counts.get(session_id)
+
+        if count is not None:
+            self._bucket_remove(session_id, count)
+            self.counts[session_id] = count + 1
+            self._bucket_add(session_id, count + 1)
+            self.bytes[session_id] += size
+            if count == self.min_count and self.min_count not in self.buckets:
+                self.min_count = count + 1
+            return
+
+        if len(self.counts) < self.capacity:
+            self.counts[session_id] = 1
+            self.errors[session_id] = 0
+            self.bytes[session_id] = size
+            self.rtt[session_id] = [0, 0.0]
+            self._bucket_add(session_id, 1)
+            self.min_count = 1
+            return
+
+        # Replace the oldest session among those with the minimum count
+        min_count = self.min_count
+        victim = next(iter(self.buckets[min_count]))
+        self._bucket_remove(victim, min_count)
+        del self.counts[victim]
+        del self.errors[victim]
+        del self.bytes[victim]
+        del self.rtt[victim]
+        self.evictions += 1
+
+        self.counts[session_id] = min_count + 1
+        self.errors[session_id] = min_count
+        self.bytes[session_id] = size
+        self.rtt[session_id] = [0, 0.0]
+        self._bucket_add(session_id, min_count + 1)
+        if min_count not in self.buckets:
+            self.min_count = min_count + 1
+
+    def add_rtt(self, session_id, rtt):
+        """Attribute a measured round trip to a session if it is tracked"""
+        totals = self.rtt.get(session_id)
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += rtt
+
+    def top(self, k=5):
+        """Return the `k` heaviest sessions as dicts, highest count first"""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            {
+                'session': session_id,
+                'packets': count,
+                'error': self.errors[session_id],
+                'bytes': self.bytes[session_id],
+                'avg_rtt': self.rtt[session_id][1] / self.rtt[session_id][0] if self.rtt[session_id][0] else None
+            }
+            for session_id, count in ranked
+        ]
+
+# Requests waiting for a response; the oldest are dropped beyond this
+CORRELATION_TABLE_SIZE = 4096
+# Requests unanswered for this long are counted as timeouts
+CORRELATION_TIMEOUT = 30.0
+
+class RequestResponseCorrelator:
+    """Pair response frames with the requests that caused them
+
+    Responses carrying `reply_to` are matched by packet_id; older servers
+    answer serially per connection, so responses without it are matched to
+    the oldest outstanding request on the same connection. The pending table
+    is bounded and entries older than `timeout` are expired as timeouts.
+    """
+
+    def __init__(self, max_pending=CORRELATION_TABLE_SIZE, timeout=CORRELATION_TIMEOUT):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = OrderedDict()  # (connection, packet_id) -> (timestamp, type, session)
+        self.fifo = defaultdict(deque)  # connection -> packet_ids in send order
+        self.by_type = defaultdict(lambda: [0, 0.0, 0.0])  # type -> [count, sum, max]
+        self.matched = 0
+        self.timeouts = 0
+        self.evicted = 0
+        self.orphan_responses = 0
+
+    def on_request(self, connection, packet_id, packet_type, session_id, timestamp):
+        key = (connection, packet_id)
+        if len(self.pending) >= self.max_pending:
+            self._drop(*self.pending.popitem(last=False))
+            self.evicted += 1
+
+        self.pending[key] = (timestamp, packet_type, session_id)
+        self.fifo[connection].append(packet_id)
+
+    def on_response(self, connection, reply_to, timestamp):
+        """Return (rtt, request_type, request_session) or None if unmatched"""
+        queue = self.fifo.get(connection)
+
+        if reply_to is not None:
+            entry = self.pending.pop((connection, reply_to), None)
+            if entry is not None and queue:
+                # Usually the head; anything else is an out-of-order answer
+                if queue[0] == reply_to:
+                    queue.popleft()
+                else:
+                    queue.remove(reply_to)
+        else:
+            entry = None
+            while queue and entry is None:
+                entry = self.pending.pop((connection, queue.popleft()), None)
+
+        if queue is not None and not queue:
+            del self.fifo[connection]
+
+        if entry is None:
+            self.orphan_responses += 1
+            return None
+
+        request_time, packet_type, session_id = entry
+        rtt = max(0.0, timestamp - request_time)
+
+        self.matched += 1
+        totals = self.by_type[packet_type]
+        totals[0] += 1
+        totals[1] += rtt
+        totals[2] = max(totals[2], rtt)
+
+        return rtt, packet_type, session_id
+
+    def expire(self, now=None):
+        """Count and drop requests that have waited longer than the timeout"""
+        cutoff = (now if now is not None else time.time()) - self.timeout
+        while self.pending:
+            key, entry = next(iter(self.pending.items()))
+            if entry[0] >= cutoff:
+                break
+            del self.pending[key]
+            self._drop(key, entry)
+            self.timeouts += 1
+
+    def _drop(self, key, entry):
+        connection, packet_id = key
+        queue = self.fifo.get(connection)
+        if queue:
+            try:
+                queue.remove(packet_id)
+            except ValueError:
+                pass
+            if not queue:
+                del self.fifo[connection]
+
+    def close_connection(self, connection):
+        """Count everything still outstanding on a closed connection as unanswered"""
+        for packet_id in self.fifo.pop(connection, ()):
+            if self.pending.pop((connection, packet_id), None) is not None:
+                self.timeouts += 1
+
+    def get_stats(self):
+        return {
+            'matched': self.matched,
+            'pending': len(self.pending),
+            'timeouts': self.timeouts,
+            'evicted': self.evicted,
+            'orphan_responses': self.orphan_responses,
+            'by_type': {
+                packet_type: {'count': count, 'avg': total / count, 'max': peak}
+                for packet_type, (count, total, peak) in self.by_type.items() if count
+            }
+        }
+
 class PacketStats:
     """Packet statistics tracker"""
 
-    def __init__(self):
+    def __init__(self, session_capacity=SESSION_TRACKER_CAPACITY):
         self.total_packets = 0
         self.packet_types = defaultdict(int)
-        self.sessions = defaultdict(int)
+        self.sessions = SessionHeavyHitters(session_capacity)
         self.data_volume = 0
         self.start_time = time.time()
         self.recent_packets = deque(maxlen=100)
         self.errors = 0
         self.response_times = deque(maxlen=50)
+        self.correlator = RequestResponseCorrelator()
+
+    def add_frame(self, packet_type, session_id, size, connection,
+                  packet_id=None, reply_to=None, timestamp=None):
+        """Record an observed frame, pairing responses with their requests
+
+        Returns the measured round-trip time for responses, otherwise None.
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        response_time = None
+
+        if packet_type in RESPONSE_TYPES:
+            match = self.correlator.on_response(connection, reply_to, timestamp)
+            if match:
+                response_time, _, request_session = match
+                self.sessions.add_rtt(request_session, response_time)
+        else:
+            self.correlator.on_request(connection, packet_id, packet_type, session_id, timestamp)
+
+        self.add_packet(packet_type, session_id, size, response_time)
+        return response_time
 
     def add_packet(self, packet_type, session_id, size, response_time=None):
         self.total_packets += 1
         self.packet_types[packet_type] += 1
-        self.sessions[session_id] += 1
+        self.sessions.add(session_id, size)
         self.data_volume += size
 
         packet_info = {
@@ -55,10 +301,11 @@ class PacketStats:
         }
         self.recent_packets.append(packet_info)
 
-        if response_time:
+        if response_time is not None:
             self.response_times.append(response_time)
 
     def get_stats(self):
+        self.correlator.expire()
         uptime = time.time() - self.start_time
         packets_per_sec = self.total_packets / uptime if uptime > 0 else 0
         avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
@@ -69,11 +316,49 @@ class PacketStats:
             'packets_per_sec': packets_per_sec,
             'data_volume_kb': self.data_volume / 1024,
             'packet_types': dict(self.packet_types),
-            'active_sessions': len([s for s in self.sessions if self.sessions[s] > 0]),
+            'active_sessions': len(self.sessions),
+            'session_evictions': self.sessions.evictions,
+            'top_talkers': self.sessions.top(5),
             'avg_response_time': avg_response_time,
+            'correlation': self.correlator.get_stats(),
             'errors': self.errors
         }
 
+def print_traffic_summary(stats):
+    """Print overview, packet type and top talker sections for a stats dict"""
+    # Overview stats
+    print(f"\n{Colors.CYAN}📊 Traffic Overview:{Colors.NC}")
+    print(f"  Total Packets: {Colors.WHITE}{stats['total_packets']}{Colors.NC}")
+    print(f"  Uptime: {Colors.WHITE}{stats['uptime']:.1f}s{Colors.NC}")
+    print(f"  Rate: {Colors.WHITE}{stats['packets_per_sec']:.1f} pkt/sec{Colors.NC}")
+    print(f"  Data Volume: {Colors.WHITE}{stats['data_volume_kb']:.1f} KB{Colors.NC}")
+    print(f"  Active Sessions: {Colors.WHITE}{stats['active_sessions']}{Colors.NC}")
+    print(f"  Avg Response: {Colors.WHITE}{stats['avg_response_time']:.3f}s{Colors.NC}")
+
+    # Packet type breakdown
+    print(f"\n{Colors.CYAN}📦 Packet Types:{Colors.NC}")
+    for packet_type, count in stats['packet_types'].items():
+        percentage = (count / stats['total_packets'] * 100) if stats['total_packets'] > 0 else 0
+        print(f"  {packet_type:8} {Colors.WHITE}{count:4d}{Colors.NC} ({percentage:5.1f}%)")
+
+    # Top talkers
+    print(f"\n{Colors.CYAN}🏆 Top Talkers:{Colors.NC}")
+    for talker in stats['top_talkers']:
+        session = talker['session'][:12] if talker['session'] else "global"
+        approx = f" ±{talker['error']}" if talker['error'] else ""
+        rtt = f"  rtt {talker['avg_rtt']:.3f}s" if talker.get('avg_rtt') is not None else ""
+        print(f"  {session:12} {Colors.WHITE}{talker['packets']:6d}{Colors.NC} pkts{approx}"
+              f"  {talker['bytes'] / 1024:8.1f} KB{rtt}")
+
+def print_correlation_summary(correlation):
+    """Print per-type round-trip times and request/response pairing counters"""
+    for packet_type, rtt in sorted(correlation['by_type'].items()):
+        print(f"    {packet_type:8} {Colors.WHITE}{rtt['count']:6d}{Colors.NC} "
+              f"avg={rtt['avg']:.3f}s max={rtt['max']:.3f}s")
+    print(f"  Matched: {correlation['matched']} | Pending: {correlation['pending']} | "
+          f"Timeouts: {correlation['timeouts']} | Evicted: {correlation['evicted']} | "
+          f"Orphan Responses: {correlation['orphan_responses']}")
+
 class PacketSniffer:
     """Raw packet sniffer for TS protocol"""
 
@@ -82,6 +367,9 @@ class PacketSniffer:
         self.running = False
         self.stats = PacketStats()
         self.packet_handlers = []
+        self.simulated_responses = []  # heap of (due time, request packet_id, session, connection)
+        self.connections = []
+        self.connections_checked = 0
 
     def add_handler(self, handler):
         """Add packet handler function"""
@@ -126,33 +414,60 @@ class PacketSniffer:
                 time.sleep(1)
 
     def get_active_connections(self):
-        """Get active connections on our port"""
+        """Get active connections on our port, re-running `ss` at most every CONNECTION_CACHE_TTL"""
+        now = time.monotonic()
+        if now - self.connections_checked < CONNECTION_CACHE_TTL:
+            return self.connections
+
         try:
             result = os.popen(f"ss -tn sport = :{self.port}").read()
             lines = result.strip().split('\n')[1:]  # Skip header
-            return [line for line in lines if line.strip()]
+            self.connections = [line for line in lines if line.strip()]
         except:
-            return []
+            self.connections = []
+        self.connections_checked = now
+        return self.connections
+
+    def observe_frame(self, packet_type, session_id, size, connection,
+                      packet_id=None, reply_to=None, timestamp=None):
+        """Feed one observed frame through stats and handlers"""
+        response_time = self.stats.add_frame(
+            packet_type, session_id, size, connection, packet_id, reply_to, timestamp
+        )
+
+        # Notify handlers
+        for handler in self.packet_handlers:
+            handler(packet_type, session_id, size, response_time)
 
     def simulate_packet_detection(self, connection):
         """Simulate packet detection from connection data"""
         # This is a simplified simulation since we can't easily intercept packets
         # In a real implementation, this would parse actual network traffic
 
-        packet_types = ['cmd', 'res', 'list', 'create', 'kill']
+        request_types = ['cmd', 'list', 'create', 'kill']
         import random
+        import heapq
+
+        now = time.time()
+
+        # Deliver simulated server responses that are due
+        while self.simulated_responses and self.simulated_responses[0][0] <= now:
+            due, packet_id, session_id, origin = heapq.heappop(self.simulated_responses)
+            self.observe_frame('res', session_id, random.randint(100, 500), origin,
+                               reply_to=packet_id, timestamp=due)
 
         if random.random() < 0.3:  # 30% chance of detecting a packet
-            packet_type = random.choice(packet_types)
+            packet_type = random.choice(request_types)
             session_id = f"session-{random.randint(1,5)}"
             size = random.randint(100, 500)
-            response_time = random.uniform(0.01, 0.1)
+            packet_id = f"{int(now * 1000)}_{random.getrandbits(32)}"
 
-            self.stats.add_packet(packet_type, session_id, size, response_time)
+            self.observe_frame(packet_type, session_id, size, connection,
+                               packet_id=packet_id, timestamp=now)
 
-            # Notify handlers
-            for handler in self.packet_handlers:
-                handler(packet_type, session_id, size, response_time)
+            if random.random() < 0.95:  # a few requests never get an answer
+                due = now + random.uniform(0.01, 0.1)
+                heapq.heappush(self.simulated_responses, (due, packet_id, session_id, connection))
 
 class RealTimeAnalyzer:
     """Real-time packet traffic analyzer"""
@@ -161,6 +476,8 @@ class RealTimeAnalyzer:
         self.sniffer = PacketSniffer()
         self.display_thread = None
         self.running = False
+        self.screen = TerminalScreen()
+        self.refresh = AdaptiveRefresh(min_interval=0.25, max_interval=2.0)
 
         # Add our handler to the sniffer
         self.sniffer.add_handler(self.handle_packet)
@@ -214,11 +531,12 @@ class RealTimeAnalyzer:
         """Real-time display loop"""
         while self.running:
             try:
-                os.system('clear')
-                self.display_dashboard()
-                time.sleep(2)
+                with self.screen.frame():
+                    self.display_dashboard()
+                time.sleep(self.refresh.next_interval(self.screen.changed_rows))
             except Exception as e:
                 print(f"{Colors.RED}Display error: {e}{Colors.NC}")
+                self.screen.invalidate()
                 time.sleep(1)
 
     def display_dashboard(self):
@@ -229,20 +547,7 @@ class RealTimeAnalyzer:
         print(f"{Colors.MAGENTA}        Packet TS - Real-Time Traffic Analysis{Colors.NC}")
         print(f"{Colors.MAGENTA}═══════════════════════════════════════════════════{Colors.NC}")
 
-        # Overview stats
-        print(f"\n{Colors.CYAN}📊 Traffic Overview:{Colors.NC}")
-        print(f"  Total Packets: {Colors.WHITE}{stats['total_packets']}{Colors.NC}")
-        print(f"  Uptime: {Colors.WHITE}{stats['uptime']:.1f}s{Colors.NC}")
-        print(f"  Rate: {Colors.WHITE}{stats['packets_per_sec']:.1f} pkt/sec{Colors.NC}")
-        print(f"  Data Volume: {Colors.WHITE}{stats['data_volume_kb']:.1f} KB{Colors.NC}")
-        print(f"  Active Sessions: {Colors.WHITE}{stats['active_sessions']}{Colors.NC}")
-        print(f"  Avg Response: {Colors.WHITE}{stats['avg_response_time']:.3f}s{Colors.NC}")
-
-        # Packet type breakdown
-        print(f"\n{Colors.CYAN}📦 Packet Types:{Colors.NC}")
-        for packet_type, count in stats['packet_types'].items():
-            percentage = (count / stats['total_packets'] * 100) if stats['total_packets'] > 0 else 0
-            print(f"  {packet_type:8} {Colors.WHITE}{count:4d}{Colors.NC} ({percentage:5.1f}%)")
+        print_traffic_summary(stats)
 
         # Recent packets
         print(f"\n{Colors.CYAN}🔄 Recent Traffic:{Colors.NC}")
@@ -277,16 +582,19 @@ class RealTimeAnalyzer:
 
             print(f"  Response Time: min={min_rt:.3f}s avg={avg_rt:.3f}s max={max_rt:.3f}s")
 
+        print_correlation_summary(stats['correlation'])
+
         # Connection status
         connections = self.sniffer.get_active_connections()
         print(f"  Active Connections: {len(connections)}")
 
-        print(f"\n{Colors.BLUE}[Press Ctrl+C to stop monitoring]{Colors.NC}")
+        print(f"\n{Colors.BLUE}[Refresh {self.refresh.interval:.2f}s. Press Ctrl+C to stop monitoring]{Colors.NC}")
 
     def stop(self):
         """Stop analysis"""
         self.running = False
         self.sniffer.running = False
+        self.screen.close()
         print(f"\n{Colors.GREEN}✓ Traffic analysis stopped{Colors.NC}")
 
 class PacketHexDumper:
@@ -318,22 +626,921 @@ class PacketHexDumper:
 
         print()
 
+# Capture file formats
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+# Records or blocks larger than this are treated as corruption
+PCAP_MAX_RECORD = 16 * 1024 * 1024
+
+# Link layer types we know how to strip
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+# Frames larger than this are treated as a desynchronised stream
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Out-of-order segments buffered per direction before giving up on a gap
+MAX_PENDING_SEGMENTS = 1024
+
+class PcapReader:
+    """Streaming reader for pcap and pcapng capture files
+
+    Yields (timestamp, linktype, frame_bytes) tuples one record at a time,
+    so captures of any size are read in constant memory. Truncated or
+    corrupt data ends the capture with a warning; blocks that are
+    well-formed but unusable (e.g. an unknown interface) are skipped and
+    counted in `skipped`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.skipped = 0
+        self.warned = set()
+
+    def _warn(self, message):
+        # Once per kind of problem, not once per block
+        if message not in self.warned:
+            self.warned.add(message)
+            print(f"{Colors.YELLOW}⚠ {self.path}: {message}{Colors.NC}")
+
+    def _skip(self, message):
+        self.skipped += 1
+        self._warn(message)
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+
+            if struct.unpack('<I', head)[0] == PCAPNG_SHB:
+                yield from self._read_pcapng(f, head)
+            else:
+                yield from self._read_pcap(f, head)
+
+    def _read_pcap(self, f, magic_bytes):
+        for endian in ('<', '>'):
+            magic = struct.unpack(endian + 'I', magic_bytes)[0]
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            raise ValueError(f"Not a pcap file: {self.path}")
+
+        resolution = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+        header = f.read(20)
+        if len(header) < 20:
+            return
+        linktype = struct.unpack(endian + 'I', header[16:20])[0] & 0x0FFFFFFF
+
+        record_header = struct.Struct(endian + 'IIII')
+        while True:
+            raw = f.read(16)
+            if len(raw) < 16:
+                if raw:
+                    self._warn("truncated record header at end of capture")
+                return
+            ts_sec, ts_frac, incl_len, _ = record_header.unpack(raw)
+            if incl_len > PCAP_MAX_RECORD:
+                self._warn(f"corrupt record length {incl_len}, stopping")
+                return
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                self._warn("truncated record at end of capture")
+                return
+            yield ts_sec + ts_frac * resolution, linktype, data
+
+    def _read_pcapng(self, f, first_type):
+        endian = '<'
+        interfaces = []
+        block_type_bytes = first_type
+
+        while True:
+            raw_len = f.read(4)
+            if len(raw_len) < 4:
+                return
+
+            if struct.unpack('<I', block_type_bytes)[0] == PCAPNG_SHB:
+                # The section header carries the byte order for everything after it
+                body_start = f.read(4)
+                if len(body_start) < 4:
+                    self._warn("truncated section header at end of capture")
+                    return
+                endian = '<' if struct.unpack('<I', body_start)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                block_len = struct.unpack(endian + 'I', raw_len)[0]
+                if not self._valid_block_length(block_len, 28):
+                    return
+                body = body_start + f.read(block_len - 12)
+                interfaces = []
+            else:
+                block_len = struct.unpack(endian + 'I', raw_len)[0]
+                if not self._valid_block_length(block_len, 12):
+                    return
+                body = f.read(block_len - 8)
+            if len(body) < block_len - 8:
+                self._warn("truncated block at end of capture")
+                return
+
+            block_type = struct.unpack(endian + 'I', block_type_bytes)[0]
+
+            if block_type == PCAPNG_IDB:
+                if len(body) < 12:
+                    # Still takes an id, so later interfaces keep theirs
+                    self._skip("short interface description block")
+                    interfaces.append(None)
+                else:
+                    linktype = struct.unpack(endian + 'H', body[0:2])[0]
+                    interfaces.append((linktype, self._pcapng_resolution(body[8:-4], endian)))
+
+            elif block_type == PCAPNG_EPB:
+                interface_id = struct.unpack(endian + 'I', body[:4])[0] if len(body) >= 24 else None
+                if interface_id is None:
+                    self._skip("short enhanced packet block")
+                elif interface_id >= len(interfaces) or interfaces[interface_id] is None:
+                    self._skip(f"packets for undeclared interface {interface_id} skipped")
+                else:
+                    ts_high, ts_low, cap_len = struct.unpack(endian + 'III', body[4:16])
+                    linktype, resolution = interfaces[interface_id]
+                    timestamp = ((ts_high << 32) | ts_low) * resolution
+                    yield timestamp, linktype, body[20:20 + min(cap_len, len(body) - 24)]
+
+            elif block_type == PCAPNG_SPB and interfaces:
+                # Simple packets have no timestamp; they are rare enough to skip
+                pass
+
+            block_type_bytes = f.read(4)
+            if len(block_type_bytes) < 4:
+                return
+
+    def _valid_block_length(self, block_len, minimum):
+        """Block lengths are multiples of 4 and cover at least the block's fixed fields"""
+        if block_len < minimum or block_len % 4 or block_len > PCAP_MAX_RECORD:
+            self._warn(f"corrupt block length {block_len}, stopping")
+            return False
+        return True
+
+    @staticmethod
+    def _pcapng_resolution(options, endian):
+        """Return the timestamp resolution from an IDB's if_tsresol option"""
+        offset = 0
+        while offset + 4 <= len(options):
+            code, length = struct.unpack(endian + 'HH', options[offset:offset + 4])
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                value = options[offset + 4]
+                if value & 0x80:
+                    return 2.0 ** -(value & 0x7F)
+                return 10.0 ** -value
+            offset += 4 + ((length + 3) & ~3)
+        return 1e-6
+
+def decode_tcp_segment(linktype, frame):
+    """Strip link, IP and TCP headers
+
+    Returns (src, sport, dst, dport, seq, flags, payload) or None when the
+    frame is not an unfragmented IPv4/IPv6 TCP segment.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        ethertype = struct.unpack('!H', frame[12:14])[0] if len(frame) >= 14 else 0
+        while ethertype in (0x8100, 0x88A8) and len(frame) >= offset + 4:
+            ethertype = struct.unpack('!H', frame[offset + 2:offset + 4])[0]
+            offset += 4
+        if ethertype not in (0x0800, 0x86DD):
+            return None
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        offset = 4
+    elif linktype == LINKTYPE_RAW or linktype == 12:
+        offset = 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset = 20
+    else:
+        return None
+
+    if len(frame) <= offset:
+        return None
+
+    version = frame[offset] >> 4
+    if version == 4:
+        ihl = (frame[offset] & 0x0F) * 4
+        if ihl < 20 or len(frame) < offset + ihl:
+            return None
+        total_length, frag, proto = struct.unpack('!H2xHxB', frame[offset + 2:offset + 10])
+        if proto != 6 or frag & 0x3FFF:
+            return None
+        src = socket.inet_ntop(socket.AF_INET, frame[offset + 12:offset + 16])
+        dst = socket.inet_ntop(socket.AF_INET, frame[offset + 16:offset + 20])
+        # Segmentation offload leaves total_length as 0; trust the capture then
+        ip_end = offset + total_length if total_length else len(frame)
+        offset += ihl
+    elif version == 6:
+        if len(frame) < offset + 40:
+            return None
+        payload_length = struct.unpack('!H', frame[offset + 4:offset + 6])[0]
+        if frame[offset + 6] != 6:
+            return None
+        src = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+        dst = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+        offset += 40
+        ip_end = offset + payload_length if payload_length else len(frame)
+    else:
+        return None
+
+    if len(frame) < offset + 20:
+        return None
+
+    sport, dport, seq, data_offset, flags = struct.unpack('!HHIxxxxBB', frame[offset:offset + 14])
+    header_length = (data_offset >> 4) * 4
+    if header_length < 20 or len(frame) < offset + header_length:
+        return None
+    payload = frame[offset + header_length:min(ip_end, len(frame))]
+
+    return src, sport, dst, dport, seq, flags, payload
+
+class TCPStreamReassembler:
+    """Reassemble TCP byte streams and cut them into TS frames
+
+    Each direction of a connection is reassembled independently by sequence
+    number; retransmissions are trimmed and out-of-order segments are held
+    until the gap is filled. Complete length-prefixed frames are returned as
+    they become available.
+    """
+
+    TCP_FIN = 0x01
+    TCP_SYN = 0x02
+    TCP_RST = 0x04
+
+    def __init__(self):
+        self.streams = {}
+        self.desyncs = 0
+
+    def add_segment(self, key, seq, flags, payload):
+        """Feed one segment; return a list of complete frame payloads"""
+        stream = self.streams.get(key)
+
+        if flags & self.TCP_SYN:
+            self.streams[key] = {'next_seq': (seq + 1) & 0xFFFFFFFF, 'pending': {}, 'buffer': bytearray()}
+            return []
+
+        if stream is None:
+            if not payload:
+                return []
+            # Capture started mid-connection: trust the first data segment
+            stream = {'next_seq': seq, 'pending': {}, 'buffer': bytearray()}
+            self.streams[key] = stream
+
+        if payload:
+            self._insert(stream, seq, payload)
+
+        frames = self._cut_frames(stream)
+
+        if flags & (self.TCP_FIN | self.TCP_RST):
+            del self.streams[key]
+
+        return frames
+
+    def _insert(self, stream, seq, payload):
+        offset = (seq - stream['next_seq']) & 0xFFFFFFFF
+
+        if offset >= 0x80000000:
+            # Segment starts before next_seq: retransmission or overlap
+            overlap = 0x100000000 - offset
+            if overlap >= len(payload):
+                return
+            payload = payload[overlap:]
+            offset = 0
+
+        if offset > 0:
+            if len(stream['pending']) < MAX_PENDING_SEGMENTS:
+                stream['pending'][seq] = payload
+            return
+
+        stream['buffer'] += payload
+        stream['next_seq'] = (stream['next_seq'] + len(payload)) & 0xFFFFFFFF
+
+        pending = stream['pending']
+        while pending:
+            segment = pending.pop(stream['next_seq'], None)
+            if segment is None:
+                break
+            stream['buffer'] += segment
+            stream['next_seq'] = (stream['next_seq'] + len(segment)) & 0xFFFFFFFF
+
+    def _cut_frames(self, stream):
+        frames = []
+        buffer = stream['buffer']
+        position = 0
+
+        while len(buffer) - position >= 4:
+            length = struct.unpack_from('!I', buffer, position)[0]
+            if length > MAX_FRAME_SIZE:
+                # Lost framing (usually a mid-stream capture start); drop the backlog
+                self.desyncs += 1
+                position = len(buffer)
+                break
+            if len(buffer) - position < 4 + length:
+                break
+            frames.append(bytes(buffer[position + 4:position + 4 + length]))
+            position += 4 + length
+
+        if position:
+            del buffer[:position]
+
+        return frames
+
+class PcapTrafficAnalyzer:
+    """Offline analysis of TS traffic captured in a pcap/pcapng file
+
+    Frames are decoded into columnar arrays (timestamps, sizes, type codes,
+    session codes, RTTs) while streaming the capture; every statistic is then
+    computed with NumPy reductions over those columns.
+    """
+
+    def __init__(self, path, port=19999, recorder=None):
+        self.path = path
+        self.port = port
+        self.recorder = recorder
+        self.reassembler = TCPStreamReassembler()
+
+        self.timestamps = array('d')
+        self.sizes = array('q')
+        self.type_codes = array('l')
+        self.session_codes = array('l')
+        self.rtts = array('d')
+        self.request_type_codes = array('l')  # type of the request a response answers, -1 if none
+        self.request_session_codes = array('l')  # session of that request, -1 if none
+
+        self.type_names = []
+        self.type_index = {}
+        self.session_names = []
+        self.session_index = {}
+        self.correlator = RequestResponseCorrelator()
+
+        self.errors = 0
+        self.captured_frames = 0
+
+    def _intern(self, value, names, index):
+        code = index.get(value)
+        if code is None:
+            code = len(names)
+            index[value] = code
+            names.append(value)
+        return code
+
+    def ingest(self):
+        """Stream the capture file and fill the columnar arrays"""
+        for timestamp, linktype, frame in PcapReader(self.path):
+            self.captured_frames += 1
+
+            segment = decode_tcp_segment(linktype, frame)
+            if segment is None:
+                continue
+
+            src, sport, dst, dport, seq, flags, payload = segment
+            if self.port not in (sport, dport):
+                continue
+
+            to_server = dport == self.port
+            client = (src, sport) if to_server else (dst, dport)
+
+            for body in self.reassembler.add_segment((src, sport, dst, dport), seq, flags, payload):
+                self._add_frame(timestamp, body, to_server, client)
+
+    def _add_frame(self, timestamp, body, to_server, client):
+        try:
+            packet = json.loads(body)
+            packet_type = str(packet.get('type', 'unknown'))
+            session_id = packet.get('session_id') or ''
+            packet_id = packet.get('packet_id')
+            reply_to = packet.get('reply_to')
+        except (ValueError, AttributeError):
+            self.errors += 1
+            return
+
+        type_code = self._intern(packet_type, self.type_names, self.type_index)
+
+        rtt = float('nan')
+        request_type_code = -1
+        request_session_code = -1
+        if to_server:
+            self.correlator.on_request(client, packet_id, packet_type, session_id, timestamp)
+        else:
+            match = self.correlator.on_response(client, reply_to, timestamp)
+            if match:
+                rtt, request_type, request_session = match
+                request_type_code = self._intern(request_type, self.type_names, self.type_index)
+                request_session_code = self._intern(request_session, self.session_names, self.session_index)
+
+        # Expire on capture time, not wall-clock time
+        if len(self.timestamps) % 1024 == 0:
+            self.correlator.expire(timestamp)
+
+        self.timestamps.append(timestamp)
+        self.sizes.append(len(body) + 4)
+        self.type_codes.append(type_code)
+        self.session_codes.append(self._intern(session_id, self.session_names, self.session_index))
+        self.rtts.append(rtt)
+        self.request_type_codes.append(request_type_code)
+        self.request_session_codes.append(request_session_code)
+
+        if self.recorder:
+            self.recorder.record(
+                packet_type, session_id, len(body) + 4, None if rtt != rtt else rtt,
+                timestamp=timestamp, direction=DIRECTION_REQUEST if to_server else DIRECTION_RESPONSE
+            )
+
+    def get_stats(self):
+        """Aggregate the columns into the same stats dict as PacketStats"""
+        import numpy as np
+
+        timestamps = np.frombuffer(self.timestamps, dtype=np.float64)
+        sizes = np.frombuffer(self.sizes, dtype=np.int64)
+        type_codes = np.frombuffer(self.type_codes, dtype=np.dtype(f'i{self.type_codes.itemsize}'))
+        session_codes = np.frombuffer(self.session_codes, dtype=np.dtype(f'i{self.session_codes.itemsize}'))
+        rtts = np.frombuffer(self.rtts, dtype=np.float64)
+        request_type_codes = np.frombuffer(self.request_type_codes, dtype=type_codes.dtype)
+        request_session_codes = np.frombuffer(self.request_session_codes, dtype=type_codes.dtype)
+
+        total = len(timestamps)
+        uptime = float(timestamps.max() - timestamps.min()) if total else 0.0
+
+        type_counts = np.bincount(type_codes, minlength=len(self.type_names))
+        session_counts = np.bincount(session_codes, minlength=len(self.session_names))
+        session_bytes = np.bincount(session_codes, weights=sizes, minlength=len(self.session_names))
+
+        answered = ~np.isnan(rtts)
+        rtt_values = rtts[answered]
+        rtt_type_counts = np.bincount(request_type_codes[answered], minlength=len(self.type_names))
+        rtt_type_sums = np.bincount(request_type_codes[answered], weights=rtt_values, minlength=len(self.type_names))
+        rtt_session_counts = np.bincount(request_session_codes[answered], minlength=len(self.session_names))
+        rtt_session_sums = np.bincount(request_session_codes[answered], weights=rtt_values, minlength=len(self.session_names))
+
+        top = np.argsort(session_counts)[::-1][:5]
+        top_talkers = [
+            {
+                'session': self.session_names[i],
+                'packets': int(session_counts[i]),
+                'error': 0,
+                'bytes': int(session_bytes[i]),
+                'avg_rtt': float(rtt_session_sums[i] / rtt_session_counts[i]) if rtt_session_counts[i] else None
+            }
+            for i in top if session_counts[i] > 0
+        ]
+
+        return {
+            'total_packets': total,
+            'uptime': uptime,
+            'packets_per_sec': total / uptime if uptime > 0 else 0,
+            'data_volume_kb': float(sizes.sum()) / 1024,
+            'packet_types': {name: int(type_counts[i]) for i, name in enumerate(self.type_names)},
+            'active_sessions': int(np.count_nonzero(session_counts)),
+            'session_evictions': 0,
+            'top_talkers': top_talkers,
+            'avg_response_time': float(rtt_values.mean()) if len(rtt_values) else 0,
+            'errors': self.errors + self.reassembler.desyncs,
+            'correlation': self.correlator.get_stats(),
+            'response_time': {
+                'min': float(rtt_values.min()) if len(rtt_values) else 0,
+                'max': float(rtt_values.max()) if len(rtt_values) else 0,
+                'p95': float(np.percentile(rtt_values, 95)) if len(rtt_values) else 0,
+                'by_type': {
+                    name: float(rtt_type_sums[i] / rtt_type_counts[i])
+                    for i, name in enumerate(self.type_names) if rtt_type_counts[i]
+                }
+            },
+            'captured_frames': self.captured_frames
+        }
+
+    def print_report(self):
+        """Print the analysis in the same layout as the live dashboard"""
+        stats = self.get_stats()
+
+        print(f"{Colors.MAGENTA}═══════════════════════════════════════════════════{Colors.NC}")
+        print(f"{Colors.MAGENTA}        Packet TS - Capture Analysis{Colors.NC}")
+        print(f"{Colors.MAGENTA}═══════════════════════════════════════════════════{Colors.NC}")
+        print(f"  File: {self.path} ({stats['captured_frames']} captured frames, port {self.port})")
+
+        print_traffic_summary(stats)
+
+        print(f"\n{Colors.CYAN}⚡ Performance Metrics:{Colors.NC}")
+        rt = stats['response_time']
+        print(f"  Response Time: min={rt['min']:.3f}s avg={stats['avg_response_time']:.3f}s "
+              f"p95={rt['p95']:.3f}s max={rt['max']:.3f}s")
+        print_correlation_summary(stats['correlation'])
+        print(f"  Decode Errors: {stats['errors']}")
+
+# Binary traffic log: fixed-size little-endian records, one file per segment
+TRAFFIC_LOG_MAGIC = b'TSTRAF01'
+TRAFFIC_LOG_HEADER = struct.Struct('<8sI4x')
+# timestamp, size, session code, type code, direction, reserved, rtt (NaN if unknown)
+TRAFFIC_LOG_RECORD = struct.Struct('<dIIHBxf')
+TRAFFIC_LOG_SEGMENT_BYTES = 64 * 1024 * 1024
+# Legacy shared string table; segments now carry their own traffic-NNNNN.strings.jsonl
+TRAFFIC_LOG_STRINGS = 'strings.jsonl'
+# Strings interned per segment; a full table rotates the segment so codes fit the 'H' type field
+TRAFFIC_LOG_MAX_STRINGS = 0xFFFF
+
+# Request types replay sends by default; cmd/create/kill would touch real sessions
+REPLAY_SAFE_TYPES = ('list', 'hb')
+# Types that change session state and are only replayed against sandbox session ids
+REPLAY_SANDBOX_TYPES = ('cmd',)
+REPLAY_CONNECTIONS = 4
+
+class TrafficRecorder:
+    """Append-only binary recorder for observed frame events
+
+    Every event is a fixed-size record; session ids and packet types are
+    interned into a per-segment string table written next to the segment
+    the first time they are seen. Segments rotate once they reach
+    `segment_bytes` or their string table is full, which keeps the table
+    bounded no matter how many sessions come and go.
+    """
+
+    def __init__(self, directory, segment_bytes=TRAFFIC_LOG_SEGMENT_BYTES,
+                 max_strings=TRAFFIC_LOG_MAX_STRINGS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_strings = min(max_strings, TRAFFIC_LOG_MAX_STRINGS)
+        self.lock = threading.Lock()
+        self.codes = {}
+        self.records = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Resume an existing log by continuing after the last segment
+        segments = traffic_log_segments(directory)
+        self.segment_index = int(os.path.basename(segments[-1])[8:13]) + 1 if segments else 0
+        self.segment = None
+        self.strings_file = None
+        self.segment_size = 0
+        self._open_segment()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"traffic-{self.segment_index:05d}.bin")
+        self.segment = open(path, 'ab')
+        self.segment.write(TRAFFIC_LOG_HEADER.pack(TRAFFIC_LOG_MAGIC, TRAFFIC_LOG_RECORD.size))
+        self.segment_size = TRAFFIC_LOG_HEADER.size
+        self.strings_file = open(traffic_log_strings_path(path), 'w')
+        self.codes = {}
+
+    def _rotate(self):
+        self.segment.close()
+        self.strings_file.close()
+        self.segment_index += 1
+        self._open_segment()
+
+    def _intern(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.codes)
+            self.codes[value] = code
+            self.strings_file.write(json.dumps({'code': code, 'value': value}) + '\n')
+            self.strings_file.flush()
+        return code
+
+    def record(self, packet_type, session_id, size, response_time=None,
+               timestamp=None, direction=None):
+        """Append one frame event"""
+        if direction is None:
+            direction = DIRECTION_RESPONSE if packet_type in RESPONSE_TYPES else DIRECTION_REQUEST
+        session_id = session_id or ''
+
+        with self.lock:
+            new_strings = (session_id not in self.codes) + (packet_type not in self.codes)
+            if (self.segment_size + TRAFFIC_LOG_RECORD.size > self.segment_bytes
+                    or len(self.codes) + new_strings > self.max_strings):
+                self._rotate()
+
+            self.segment.write(TRAFFIC_LOG_RECORD.pack(
+                timestamp if timestamp is not None else time.time(),
+                size,
+                self._intern(session_id),
+                self._intern(packet_type),
+                direction,
+                response_time if response_time is not None else float('nan')
+            ))
+            self.segment_size += TRAFFIC_LOG_RECORD.size
+            self.records += 1
+
+    def handle_packet(self, packet_type, session_id, size, response_time):
+        """PacketSniffer handler signature"""
+        self.record(packet_type, session_id, size, response_time)
+
+    def flush(self):
+        with self.lock:
+            self.segment.flush()
+
+    def close(self):
+        with self.lock:
+            self.segment.close()
+            self.strings_file.close()
+
+def traffic_log_segments(directory):
+    """Return segment paths of a traffic log in write order"""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith('traffic-') and name.endswith('.bin')
+    )
+
+def traffic_log_strings_path(segment_path):
+    """String table that belongs to a segment file"""
+    return segment_path[:-len('.bin')] + '.strings.jsonl'
+
+def load_traffic_log_strings(path):
+    strings = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    strings[entry['code']] = entry['value']
+    return strings
+
+class TrafficLogReader:
+    """Random-access reader for a traffic log directory
+
+    Segments are memory-mapped, so indexing any record is a single
+    unpack_from on the mapping with no reads or copies.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.maps = []
+        self.strings = []  # string table of each segment
+        self.offsets = []  # cumulative record count before each segment
+        self.total = 0
+
+        # Logs written before per-segment tables share one file
+        legacy_strings = None
+
+        for path in traffic_log_segments(directory):
+            size = os.path.getsize(path)
+            if size <= TRAFFIC_LOG_HEADER.size:
+                continue
+
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, record_size = TRAFFIC_LOG_HEADER.unpack_from(mapped, 0)
+            if magic != TRAFFIC_LOG_MAGIC or record_size != TRAFFIC_LOG_RECORD.size:
+                mapped.close()
+                raise ValueError(f"Not a traffic log segment: {path}")
+
+            strings_path = traffic_log_strings_path(path)
+            if os.path.exists(strings_path):
+                strings = load_traffic_log_strings(strings_path)
+            else:
+                if legacy_strings is None:
+                    legacy_strings = load_traffic_log_strings(os.path.join(directory, TRAFFIC_LOG_STRINGS))
+                strings = legacy_strings
+
+            # A torn trailing record from a crash is ignored
+            count = (size - TRAFFIC_LOG_HEADER.size) // record_size
+            self.maps.append(mapped)
+            self.strings.append(strings)
+            self.offsets.append(self.total)
+            self.total += count
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError(index)
+
+        segment = bisect.bisect_right(self.offsets, index) - 1
+        position = TRAFFIC_LOG_HEADER.size + (index - self.offsets[segment]) * TRAFFIC_LOG_RECORD.size
+        timestamp, size, session_code, type_code, direction, rtt = \
+            TRAFFIC_LOG_RECORD.unpack_from(self.maps[segment], position)
+        strings = self.strings[segment]
+
+        return {
+            'timestamp': timestamp,
+            'type': strings.get(type_code, str(type_code)),
+            'session': strings.get(session_code, str(session_code)),
+            'size': size,
+            'direction': direction,
+            'response_time': None if rtt != rtt else rtt
+        }
+
+    def __iter__(self):
+        for index in range(self.total):
+            yield self[index]
+
+    def close(self):
+        for mapped in self.maps:
+            mapped.close()
+        self.maps = []
+
+class TrafficReplayer:
+    """Re-send recorded request traffic to a PacketTSServer
+
+    Requests are paced by their recorded timestamps divided by `speed`;
+    a speed of 0 sends as fast as the server answers. Requests are spread
+    over `connections` client connections, each session always using the
+    same one so its requests keep their recorded order.
+
+    Only REPLAY_SAFE_TYPES are sent by default. With a `sandbox` prefix,
+    session ids are rewritten to `<sandbox><session>` and state-changing
+    REPLAY_SANDBOX_TYPES are replayed against those sessions instead of
+    the recorded (possibly live) ones.
+    """
+
+    def __init__(self, reader, host='localhost', port=19999, speed=1.0,
+                 packet_types=REPLAY_SAFE_TYPES, connections=REPLAY_CONNECTIONS, sandbox=None):
+        self.reader = reader
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.sandbox = sandbox
+        self.connections = max(1, connections)
+        self.packet_types = set(packet_types) if packet_types else None
+        if self.packet_types is not None:
+            if sandbox:
+                self.packet_types.update(REPLAY_SANDBOX_TYPES)
+            else:
+                self.packet_types.difference_update(REPLAY_SANDBOX_TYPES)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+        self.response_times = []
+
+    def _build_frame(self, record, packet_id):
+        session_id = record['session']
+        if self.sandbox and session_id:
+            session_id = f"{self.sandbox}{session_id}"
+
+        packet = {
+            "type": record['type'],
+            "session_id": session_id,
+            "data": {},
+            "timestamp": datetime.now().isoformat(),
+            "packet_id": f"replay_{packet_id}"
+        }
+        if record['type'] == 'cmd':
+            packet["data"]["command"] = ""
+
+        # Pad up to the recorded frame size; the empty field measures its own overhead
+        packet["data"]["replay_padding"] = ""
+        json_data = json.dumps(packet).encode('utf-8')
+        padding = record['size'] - 4 - len(json_data)
+        if padding > 0:
+            packet["data"]["replay_padding"] = "x" * padding
+        else:
+            del packet["data"]["replay_padding"]
+        json_data = json.dumps(packet).encode('utf-8')
+
+        return struct.pack('!I', len(json_data)) + json_data
+
+    @staticmethod
+    def _recv_exact(sock, length):
+        data = b''
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("Server closed connection")
+            data += chunk
+        return data
+
+    def _connection_worker(self, requests):
+        """Send queued frames over one connection, reconnecting after errors"""
+        sock = None
+        try:
+            while True:
+                frame = requests.get()
+                if frame is None:
+                    break
+
+                sent_at = time.time()
+                try:
+                    if sock is None:
+                        sock = socket.create_connection((self.host, self.port), timeout=5)
+                    sock.sendall(frame)
+                    length = struct.unpack('!I', self._recv_exact(sock, 4))[0]
+                    self._recv_exact(sock, length)
+                    with self.lock:
+                        self.response_times.append(time.time() - sent_at)
+                        self.sent += 1
+                except (OSError, ConnectionError) as e:
+                    with self.lock:
+                        self.errors += 1
+                    print(f"{Colors.RED}Replay error: {e}{Colors.NC}")
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def replay(self):
+        """Replay the whole log; return a summary dict"""
+        queues = [queue.Queue(maxsize=1000) for _ in range(self.connections)]
+        workers = [
+            threading.Thread(target=self._connection_worker, args=(requests,), daemon=True)
+            for requests in queues
+        ]
+        for worker in workers:
+            worker.start()
+
+        first_timestamp = None
+        start_time = time.time()
+        packet_id = 0
+
+        try:
+            for record in self.reader:
+                if record['direction'] == DIRECTION_RESPONSE:
+                    continue
+                if self.packet_types and record['type'] not in self.packet_types:
+                    continue
+
+                if first_timestamp is None:
+                    first_timestamp = record['timestamp']
+
+                if self.speed > 0:
+                    due = start_time + (record['timestamp'] - first_timestamp) / self.speed
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                requests = queues[zlib.crc32(record['session'].encode('utf-8')) % self.connections]
+                requests.put(self._build_frame(record, packet_id))
+                packet_id += 1
+        finally:
+            for requests in queues:
+                requests.put(None)
+            for worker in workers:
+                worker.join()
+
+        elapsed = time.time() - start_time
+        return {
+            'sent': self.sent,
+            'errors': self.errors,
+            'elapsed': elapsed,
+            'rate': self.sent / elapsed if elapsed > 0 else 0,
+            'avg_response_time': sum(self.response_times) / len(self.response_times) if self.response_times else 0
+        }
+
 def main():
     if len(sys.argv) < 2:
         print(f"{Colors.CYAN}Usage: packet-traffic-analyzer.py [mode]{Colors.NC}")
         print(f"Modes:")
-        print(f"  monitor   - Real-time traffic monitoring")
+        print(f"  monitor   - Real-time traffic monitoring: monitor [--record <dir>]")
         print(f"  hex       - Show hex dump of sample packets")
         print(f"  simulate  - Simulate traffic for testing")
+        print(f"  pcap      - Analyze a pcap/pcapng capture: pcap <file> [port] [--record <dir>]")
+        print(f"  replay    - Replay a recorded traffic log: replay <dir> [speed|max] [host:port] "
+              f"[--connections <n>] [--sandbox <prefix>]")
         sys.exit(1)
 
     mode = sys.argv[1]
 
+    # Optional traffic recording for monitor and pcap modes
+    recorder = None
+    if "--record" in sys.argv:
+        index = sys.argv.index("--record")
+        if index + 1 >= len(sys.argv):
+            print(f"{Colors.RED}--record requires a directory{Colors.NC}")
+            sys.exit(1)
+        recorder = TrafficRecorder(sys.argv[index + 1])
+        del sys.argv[index:index + 2]
+        print(f"{Colors.CYAN}📼 Recording traffic to {recorder.directory}{Colors.NC}")
+
+    # Replay options: parallel connections and a session prefix that enables cmd frames
+    replay_connections = REPLAY_CONNECTIONS
+    sandbox = None
+    for flag in ("--connections", "--sandbox"):
+        if flag in sys.argv:
+            index = sys.argv.index(flag)
+            if index + 1 >= len(sys.argv):
+                print(f"{Colors.RED}{flag} requires a value{Colors.NC}")
+                sys.exit(1)
+            if flag == "--connections":
+                replay_connections = int(sys.argv[index + 1])
+            else:
+                sandbox = sys.argv[index + 1]
+            del sys.argv[index:index + 2]
+
     if mode == "monitor":
         analyzer = RealTimeAnalyzer()
+        if recorder:
+            analyzer.sniffer.add_handler(recorder.handle_packet)
 
         def signal_handler(sig, frame):
             analyzer.stop()
+            if recorder:
+                recorder.close()
             sys.exit(0)
 
         signal.signal(signal.SIGINT, signal_handler)
@@ -391,6 +1598,53 @@ def main():
 
         print(f"{Colors.CYAN}✓ Simulation complete. Generated {packet_count} packets{Colors.NC}")
 
+    elif mode == "pcap":
+        if len(sys.argv) < 3:
+            print(f"{Colors.RED}Usage: packet-traffic-analyzer.py pcap <file> [port]{Colors.NC}")
+            sys.exit(1)
+
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 19999
+        analyzer = PcapTrafficAnalyzer(sys.argv[2], port, recorder)
+
+        start_time = time.time()
+        analyzer.ingest()
+        if recorder:
+            recorder.close()
+        analyzer.print_report()
+        print(f"\n{Colors.GREEN}✓ Analyzed in {time.time() - start_time:.2f}s{Colors.NC}")
+
+    elif mode == "replay":
+        if len(sys.argv) < 3:
+            print(f"{Colors.RED}Usage: packet-traffic-analyzer.py replay <dir> [speed|max] [host:port] "
+                  f"[--connections <n>] [--sandbox <prefix>]{Colors.NC}")
+            sys.exit(1)
+
+        speed_arg = sys.argv[3] if len(sys.argv) > 3 else "1"
+        speed = 0 if speed_arg == "max" else float(speed_arg.rstrip("x"))
+        host, port = "localhost", 19999
+        if len(sys.argv) > 4:
+            host, _, port_str = sys.argv[4].rpartition(":")
+            host, port = host or "localhost", int(port_str)
+
+        reader = TrafficLogReader(sys.argv[2])
+        print(f"{Colors.YELLOW}🔁 Replaying {len(reader)} recorded events to {host}:{port} "
+              f"at {'max' if speed == 0 else f'{speed:g}×'} speed...{Colors.NC}")
+
+        if sandbox:
+            print(f"{Colors.CYAN}Commands go to sandbox sessions prefixed '{sandbox}'{Colors.NC}")
+        else:
+            print(f"{Colors.CYAN}Skipping {', '.join(REPLAY_SANDBOX_TYPES)} frames; "
+                  f"pass --sandbox <prefix> to replay them{Colors.NC}")
+
+        replayer = TrafficReplayer(reader, host, port, speed,
+                                   connections=replay_connections, sandbox=sandbox)
+        result = replayer.replay()
+        reader.close()
+
+        print(f"{Colors.GREEN}✓ Replay complete: {result['sent']} sent, {result['errors']} errors "
+              f"in {result['elapsed']:.1f}s ({result['rate']:.1f} pkt/sec, "
+              f"avg response {result['avg_response_time']:.3f}s){Colors.NC}")
+
     else:
         print(f"{Colors.RED}Unknown mode: {mode}{Colors.NC}")
         sys.exit(1)
@@ -38,12 +38,13 @@ class PacketType:
 class TSPacket:
     """TS Communication Packet"""
 
-    def __init__(self, packet_type, session_id=None, data=None, timestamp=None):
+    def __init__(self, packet_type, session_id=None, data=None, timestamp=None, reply_to=None):
         self.type = packet_type
         self.session_id = session_id or ""
         self.data = data or {}
         self.timestamp = timestamp or datetime.now().isoformat()
         self.packet_id = f"{int(time.time() * 1000)}_{id(self)}"
+        self.reply_to = reply_to  # packet_id of the request this packet answers
 
     def to_bytes(self):
         """Convert packet to bytes"""
@@ -54,6 +55,8 @@ class TSPacket:
             "timestamp": self.timestamp,
             "packet_id": self.packet_id
         }
+        if self.reply_to:
+            packet_dict["reply_to"] = self.reply_to
 
         json_data = json.dumps(packet_dict).encode('utf-8')
         length = len(json_data)
@@ -81,6 +84,7 @@ class TSPacket:
                 packet_dict["timestamp"]
             )
             packet.packet_id = packet_dict["packet_id"]
+            packet.reply_to = packet_dict.get("reply_to")
 
             return packet
         except Exception as e:
@@ -260,6 +264,7 @@ class PacketTSServer:
 
                 # Send response
                 if response:
+                    response.reply_to = packet.packet_id
                     self.send_packet(client_socket, response)
 
         except Exception as e:
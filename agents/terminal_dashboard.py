@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Terminal Dashboard Renderer
+Flicker-free incremental redraw shared by the monitoring dashboards
+"""
+
+import io
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+from collections import deque
+from contextlib import contextmanager
+
+# ANSI control sequences
+CSI = '\033['
+HIDE_CURSOR = f'{CSI}?25l'
+SHOW_CURSOR = f'{CSI}?25h'
+CLEAR_SCREEN = f'{CSI}2J'
+CLEAR_LINE = f'{CSI}K'
+CLEAR_BELOW = f'{CSI}J'
+RESET = f'{CSI}0m'
+AUTOWRAP_OFF = f'{CSI}?7l'
+AUTOWRAP_ON = f'{CSI}?7h'
+ANSI_ESCAPE = re.compile(r'(\033\[[0-9;?]*[A-Za-z])')
+
+# Lines printed by other threads that are kept under the frame
+MESSAGE_LINES = 5
+
+# Repaint everything periodically to recover from stray writes by other threads
+FULL_REDRAW_INTERVAL = 30
+
+def char_width(char):
+    """Number of terminal columns taken by one character"""
+    if unicodedata.combining(char):
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+def clip_line(line, columns):
+    """Cut `line` to `columns` visible characters, keeping ANSI codes intact"""
+    out = []
+    width = 0
+    styled = False
+    for part in ANSI_ESCAPE.split(line):
+        if ANSI_ESCAPE.fullmatch(part):
+            out.append(part)
+            styled = True
+            continue
+        for char in part:
+            width += char_width(char)
+            if width > columns:
+                return ''.join(out) + (RESET if styled else '')
+            out.append(char)
+    return line
+
+class ThreadStdout:
+    """sys.stdout replacement that keeps other threads off the screen
+
+    Prints from a thread that is building a frame go to that frame. Prints
+    from any other thread are kept as messages shown under the frame, or
+    written straight through when the output is not a terminal.
+    """
+
+    def __init__(self, stream, passthrough, max_messages=MESSAGE_LINES):
+        self.stream = stream
+        self.passthrough = passthrough
+        self.messages = deque(maxlen=max_messages)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.partial = {}
+
+    def write(self, data):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(data)
+        if self.passthrough:
+            return self.stream.write(data)
+
+        ident = threading.get_ident()
+        with self.lock:
+            text = self.partial.pop(ident, '') + data
+            *lines, rest = text.split('\n')
+            self.messages.extend(line for line in lines if line.strip())
+            if rest:
+                self.partial[ident] = rest
+        return len(data)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None and self.passthrough:
+            self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def recent_messages(self):
+        with self.lock:
+            return list(self.messages)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class TerminalScreen:
+    """In-memory screen model that only rewrites lines that changed
+
+    A frame is built by printing as usual inside `frame()`. On render the
+    new lines are compared with what is on screen, and only changed rows are
+    rewritten using cursor addressing, so there is no clear and no flicker.
+    Lines are clipped to the terminal width so nothing wraps onto the next
+    row. When the output is not a terminal, whole frames are written as
+    plain text.
+    """
+
+    def __init__(self, stream=None, full_redraw_interval=FULL_REDRAW_INTERVAL):
+        self.stream = stream or sys.stdout
+        self.full_redraw_interval = full_redraw_interval
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.lines = []
+        self.size = None
+        self.last_full_redraw = 0
+        self.changed_rows = 0
+        self.bytes_written = 0
+        self.stdout = None
+
+    def _install_stdout(self):
+        # Only prints from the frame thread belong to the frame
+        if self.stdout is None:
+            self.stdout = ThreadStdout(sys.stdout, passthrough=not self.is_tty)
+            sys.stdout = self.stdout
+
+    @contextmanager
+    def frame(self):
+        """Capture everything this thread prints in the block as the next frame"""
+        self._install_stdout()
+        buffer = io.StringIO()
+        self.stdout.local.buffer = buffer
+        try:
+            yield
+        finally:
+            self.stdout.local.buffer = None
+        self.render(buffer.getvalue())
+
+    def invalidate(self):
+        """Force a full repaint on the next render"""
+        self.lines = []
+        self.last_full_redraw = 0
+
+    def render(self, text):
+        """Draw `text` as the new screen content; return the number of changed rows"""
+        new_lines = text.rstrip('\n').split('\n')
+
+        if not self.is_tty:
+            self._write(text if text.endswith('\n') else text + '\n')
+            self.changed_rows = len(new_lines)
+            self.lines = new_lines
+            return self.changed_rows
+
+        if self.stdout is not None:
+            messages = self.stdout.recent_messages()
+            if messages:
+                new_lines = new_lines + [''] + messages
+
+        size = shutil.get_terminal_size()
+        new_lines = [clip_line(line, size.columns)
+                     for line in new_lines[:max(1, size.lines - 1)]]
+
+        now = time.time()
+        out = []
+        if (size != self.size or not self.lines
+                or now - self.last_full_redraw >= self.full_redraw_interval):
+            out.append(HIDE_CURSOR + AUTOWRAP_OFF + CLEAR_SCREEN)
+            self.lines = []
+            self.size = size
+            self.last_full_redraw = now
+
+        changed = 0
+        for row, line in enumerate(new_lines):
+            if row < len(self.lines) and self.lines[row] == line:
+                continue
+            out.append(f'{CSI}{row + 1};1H{line}{CLEAR_LINE}')
+            changed += 1
+
+        if len(new_lines) < len(self.lines):
+            out.append(f'{CSI}{len(new_lines) + 1};1H{CLEAR_BELOW}')
+            changed += len(self.lines) - len(new_lines)
+
+        # Park the cursor under the frame
+        if out:
+            out.append(f'{CSI}{len(new_lines) + 1};1H')
+            self._write(''.join(out))
+
+        self.lines = new_lines
+        self.changed_rows = changed
+        return changed
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Restore stdout and the cursor, leaving it below the last frame"""
+        if self.stdout is not None:
+            if sys.stdout is self.stdout:
+                sys.stdout = self.stdout.stream
+            self.stdout = None
+        if self.is_tty:
+            self._write(f'{CSI}{len(self.lines) + 1};1H{AUTOWRAP_ON}{SHOW_CURSOR}')
+
+class AdaptiveRefresh:
+    """Refresh interval that speeds up while the screen is busy
+
+    Frames that change more than `idle_rows` rows (e.g. beyond a clock or
+    uptime line) halve the interval down to `min_interval`; quiet frames back
+    off by `backoff` up to `max_interval`.
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=2.0, idle_rows=2, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_rows = idle_rows
+        self.backoff = backoff
+        self.interval = max_interval
+
+    def next_interval(self, changed_rows):
+        if changed_rows > self.idle_rows:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
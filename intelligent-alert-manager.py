@@ -8,8 +8,10 @@ from typing import Dict, List, Optional, Any, Tuple
 from collections import defaultdict
 import hashlib
 import re
+import zlib
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, vstack
 import numpy as np
 
 class IntelligentAlertManager:
@@ -23,7 +25,23 @@ class IntelligentAlertManager:
             'similarity_threshold': 0.7,
             'time_window': 300,  # 5 minutes
             'max_group_size': 10,
-            'correlation_window': 600  # 10 minutes
+            'correlation_window': 600,  # 10 minutes
+            # Above this many alerts, only MinHash/LSH candidate pairs are scored
+            'lsh_min_alerts': 3000,
+            'lsh_bands': 32,
+            'lsh_rows': 2,
+            'lsh_bucket_window': 30,  # neighbours paired per alert within one bucket
+            # Rows scored per dense block below lsh_min_alerts (block x n floats at a time)
+            'similarity_block_rows': 256
+        }
+
+        # Weights of the alert similarity components
+        self.similarity_weights = {
+            'labels': 0.3,
+            'pattern': 0.2,
+            'severity': 0.1,
+            'hints': 0.2,
+            'text': 0.2
         }
 
         # Alert priorities
@@ -46,15 +64,28 @@ class IntelligentAlertManager:
 
         # Alert history
         self.alert_history = defaultdict(list)
-        self.alert_groups = {}
         self.suppression_rules = []
 
-        # ML components
-        self.vectorizer = TfidfVectorizer(max_features=100)
+        # Persistent grouping across cycles: group id -> {fingerprint: alert}, the group of each
+        # fingerprint, and a content signature per fingerprint to spot changed alerts
+        self.alert_groups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.group_index: Dict[str, str] = {}
+        self.alert_signatures: Dict[str, str] = {}
+        self.group_counter = 0
+        # Correlations between group pairs, kept until either group changes
+        self.group_correlations: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        # ML components (fitted once per batch of alerts, so the vocabulary is not capped)
+        self.vectorizer = TfidfVectorizer()
+        self.minhash_seeds = np.random.default_rng(0).integers(
+            0, 2 ** 64, size=(2, self.grouping_rules['lsh_bands'] * self.grouping_rules['lsh_rows']),
+            dtype=np.uint64
+        )
+        self.minhash_seeds[0] |= np.uint64(1)
         self.alert_embeddings = {}
 
-    async def fetch_active_alerts(self) -> List[Dict[str, Any]]:
-        """Fetch active alerts from Prometheus AlertManager"""
+    async def fetch_active_alerts(self) -> Optional[List[Dict[str, Any]]]:
+        """Fetch active alerts from Prometheus AlertManager; None if the fetch failed"""
         try:
             async with aiohttp.ClientSession() as session:
                 url = f"{self.prometheus_alertmanager_url}/api/v2/alerts"
@@ -62,9 +93,10 @@ class IntelligentAlertManager:
                     if response.status == 200:
                         alerts = await response.json()
                         return [self.process_alert(alert) for alert in alerts]
+                    print(f"Error fetching alerts: HTTP {response.status}")
         except Exception as e:
             print(f"Error fetching alerts: {e}")
-        return []
+        return None
 
     def process_alert(self, alert: Dict[str, Any]) -> Dict[str, Any]:
         """Process and enrich alert data"""
@@ -163,82 +195,344 @@ class IntelligentAlertManager:
 
     def calculate_alert_similarity(self, alert1: Dict[str, Any], alert2: Dict[str, Any]) -> float:
         """Calculate similarity between two alerts"""
-        # Label similarity
-        labels1 = set(alert1['labels'].items())
-        labels2 = set(alert2['labels'].items())
-        label_similarity = len(labels1 & labels2) / max(len(labels1), len(labels2)) if labels1 or labels2 else 0
-
-        # Pattern similarity
-        pattern_similarity = 1.0 if alert1['pattern_type'] == alert2['pattern_type'] else 0.0
-
-        # Severity similarity
-        severity_similarity = 1.0 - abs(
-            self.priority_weights.get(alert1['severity'], 1) -
-            self.priority_weights.get(alert2['severity'], 1)
-        ) / 10.0
-
-        # Correlation hints similarity
-        hints1 = set(alert1['correlation_hints'])
-        hints2 = set(alert2['correlation_hints'])
-        hint_similarity = len(hints1 & hints2) / max(len(hints1), len(hints2)) if hints1 or hints2 else 0
-
-        # Text similarity (using TF-IDF)
-        text_similarity = self.calculate_text_similarity(
-            f"{alert1['name']} {alert1.get('annotations', {}).get('description', '')}",
-            f"{alert2['name']} {alert2.get('annotations', {}).get('description', '')}"
-        )
-
-        # Weighted average
-        weights = [0.3, 0.2, 0.1, 0.2, 0.2]
-        similarities = [label_similarity, pattern_similarity, severity_similarity, hint_similarity, text_similarity]
+        return float(self.similarity_matrix([alert1, alert2])[0, 1])
+
+    def alert_text(self, alert: Dict[str, Any]) -> str:
+        return f"{alert['name']} {alert.get('annotations', {}).get('description', '')}"
+
+    def one_hot_sets(self, item_sets: List[set]) -> Tuple[csr_matrix, np.ndarray]:
+        """One-hot rows for a list of sets, with the set sizes"""
+        columns = {}
+        indices = [columns.setdefault(item, len(columns)) for items in item_sets for item in items]
+        sizes = np.array([len(items) for items in item_sets], dtype=np.float64)
+        indptr = np.concatenate(([0], np.cumsum(sizes, dtype=np.int64)))
+        one_hot = csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(item_sets), max(1, len(columns))))
+        return one_hot, sizes
+
+    def set_overlap_matrix(self, item_sets: List[set]) -> np.ndarray:
+        """|A & B| / max(|A|, |B|) for every pair of sets (0 when both are empty)"""
+        # The sparse product of one-hot rows counts shared items
+        one_hot, sizes = self.one_hot_sets(item_sets)
+        shared = (one_hot @ one_hot.T).toarray()
+        largest = np.maximum.outer(sizes, sizes)
+        return np.divide(shared, largest, out=np.zeros_like(shared), where=largest > 0)
+
+    def text_vectors(self, texts: List[str]) -> csr_matrix:
+        """L2-normalized TF-IDF rows from one fit over all texts"""
+        try:
+            return self.vectorizer.fit_transform(texts)
+        except ValueError:
+            # Empty vocabulary (no usable terms in any text)
+            return csr_matrix((len(texts), 1))
+
+    def text_similarity_matrix(self, texts: List[str]) -> np.ndarray:
+        """Cosine similarity of every pair of texts under one TF-IDF fit"""
+        return cosine_similarity(self.text_vectors(texts), dense_output=True)
+
+    def similarity_features(self, alerts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Per-alert inputs of every similarity term, computed once per batch"""
+        labels, label_sizes = self.one_hot_sets([set(alert['labels'].items()) for alert in alerts])
+        hints, hint_sizes = self.one_hot_sets([set(alert['correlation_hints']) for alert in alerts])
+        _, patterns = np.unique([alert['pattern_type'] for alert in alerts], return_inverse=True)
+        return {
+            'labels': labels, 'label_sizes': label_sizes,
+            'hints': hints, 'hint_sizes': hint_sizes,
+            'texts': self.text_vectors([self.alert_text(alert) for alert in alerts]),
+            'patterns': patterns.ravel(),
+            'severity': np.array([self.priority_weights.get(alert['severity'], 1) for alert in alerts],
+                                 dtype=np.float64)
+        }
 
-        return sum(w * s for w, s in zip(weights, similarities))
+    def similarity_block(self, features: Dict[str, Any], start: int, end: int) -> np.ndarray:
+        """Similarity of alerts start..end against all alerts, as a dense (end - start) x n block"""
+        def overlap(one_hot, sizes):
+            shared = (one_hot[start:end] @ one_hot.T).toarray()
+            largest = np.maximum.outer(sizes[start:end], sizes)
+            return np.divide(shared, largest, out=np.zeros_like(shared), where=largest > 0)
+
+        patterns, severity = features['patterns'], features['severity']
+        weights = self.similarity_weights
+        block = weights['labels'] * overlap(features['labels'], features['label_sizes'])
+        block += weights['pattern'] * (patterns[start:end, None] == patterns[None, :])
+        block += weights['severity'] * (1.0 - np.abs(severity[start:end, None] - severity[None, :]) / 10.0)
+        block += weights['hints'] * overlap(features['hints'], features['hint_sizes'])
+        # TF-IDF rows are L2-normalized, so their dot product is the cosine similarity
+        texts = features['texts']
+        block += weights['text'] * (texts[start:end] @ texts.T).toarray()
+        return block
+
+    def similarity_matrix(self, alerts: List[Dict[str, Any]]) -> np.ndarray:
+        """Pairwise similarity of all alerts as one dense matrix"""
+        return self.similarity_block(self.similarity_features(alerts), 0, len(alerts))
 
     def calculate_text_similarity(self, text1: str, text2: str) -> float:
         """Calculate text similarity using TF-IDF"""
-        try:
-            if not text1 or not text2:
-                return 0.0
-
-            vectors = self.vectorizer.fit_transform([text1, text2])
-            similarity = cosine_similarity(vectors[0:1], vectors[1:2])[0][0]
-            return float(similarity)
-        except:
+        if not text1 or not text2:
             return 0.0
+        return float(self.text_similarity_matrix([text1, text2])[0, 1])
+
+    def pair_similarities(self, alerts: List[Dict[str, Any]], rows: np.ndarray, cols: np.ndarray,
+                          chunk_size: int = 100000) -> np.ndarray:
+        """Similarity of the given (rows[k], cols[k]) alert pairs only, same terms as similarity_matrix"""
+        features = self.similarity_features(alerts)
+        texts, patterns, severity = features['texts'], features['patterns'], features['severity']
+
+        def overlap(one_hot, sizes, i, j):
+            shared = np.asarray(one_hot[i].multiply(one_hot[j]).sum(axis=1)).ravel()
+            largest = np.maximum(sizes[i], sizes[j])
+            return np.divide(shared, largest, out=np.zeros_like(shared), where=largest > 0)
+
+        weights = self.similarity_weights
+        similarities = np.empty(len(rows))
+        for start in range(0, len(rows), chunk_size):
+            i, j = rows[start:start + chunk_size], cols[start:start + chunk_size]
+            text_similarity = np.asarray(texts[i].multiply(texts[j]).sum(axis=1)).ravel()
+            similarities[start:start + chunk_size] = (
+                weights['labels'] * overlap(features['labels'], features['label_sizes'], i, j)
+                + weights['pattern'] * (patterns[i] == patterns[j])
+                + weights['severity'] * (1.0 - np.abs(severity[i] - severity[j]) / 10.0)
+                + weights['hints'] * overlap(features['hints'], features['hint_sizes'], i, j)
+                + weights['text'] * text_similarity
+            )
+        return similarities
+
+    def minhash_tokens(self, alert: Dict[str, Any]) -> set:
+        """Label pairs, correlation hints and alert name tokens"""
+        tokens = {f"label:{key}={value}" for key, value in alert['labels'].items()}
+        tokens.update(f"hint:{hint}" for hint in alert['correlation_hints'])
+        name_tokens = re.findall(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+', alert['name'])
+        tokens.update(f"name:{token.lower()}" for token in name_tokens or [alert['name']])
+        return tokens
+
+    def minhash_signatures(self, alerts: List[Dict[str, Any]], block: int = 8) -> np.ndarray:
+        """MinHash signature per alert, one column per hash function"""
+        token_sets = [self.minhash_tokens(alert) for alert in alerts]
+        sizes = np.array([len(tokens) for tokens in token_sets])
+        hashes = np.fromiter((zlib.crc32(token.encode()) for tokens in token_sets for token in tokens),
+                             dtype=np.uint64, count=int(sizes.sum()))
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        # Multiply-shift hashing; uint64 products wrap, the high 32 bits are the hash
+        multipliers, increments = self.minhash_seeds
+        signatures = np.empty((len(alerts), multipliers.size), dtype=np.uint64)
+        for start in range(0, multipliers.size, block):
+            end = start + block
+            permuted = (hashes[:, None] * multipliers[start:end] + increments[start:end]) >> np.uint64(32)
+            signatures[:, start:end] = np.minimum.reduceat(permuted, offsets, axis=0)
+        return signatures
+
+    def lsh_candidate_pairs(self, signatures: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Alert pairs (i < j) that share a bucket in at least one LSH band"""
+        n = len(signatures)
+        rows_per_band = self.grouping_rules['lsh_rows']
+        window = self.grouping_rules['lsh_bucket_window']
+        codes = []
+
+        for band in range(self.grouping_rules['lsh_bands']):
+            band_columns = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+            keys = band_columns[:, 0].copy()
+            for column in range(1, rows_per_band):
+                keys = keys * np.uint64(0x100000001B3) + band_columns[:, column]
+
+            # Within a bucket (in alert order) each alert is paired with its next `window`
+            # members, so a storm of identical alerts stays linear instead of quadratic
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            for distance in range(1, min(window, n - 1) + 1):
+                same = sorted_keys[:-distance] == sorted_keys[distance:]
+                first, second = order[:-distance][same], order[distance:][same]
+                codes.append(np.minimum(first, second).astype(np.int64) * n + np.maximum(first, second))
+
+        if not codes:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        codes = np.concatenate(codes)
+        codes.sort()
+        codes = codes[np.concatenate(([True], codes[1:] != codes[:-1]))]
+        return codes // n, codes % n
+
+    def similar_pairs(self, alerts: List[Dict[str, Any]]) -> csr_matrix:
+        """Symmetric boolean adjacency of alerts at or above the similarity threshold"""
+        n = len(alerts)
+        threshold = self.grouping_rules['similarity_threshold']
+
+        if n < self.grouping_rules['lsh_min_alerts']:
+            # Exact, but thresholded a block of rows at a time so no n x n matrix is held
+            features = self.similarity_features(alerts)
+            block_rows = self.grouping_rules['similarity_block_rows']
+            blocks = [csr_matrix(self.similarity_block(features, start, min(start + block_rows, n)) >= threshold)
+                      for start in range(0, n, block_rows)]
+            return vstack(blocks, format='csr') if blocks else csr_matrix((0, 0), dtype=bool)
+
+        rows, cols = self.lsh_candidate_pairs(self.minhash_signatures(alerts))
+        keep = self.pair_similarities(alerts, rows, cols) >= threshold
+        rows, cols = rows[keep], cols[keep]
+        similar = csr_matrix((np.ones(2 * len(rows), dtype=bool),
+                              (np.concatenate((rows, cols)), np.concatenate((cols, rows)))), shape=(n, n))
+        similar.sort_indices()
+        print(f"LSH scored {len(keep)} candidate pairs for {n} alerts ({keep.sum()} similar)")
+        return similar
 
     def group_alerts(self, alerts: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
         """Group similar alerts together"""
         groups = {}
-        ungrouped = alerts.copy()
+        if not alerts:
+            return groups
 
-        while ungrouped:
-            alert = ungrouped.pop(0)
-            group_id = f"group_{len(groups)}"
-            group = [alert]
+        for members in self.greedy_groups(alerts):
+            groups[f"group_{len(groups)}"] = [alerts[i] for i in members]
 
-            # Find similar alerts
-            i = 0
-            while i < len(ungrouped):
-                if len(group) >= self.grouping_rules['max_group_size']:
-                    break
+        return groups
 
-                similarity = self.calculate_alert_similarity(alert, ungrouped[i])
-                if similarity >= self.grouping_rules['similarity_threshold']:
-                    group.append(ungrouped.pop(i))
-                else:
-                    i += 1
+    def greedy_groups(self, alerts: List[Dict[str, Any]]) -> List[List[int]]:
+        """Indices of each group: every ungrouped alert, in order, takes the next similar ungrouped alerts"""
+        if not alerts:
+            return []
+
+        similar = self.similar_pairs(alerts)
+        grouped = np.zeros(len(alerts), dtype=bool)
+        groups = []
 
-            groups[group_id] = group
+        for seed in range(len(alerts)):
+            if grouped[seed]:
+                continue
+            grouped[seed] = True
+            neighbours = similar.indices[similar.indptr[seed]:similar.indptr[seed + 1]]
+            members = neighbours[~grouped[neighbours]][:self.grouping_rules['max_group_size'] - 1]
+            grouped[members] = True
+            groups.append([seed] + members.tolist())
 
         return groups
 
-    def correlate_alerts(self, groups: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
-        """Correlate alerts across groups to identify root causes"""
-        correlations = []
+    def alert_key(self, alert: Dict[str, Any]) -> str:
+        return alert.get('fingerprint') or alert['id']
+
+    def alert_signature(self, alert: Dict[str, Any]) -> str:
+        """Content that can change under a fingerprint (labels are part of the fingerprint)"""
+        content = json.dumps([alert['annotations'], alert['status'], alert['pattern_type']], sort_keys=True)
+        return hashlib.md5(content.encode()).hexdigest()
+
+    def remove_from_group(self, key: str, changed: set):
+        group_id = self.group_index.pop(key)
+        members = self.alert_groups[group_id]
+        del members[key]
+        if not members:
+            del self.alert_groups[group_id]
+        changed.add(group_id)
+
+    def update_groups(self, alerts: List[Dict[str, Any]]) -> Tuple[Dict[str, List[Dict[str, Any]]], set]:
+        """Fold this cycle's alerts into the persistent groups; return all groups and the ids that changed
+
+        Alerts are keyed by fingerprint. Resolved alerts leave their group,
+        unchanged ones keep it, and only new or changed alerts are grouped:
+        into the most similar existing group with room (compared with the
+        group's first member), otherwise into new groups among themselves.
+        Group ids are never reused, so they stay stable across cycles.
+        """
+        changed = set()
+        current = {self.alert_key(alert): alert for alert in alerts}
+
+        # Resolved alerts
+        for key in [key for key in self.group_index if key not in current]:
+            self.remove_from_group(key, changed)
+            del self.alert_signatures[key]
+
+        # Unchanged alerts only refresh their stored copy; changed ones are regrouped
+        pending = []
+        for key, alert in current.items():
+            signature = self.alert_signature(alert)
+            if key in self.group_index:
+                if self.alert_signatures[key] == signature:
+                    self.alert_groups[self.group_index[key]][key] = alert
+                    continue
+                self.remove_from_group(key, changed)
+            self.alert_signatures[key] = signature
+            pending.append(alert)
+
+        if pending:
+            max_size = self.grouping_rules['max_group_size']
+            open_groups = [group_id for group_id, members in self.alert_groups.items() if len(members) < max_size]
+            remaining = self.assign_to_groups(pending, open_groups, changed)
+
+            for members in self.greedy_groups(remaining):
+                group_id = f"group_{self.group_counter}"
+                self.group_counter += 1
+                self.alert_groups[group_id] = {}
+                for i in members:
+                    self.add_to_group(remaining[i], group_id)
+                changed.add(group_id)
+
+        groups = {group_id: list(members.values()) for group_id, members in self.alert_groups.items()}
+        return groups, changed
+
+    def add_to_group(self, alert: Dict[str, Any], group_id: str):
+        key = self.alert_key(alert)
+        self.alert_groups[group_id][key] = alert
+        self.group_index[key] = group_id
+
+    def assign_to_groups(self, pending: List[Dict[str, Any]], open_groups: List[str],
+                         changed: set) -> List[Dict[str, Any]]:
+        """Put pending alerts into their most similar open group; return the ones that fit none"""
+        if not open_groups:
+            return pending
+
+        # Scored against each group's first member; large batches only score LSH candidates
+        representatives = [next(iter(self.alert_groups[group_id].values())) for group_id in open_groups]
+        combined = representatives + pending
+        offset = len(representatives)
+        if len(combined) < self.grouping_rules['lsh_min_alerts']:
+            rows, cols = np.divmod(np.arange(len(pending) * offset), offset)
+            rows += offset
+        else:
+            first, second = self.lsh_candidate_pairs(self.minhash_signatures(combined))
+            across = (first < offset) & (second >= offset)
+            rows, cols = second[across], first[across]
+
+        similarities = self.pair_similarities(combined, rows, cols)
+        keep = similarities >= self.grouping_rules['similarity_threshold']
+        rows, cols, similarities = rows[keep], cols[keep], similarities[keep]
+
+        # Pending alerts in order, each to its most similar group that still has room
+        room = {group_id: self.grouping_rules['max_group_size'] - len(self.alert_groups[group_id])
+                for group_id in open_groups}
+        order = np.lexsort((-similarities, rows))
+        best: Dict[int, List[int]] = {}
+        for k in order.tolist():
+            best.setdefault(int(rows[k]) - offset, []).append(int(cols[k]))
+
+        remaining = []
+        for i, alert in enumerate(pending):
+            group_id = next((open_groups[col] for col in best.get(i, ()) if room[open_groups[col]] > 0), None)
+            if group_id is None:
+                remaining.append(alert)
+                continue
+            self.add_to_group(alert, group_id)
+            room[group_id] -= 1
+            changed.add(group_id)
+
+        return remaining
+
+    def correlate_alerts(self, groups: Dict[str, List[Dict[str, Any]]],
+                         changed_groups: Optional[set] = None) -> List[Dict[str, Any]]:
+        """Correlate alerts across groups to identify root causes
+
+        Results are cached per group pair; only pairs involving a group in
+        `changed_groups` (all pairs when it is None) are checked again.
+        """
+        if changed_groups is None:
+            self.group_correlations.clear()
+            changed_groups = set(groups)
+        else:
+            self.group_correlations = {
+                pair: correlation for pair, correlation in self.group_correlations.items()
+                if pair[0] not in changed_groups and pair[1] not in changed_groups
+            }
 
         group_list = list(groups.items())
         for i, (group_id1, alerts1) in enumerate(group_list):
-            for j, (group_id2, alerts2) in enumerate(group_list[i+1:], i+1):
+            for group_id2, alerts2 in group_list[i+1:]:
+                if group_id1 not in changed_groups and group_id2 not in changed_groups:
+                    continue
+
                 # Check temporal correlation
                 time_correlated = self.check_temporal_correlation(alerts1, alerts2)
 
@@ -246,14 +540,14 @@ class IntelligentAlertManager:
                 causal_correlated = self.check_causal_correlation(alerts1, alerts2)
 
                 if time_correlated or causal_correlated:
-                    correlations.append({
+                    self.group_correlations[(group_id1, group_id2)] = {
                         'group1': group_id1,
                         'group2': group_id2,
                         'type': 'temporal' if time_correlated else 'causal',
                         'confidence': 0.8 if time_correlated and causal_correlated else 0.6
-                    })
+                    }
 
-        return correlations
+        return list(self.group_correlations.values())
 
     def check_temporal_correlation(self, alerts1: List[Dict], alerts2: List[Dict]) -> bool:
         """Check if two alert groups are temporally correlated"""
@@ -425,10 +719,11 @@ class IntelligentAlertManager:
 
         # Fetch active alerts
         alerts = await self.fetch_active_alerts()
-        print(f"Fetched {len(alerts)} active alerts")
 
-        if not alerts:
+        # A failed fetch keeps the groups as they are; an empty one resolves them all
+        if alerts is None:
             return
+        print(f"Fetched {len(alerts)} active alerts")
 
         # Deduplicate alerts
         alerts = self.deduplicate_alerts(alerts)
@@ -438,28 +733,33 @@ class IntelligentAlertManager:
         alerts = self.apply_suppression_rules(alerts)
         print(f"After suppression: {len(alerts)} alerts")
 
-        # Group similar alerts
-        groups = self.group_alerts(alerts)
-        print(f"Created {len(groups)} alert groups")
+        # Fold new, changed and resolved alerts into the persistent groups
+        groups, changed_groups = self.update_groups(alerts)
+        resolved_groups = changed_groups - groups.keys()
+        print(f"Tracking {len(groups)} alert groups, {len(changed_groups)} changed this cycle, "
+              f"{len(resolved_groups)} resolved")
 
-        # Correlate alerts
-        correlations = self.correlate_alerts(groups)
+        # Correlate alerts, re-checking only pairs that involve a changed group
+        correlations = self.correlate_alerts(groups, changed_groups)
         print(f"Found {len(correlations)} correlations")
 
         # Generate summary
         summary = self.generate_alert_summary(groups, correlations)
 
-        # Store analysis
+        # Store only what changed: changed groups (empty when resolved) and their correlations
         analysis = {
-            'groups': {k: [a['id'] for a in v] for k, v in groups.items()},
-            'correlations': correlations,
+            'groups': {group_id: [a['id'] for a in groups.get(group_id, [])] for group_id in sorted(changed_groups)},
+            'correlations': [c for c in correlations
+                             if c['group1'] in changed_groups or c['group2'] in changed_groups],
             'summary': summary
         }
-        await self.store_alert_analysis(analysis)
+        if changed_groups:
+            await self.store_alert_analysis(analysis)
 
-        # Create grouped notifications
-        for group_id, group_alerts in groups.items():
-            await self.create_grouped_notification(group_id, group_alerts)
+        # Notify only groups whose membership or content changed
+        for group_id in sorted(changed_groups):
+            if group_id in groups:
+                await self.create_grouped_notification(group_id, groups[group_id])
 
         # Update history
         for alert in alerts:
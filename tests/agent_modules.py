@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Load the agent scripts (hyphenated file names) as modules for unit tests
+"""
+
+import importlib.util
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTS_DIR = os.path.join(REPO_DIR, 'agents')
+
+# Agents import their shared helpers (e.g. terminal_dashboard) by plain name
+if AGENTS_DIR not in sys.path:
+    sys.path.insert(0, AGENTS_DIR)
+
+def load_agent(relative_path, name=None):
+    """Import a script under the repo root once and return the module"""
+    name = name or os.path.splitext(os.path.basename(relative_path))[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    # Registered before executing so worker processes and pickling can find it
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test incremental alert grouping across cycles in the intelligent alert manager
+"""
+
+import asyncio
+
+from agent_modules import load_agent
+
+alert_manager = load_agent('intelligent-alert-manager.py')
+
+def raw_alert(index, service='api', description='service down', starts_at='2026-10-18T10:00:00Z'):
+    return {
+        'fingerprint': f'fp{index}',
+        'labels': {'alertname': f'ServiceDown{index}', 'severity': 'critical', 'service': service},
+        'annotations': {'description': description},
+        'status': {'state': 'active'},
+        'startsAt': starts_at
+    }
+
+def processed(manager, raw_alerts):
+    return [manager.process_alert(alert) for alert in raw_alerts]
+
+class RecordingManager(alert_manager.IntelligentAlertManager):
+    """Alert manager fed from a list instead of Alertmanager, keeping stored analyses"""
+
+    def __init__(self):
+        super().__init__()
+        self.fetched = []
+        self.stored = []
+
+    async def fetch_active_alerts(self):
+        return processed(self, self.fetched) if self.fetched is not None else None
+
+    async def store_alert_analysis(self, analysis):
+        self.stored.append(analysis)
+
+    async def create_grouped_notification(self, group_id, alerts):
+        pass
+
+def test_new_alerts_form_groups():
+    manager = alert_manager.IntelligentAlertManager()
+    groups, changed = manager.update_groups(processed(manager, [raw_alert(i) for i in range(4)]))
+
+    assert changed == set(groups)
+    assert sum(len(alerts) for alerts in groups.values()) == 4
+    assert set(manager.group_index) == {f'fp{i}' for i in range(4)}
+
+def test_unchanged_alerts_keep_their_group():
+    manager = alert_manager.IntelligentAlertManager()
+    alerts = [raw_alert(i) for i in range(4)]
+    first, _ = manager.update_groups(processed(manager, alerts))
+
+    second, changed = manager.update_groups(processed(manager, alerts))
+    assert changed == set()
+    assert set(second) == set(first)
+
+def test_resolved_alert_leaves_its_group():
+    manager = alert_manager.IntelligentAlertManager()
+    manager.update_groups(processed(manager, [raw_alert(i) for i in range(4)]))
+    group_id = manager.group_index['fp3']
+
+    groups, changed = manager.update_groups(processed(manager, [raw_alert(i) for i in range(3)]))
+    assert changed == {group_id}
+    assert 'fp3' not in manager.group_index
+    assert 'fp3' not in manager.alert_signatures
+
+def test_changed_alert_is_regrouped():
+    manager = alert_manager.IntelligentAlertManager()
+    manager.update_groups(processed(manager, [raw_alert(0), raw_alert(1)]))
+    old_group = manager.group_index['fp1']
+
+    changed_alert = raw_alert(1, description='unauthorized access attempt')
+    groups, changed = manager.update_groups(processed(manager, [raw_alert(0), changed_alert]))
+    assert old_group in changed
+    assert manager.group_index['fp1'] in changed
+
+def test_group_ids_are_not_reused():
+    manager = alert_manager.IntelligentAlertManager()
+    manager.update_groups(processed(manager, [raw_alert(0)]))
+    first_group = manager.group_index['fp0']
+    manager.update_groups([])
+
+    manager.update_groups(processed(manager, [raw_alert(1, service='db', description='disk threshold')]))
+    assert manager.group_index['fp1'] != first_group
+
+def test_groups_respect_max_size():
+    manager = alert_manager.IntelligentAlertManager()
+    size = manager.grouping_rules['max_group_size']
+    groups, _ = manager.update_groups(processed(manager, [raw_alert(i) for i in range(size * 2 + 1)]))
+    assert all(len(alerts) <= size for alerts in groups.values())
+
+    # Later identical alerts go to groups with room, never over the limit
+    groups, _ = manager.update_groups(processed(manager, [raw_alert(i) for i in range(size * 3)]))
+    assert all(len(alerts) <= size for alerts in groups.values())
+
+def test_empty_cycle_resolves_all_groups():
+    manager = RecordingManager()
+    manager.fetched = [raw_alert(i) for i in range(10)]
+    asyncio.run(manager.process_alerts())
+    tracked = set(manager.alert_groups)
+    assert tracked
+
+    manager.fetched = []
+    asyncio.run(manager.process_alerts())
+    assert manager.alert_groups == {}
+    assert manager.group_index == {}
+    # The resolved groups are reported with no members
+    assert manager.stored[-1]['groups'] == {group_id: [] for group_id in tracked}
+    assert manager.stored[-1]['summary']['total_groups'] == 0
+
+def test_failed_fetch_keeps_groups():
+    manager = RecordingManager()
+    manager.fetched = [raw_alert(i) for i in range(3)]
+    asyncio.run(manager.process_alerts())
+    tracked = dict(manager.group_index)
+    stored = len(manager.stored)
+
+    manager.fetched = None
+    asyncio.run(manager.process_alerts())
+    assert manager.group_index == tracked
+    assert len(manager.stored) == stored
+
+def test_unchanged_cycle_stores_nothing():
+    manager = RecordingManager()
+    manager.fetched = [raw_alert(i) for i in range(3)]
+    asyncio.run(manager.process_alerts())
+    stored = len(manager.stored)
+
+    asyncio.run(manager.process_alerts())
+    assert len(manager.stored) == stored
+
+def test_cached_correlations_match_full_recompute():
+    manager = alert_manager.IntelligentAlertManager()
+    services = ['api', 'db', 'cache', 'auth']
+    descriptions = ['service down', 'cpu threshold exceeded', 'slow latency', 'unauthorized access']
+    live = {i: raw_alert(i, services[i % 4], descriptions[i % 4], f'2026-10-18T{i % 24:02d}:00:00Z')
+            for i in range(40)}
+
+    for cycle in range(3):
+        for i in range(cycle * 7, cycle * 7 + 7):
+            live.pop(i, None)
+        for i in range(40 + cycle * 10, 50 + cycle * 10):
+            live[i] = raw_alert(i, services[i % 4], descriptions[(i // 4) % 4], f'2026-10-18T{i % 24:02d}:30:00Z')
+
+        groups, changed = manager.update_groups(processed(manager, list(live.values())))
+        cached = manager.correlate_alerts(groups, changed)
+        full = manager.correlate_alerts(groups)
+
+        key = lambda c: (c['group1'], c['group2'], c['type'], c['confidence'])
+        assert sorted(map(key, cached)) == sorted(map(key, full))
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
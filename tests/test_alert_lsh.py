@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test MinHash/LSH candidate generation for alert grouping in the intelligent alert manager
+"""
+
+import numpy as np
+
+from agent_modules import load_agent
+
+alert_manager = load_agent('intelligent-alert-manager.py')
+
+SERVICES = ['payments', 'checkout', 'search', 'inventory', 'auth', 'billing', 'shipping', 'profile']
+
+def storm(manager, clusters, per_cluster):
+    """Near-duplicate alerts: each cluster shares a service, alert name and description"""
+    alerts = []
+    for i in range(clusters * per_cluster):
+        cluster = i % clusters
+        service = SERVICES[cluster % len(SERVICES)]
+        alerts.append(manager.process_alert({
+            'fingerprint': f'fp{i}',
+            'labels': {'alertname': f'{service.title()}Latency{cluster}', 'severity': 'high',
+                       'service': service, 'cluster': str(cluster), 'pod': f'{service}-{i % 3}'},
+            'annotations': {'description': f'{service} latency degraded in zone {cluster}'},
+            'status': {'state': 'active'},
+            'startsAt': '2026-10-18T10:00:00Z'
+        }))
+    return alerts
+
+def lsh_manager(min_alerts=1):
+    manager = alert_manager.IntelligentAlertManager()
+    manager.grouping_rules['lsh_min_alerts'] = min_alerts
+    return manager
+
+def pair_set(rows, cols):
+    return set(zip(rows.tolist(), cols.tolist()))
+
+def test_minhash_tokens():
+    manager = alert_manager.IntelligentAlertManager()
+    alert = storm(manager, 1, 1)[0]
+    tokens = manager.minhash_tokens(alert)
+    assert 'label:service=payments' in tokens
+    assert {'name:payments', 'name:latency', 'name:0'} <= tokens
+
+def test_signatures_estimate_jaccard():
+    manager = alert_manager.IntelligentAlertManager()
+    alerts = storm(manager, 2, 2)
+    signatures = manager.minhash_signatures(alerts)
+    assert signatures.shape == (4, manager.grouping_rules['lsh_bands'] * manager.grouping_rules['lsh_rows'])
+    assert np.array_equal(signatures, manager.minhash_signatures(alerts))
+
+    tokens = [manager.minhash_tokens(alert) for alert in alerts]
+    for i, j in ((0, 2), (0, 1), (1, 3)):
+        jaccard = len(tokens[i] & tokens[j]) / len(tokens[i] | tokens[j])
+        estimate = np.mean(signatures[i] == signatures[j])
+        assert abs(estimate - jaccard) < 0.25, (i, j, jaccard, estimate)
+
+def test_candidates_pair_near_duplicates_only():
+    manager = lsh_manager()
+    alerts = storm(manager, 4, 5)
+    rows, cols = manager.lsh_candidate_pairs(manager.minhash_signatures(alerts))
+
+    assert np.all(rows < cols)
+    assert len(pair_set(rows, cols)) == len(rows)
+    # Every pair within a cluster shares a bucket somewhere
+    for i in range(len(alerts)):
+        for j in range(i + 1, len(alerts)):
+            if i % 4 == j % 4:
+                assert (i, j) in pair_set(rows, cols), (i, j)
+
+def test_identical_storm_stays_linear():
+    manager = lsh_manager()
+    manager.grouping_rules['lsh_bucket_window'] = 5
+    alerts = storm(manager, 1, 1) * 400
+    rows, cols = manager.lsh_candidate_pairs(manager.minhash_signatures(alerts))
+
+    # Each alert is paired with at most `window` neighbours instead of all 399
+    assert 0 < len(rows) <= 400 * 5
+    assert np.all(cols - rows <= 5)
+
+def test_pair_similarities_match_exact_matrix():
+    manager = alert_manager.IntelligentAlertManager()
+    alerts = storm(manager, 3, 4)
+    exact = manager.similarity_matrix(alerts)
+    rows, cols = np.triu_indices(len(alerts), k=1)
+    assert np.allclose(manager.pair_similarities(alerts, rows, cols), exact[rows, cols])
+
+def test_lsh_path_agrees_with_exact_path():
+    alerts = storm(alert_manager.IntelligentAlertManager(), 6, 8)
+    exact = alert_manager.IntelligentAlertManager()
+    approximate = lsh_manager()
+
+    exact_pairs = exact.similar_pairs(alerts)
+    lsh_pairs = approximate.similar_pairs(alerts)
+    # LSH only drops pairs, it never invents them; near-duplicates are all found
+    assert (lsh_pairs > exact_pairs).nnz == 0
+    assert lsh_pairs.nnz >= 0.9 * (exact_pairs.nnz - exact_pairs.diagonal().sum())
+    assert exact.greedy_groups(alerts) == approximate.greedy_groups(alerts)
+
+def test_assignment_to_open_groups_uses_candidates():
+    manager = lsh_manager()
+    first = storm(manager, 3, 3)
+    groups, _ = manager.update_groups(first)
+    assert sorted(len(members) for members in groups.values()) == [3, 3, 3]
+
+    # New alerts of an existing cluster join that cluster's group
+    late = storm(manager, 3, 4)[9:]
+    for alert in late:
+        alert['fingerprint'] = alert['fingerprint'] + '-late'
+    groups, changed = manager.update_groups(first + late)
+    assert sorted(len(members) for members in groups.values()) == [4, 4, 4]
+    assert len(changed) == 3
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
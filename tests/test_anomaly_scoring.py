@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test worker-pool anomaly scoring over shared memory in the metric labeling engine
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+class RecordingExecutor:
+    """Process pool that remembers every future it hands out"""
+
+    def __init__(self, workers):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = self.pool.submit(fn, *args)
+        self.futures.append(future)
+        return future
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+class ScoringHarness:
+    """The parts of MetricLabelingEngine that score_metrics uses"""
+
+    score_metrics = engine.MetricLabelingEngine.score_metrics
+
+    def __init__(self, workers=1, chunk_size=1):
+        self.compute_workers = workers
+        self.compute_chunk_size = chunk_size
+        self.compute_executor = RecordingExecutor(workers)
+        self.anomaly_models = engine.AnomalyModelStore(None)
+        self.shared_blocks = []
+
+    def share_series(self, metrics):
+        shm, bounds = engine.MetricLabelingEngine.share_series(self, metrics)
+        self.shared_blocks.append(shm.name)
+        return shm, bounds
+
+def metrics(count, length=50):
+    rng = np.random.default_rng(0)
+    return [{'name': f'metric_{i}', 'values': rng.normal(size=length)} for i in range(count)]
+
+def block_exists(name):
+    try:
+        shared_memory.SharedMemory(name=name).close()
+        return True
+    except FileNotFoundError:
+        return False
+
+def test_scores_every_metric():
+    harness = ScoringHarness(workers=2, chunk_size=3)
+    try:
+        async def collect():
+            return [item async for item in harness.score_metrics(metrics(10))]
+
+        results = asyncio.run(collect())
+        assert sorted(index for index, _ in results) == list(range(10))
+        assert all('has_anomalies' in info for _, info in results)
+        assert not block_exists(harness.shared_blocks[0])
+    finally:
+        harness.compute_executor.shutdown()
+
+def test_early_exit_waits_for_chunks_before_unlinking():
+    harness = ScoringHarness(workers=1, chunk_size=1)
+    try:
+        async def first_then_stop():
+            scores = harness.score_metrics(metrics(20, length=2000))
+            try:
+                async for item in scores:
+                    raise RuntimeError("consumer failed")
+            finally:
+                await scores.aclose()
+
+        try:
+            asyncio.run(first_then_stop())
+        except RuntimeError:
+            pass
+
+        futures = harness.compute_executor.futures
+        assert all(future.done() for future in futures)
+        # Queued chunks were dropped; none that ran failed to attach to the block
+        assert any(future.cancelled() for future in futures)
+        assert all(future.exception() is None for future in futures if not future.cancelled())
+        assert not block_exists(harness.shared_blocks[0])
+    finally:
+        harness.compute_executor.shutdown()
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
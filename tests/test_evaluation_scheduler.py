@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test severity-adaptive re-evaluation scheduling in the metric labeling engine
+"""
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+def labels(name, severity='low', anomalous=False):
+    return {'metric_name': name, 'severity': severity, 'anomalies': {'has_anomalies': anomalous}}
+
+def test_new_metrics_are_always_due():
+    scheduler = engine.EvaluationScheduler()
+    assert sorted(scheduler.take_due(['a', 'b'], now=0)) == ['a', 'b']
+
+    scheduler.reschedule(labels('a'), changed=False, now=0)
+    assert scheduler.take_due(['a', 'c'], now=1) == ['c']
+
+def test_stable_metrics_back_off_to_max_interval():
+    scheduler = engine.EvaluationScheduler(min_interval=60, max_interval=500, backoff=2.0)
+    now = 0
+    intervals = []
+    for _ in range(6):
+        interval = scheduler.reschedule(labels('disk'), changed=False, now=now)
+        intervals.append(interval)
+        now += interval
+        assert scheduler.take_due(['disk'], now=now - 1) == []
+        assert scheduler.take_due(['disk'], now=now) == ['disk']
+    assert intervals == [120, 240, 480, 500, 500, 500]
+
+def test_urgent_anomalous_or_changed_metrics_reset_to_min_interval():
+    scheduler = engine.EvaluationScheduler(min_interval=60, max_interval=1800)
+    for _ in range(5):
+        scheduler.reschedule(labels('cpu'), changed=False, now=0)
+    assert scheduler.schedule['cpu'][1] == 1800
+
+    assert scheduler.reschedule(labels('cpu', severity='critical'), changed=False, now=0) == 60
+    scheduler.reschedule(labels('cpu'), changed=False, now=0)
+    assert scheduler.reschedule(labels('cpu', anomalous=True), changed=False, now=0) == 60
+    scheduler.reschedule(labels('cpu'), changed=False, now=0)
+    assert scheduler.reschedule(labels('cpu'), changed=True, now=0) == 60
+
+def test_due_metrics_come_most_overdue_first():
+    scheduler = engine.EvaluationScheduler(min_interval=60)
+    for name, start in (('late', 0), ('later', 10), ('latest', 20)):
+        scheduler.reschedule(labels(name, severity='high'), changed=False, now=start)
+
+    assert scheduler.take_due(['latest', 'late', 'later', 'new'], now=100) == ['new', 'late', 'later', 'latest']
+
+def test_limit_keeps_the_rest_queued():
+    scheduler = engine.EvaluationScheduler(min_interval=60)
+    names = [f'm{i}' for i in range(5)]
+    for i, name in enumerate(names):
+        scheduler.reschedule(labels(name, severity='high'), changed=False, now=i)
+
+    assert scheduler.take_due(names, now=100, limit=2) == ['m0', 'm1']
+    assert scheduler.take_due(names, now=100, limit=2) == ['m2', 'm3']
+    assert scheduler.take_due(names, now=100) == ['m4']
+
+def test_due_metrics_without_data_stay_queued_until_expired():
+    scheduler = engine.EvaluationScheduler(min_interval=60, expire_after=1000)
+    scheduler.reschedule(labels('gone', severity='high'), changed=False, now=0)
+
+    assert scheduler.take_due([], now=500) == []
+    assert 'gone' in scheduler.schedule
+    assert scheduler.take_due(['gone'], now=600) == ['gone']
+
+    scheduler.reschedule(labels('gone', severity='high'), changed=False, now=600)
+    assert scheduler.take_due([], now=600 + 60 + 1001) == []
+    assert 'gone' not in scheduler.schedule
+    # Once expired it is treated as new again
+    assert scheduler.take_due(['gone'], now=5000) == ['gone']
+
+def test_rescheduling_supersedes_queued_entries():
+    scheduler = engine.EvaluationScheduler(min_interval=60, max_interval=1800)
+    scheduler.reschedule(labels('cpu', severity='high'), changed=False, now=0)
+    scheduler.reschedule(labels('cpu'), changed=False, now=0)
+
+    # The stale entry due at 60 is skipped; only the newer one counts
+    assert scheduler.take_due(['cpu'], now=100) == []
+    assert scheduler.take_due(['cpu'], now=120) == ['cpu']
+
+    stats = scheduler.get_stats()
+    assert stats['scheduled'] == 1 and stats['mean_interval'] == 120
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
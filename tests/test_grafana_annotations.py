@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test Grafana annotation retry handling in the metric labeling engine
+"""
+
+import asyncio
+
+import aiohttp
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+class StubResponse:
+    def __init__(self, status, body=None):
+        self.status = status
+        self.body = body
+
+    async def json(self, content_type=None):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class StubSession:
+    """Answers every request with `status`, or raises when status is None"""
+
+    def __init__(self, status, body=None):
+        self.status = status
+        self.body = body
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        if self.status is None:
+            raise aiohttp.ClientConnectionError("connection refused")
+        return StubResponse(self.status, self.body)
+
+def open_region(session, now=1000.0):
+    async def get_session():
+        return session
+
+    manager = engine.GrafanaAnnotationManager('http://grafana', get_session)
+    manager.observe({'metric_name': 'cpu_usage', 'severity': 'critical', 'auto_tags': ['cpu']}, now)
+    return manager
+
+def flush(manager, now=1000.0):
+    asyncio.run(manager.flush(now))
+
+def test_created_region_is_not_requeued():
+    session = StubSession(200, {'id': 42})
+    manager = open_region(session)
+    flush(manager)
+
+    assert session.requests == [('POST', 'http://grafana/api/annotations')]
+    assert manager.regions['cpu_usage']['id'] == 42
+    assert not manager.pending
+
+def test_server_error_is_retried():
+    for status in (500, 503, 429):
+        session = StubSession(status)
+        manager = open_region(session)
+        flush(manager)
+        assert manager.pending == {'cpu_usage'}, status
+
+        # The next flush sends it again and succeeds
+        session.status, session.body = 201, {'id': 7}
+        flush(manager)
+        assert len(session.requests) == 2
+        assert manager.regions['cpu_usage']['id'] == 7
+        assert not manager.pending
+
+def test_connection_error_is_retried():
+    manager = open_region(StubSession(None))
+    flush(manager)
+    assert manager.pending == {'cpu_usage'}
+
+def test_client_error_is_dropped():
+    for status in (400, 401, 403):
+        session = StubSession(status)
+        manager = open_region(session)
+        flush(manager)
+        assert not manager.pending, status
+
+        flush(manager)
+        assert len(session.requests) == 1
+        assert manager.stats['failed'] == 1
+
+def test_deleted_annotation_is_recreated():
+    session = StubSession(200, {'id': 42})
+    manager = open_region(session)
+    flush(manager)
+
+    # Escalation forces a PATCH, which finds the annotation gone
+    manager.regions['cpu_usage']['severity'] = 'high'
+    manager.observe({'metric_name': 'cpu_usage', 'severity': 'critical'}, 1010.0)
+    session.status = 404
+    flush(manager, 1010.0)
+    assert manager.regions['cpu_usage']['id'] is None
+    assert manager.pending == {'cpu_usage'}
+
+    session.status, session.body = 200, {'id': 43}
+    flush(manager, 1010.0)
+    assert session.requests[-1] == ('POST', 'http://grafana/api/annotations')
+    assert manager.regions['cpu_usage']['id'] == 43
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
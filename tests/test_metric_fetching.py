@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Test bounded-concurrency, batched metric fetching in the metric labeling engine
+"""
+
+import asyncio
+import json
+import re
+from datetime import datetime
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+class StubResponse:
+    def __init__(self, session, status, body):
+        self.session = session
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        self.session.in_flight += 1
+        self.session.peak = max(self.session.peak, self.session.in_flight)
+        await asyncio.sleep(0.001)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.session.in_flight -= 1
+
+    async def read(self):
+        return json.dumps(self.body).encode()
+
+class StubPrometheus:
+    """Session answering label-values and query_range requests for a fixed set of metric names"""
+
+    def __init__(self, names, reject=None):
+        self.names = names
+        # Optional predicate on the requested names; matching batches get HTTP 422
+        self.reject = reject or (lambda names: False)
+        self.queries = []
+        self.in_flight = 0
+        self.peak = 0
+
+    def get(self, url, params=None, timeout=None):
+        if url.endswith('/api/v1/label/__name__/values'):
+            return StubResponse(self, 200, {'status': 'success', 'data': self.names})
+
+        names = re.fullmatch(r'\{__name__=~"(.*)"\}', params['query']).group(1).split('|')
+        self.queries.append((names, float(params['start']), float(params['end'])))
+        if self.reject(names):
+            return StubResponse(self, 422, {})
+        result = [{'metric': {'__name__': name, 'instance': instance},
+                   'values': [[1000.0, '1'], [1015.0, str(len(name))]]}
+                  for name in names for instance in ('a', 'b')]
+        return StubResponse(self, 200, {'status': 'success', 'data': {'result': result}})
+
+class FetchHarness:
+    """The parts of MetricLabelingEngine that fetch_metrics uses"""
+
+    fetch_metrics = engine.MetricLabelingEngine.fetch_metrics
+    fetch_metric_batch = engine.MetricLabelingEngine.fetch_metric_batch
+    plan_fetch_batches = engine.MetricLabelingEngine.plan_fetch_batches
+    fetch_json = engine.MetricLabelingEngine.fetch_json
+    request_json = engine.MetricLabelingEngine.request_json
+    owns_metric = engine.MetricLabelingEngine.owns_metric
+
+    def __init__(self, session, concurrency=4, max_selector_length=4000):
+        self.session = session
+        self.prometheus_url = 'http://prometheus'
+        self.fetch_concurrency = concurrency
+        self.fetch_timeout = 5
+        self.fetch_retries = 0
+        self.fetch_in_flight = 0
+        self.query_window = 300
+        self.query_step = 15
+        self.max_selector_length = max_selector_length
+        self.max_batch_samples = 500000
+        self.series_cardinality = {}
+        self.series_stats = engine.StreamingStatsStore(None, window=self.query_window)
+        self.telemetry = engine.CycleTelemetry()
+        self.shard = None
+
+    async def get_http_session(self):
+        return self.session
+
+def names(count):
+    return [f'service_metric_{i}_total' for i in range(count)]
+
+def test_fetches_every_metric_with_bounded_concurrency():
+    prometheus = StubPrometheus(names(200) + ['invalid-name'])
+    harness = FetchHarness(prometheus, concurrency=3, max_selector_length=200)
+    metrics = asyncio.run(harness.fetch_metrics())
+
+    assert sorted(metric['name'] for metric in metrics) == sorted(names(200))
+    assert len(prometheus.queries) > 3
+    assert prometheus.peak <= 3
+    assert all(len('|'.join(batch)) <= 200 for batch, _, _ in prometheus.queries)
+
+    metric = next(metric for metric in metrics if metric['name'] == 'service_metric_7_total')
+    assert metric['series'] == [('service_metric_7_total{instance="a"}', 2),
+                                ('service_metric_7_total{instance="b"}', 2)]
+    assert metric['values'].tolist() == [1.0, 22.0, 1.0, 22.0]
+    assert harness.series_cardinality['service_metric_7_total'] == 2
+
+def test_batches_follow_learned_cardinality():
+    harness = FetchHarness(None)
+    harness.max_batch_samples = 21 * 10
+    harness.series_cardinality = {'big_metric': 10}
+    batches = harness.plan_fetch_batches(['small_a', 'big_metric', 'small_b', 'bad name'])
+    assert batches == [['small_a'], ['big_metric'], ['small_b']]
+
+def test_rejected_batches_are_split():
+    prometheus = StubPrometheus(names(8), reject=lambda batch: len(batch) > 2)
+    metrics = asyncio.run(FetchHarness(prometheus).fetch_metrics())
+
+    assert sorted(metric['name'] for metric in metrics) == sorted(names(8))
+    assert max(len(batch) for batch, _, _ in prometheus.queries[1:]) <= 4
+
+def test_unsplittable_failures_drop_only_that_metric():
+    prometheus = StubPrometheus(names(4), reject=lambda batch: 'service_metric_2_total' in batch)
+    metrics = asyncio.run(FetchHarness(prometheus).fetch_metrics())
+    assert sorted(metric['name'] for metric in metrics) == sorted(set(names(4)) - {'service_metric_2_total'})
+
+def test_fetch_starts_where_the_last_one_ended():
+    prometheus = StubPrometheus(names(3))
+    harness = FetchHarness(prometheus)
+    now = datetime.utcnow().timestamp()
+    for name, age in zip(names(3), (50, 120, 80)):
+        harness.series_stats.fetched_until[name] = now - age
+    asyncio.run(harness.fetch_metrics())
+
+    # One batch: it starts at the earliest missing sample among its metrics
+    (_, start, end), = prometheus.queries
+    assert 120 <= end - start < 130
+
+def test_name_listing_failure_returns_nothing():
+    class FailingPrometheus(StubPrometheus):
+        def get(self, url, params=None, timeout=None):
+            return StubResponse(self, 403, {})
+
+    assert asyncio.run(FetchHarness(FailingPrometheus([])).fetch_metrics()) == []
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Test pcap/pcapng reading, TCP decoding and stream reassembly in the packet traffic analyzer
+"""
+
+import json
+import os
+import socket
+import struct
+import tempfile
+
+from agent_modules import load_agent
+
+analyzer = load_agent('agents/packet-traffic-analyzer.py')
+
+CLIENT = ('10.0.0.1', 40000)
+SERVER = ('10.0.0.2', 19999)
+
+def tcp_frame(src, dst, seq, payload=b'', flags=0x18, total_length=None):
+    """Ethernet + IPv4 + TCP frame"""
+    tcp = struct.pack('!HHIIBBHHH', src[1], dst[1], seq, 0, 0x50, flags, 65535, 0, 0)
+    if total_length is None:
+        total_length = 20 + len(tcp) + len(payload)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, total_length, 0, 0x4000, 64, 6, 0,
+                     socket.inet_aton(src[0]), socket.inet_aton(dst[0]))
+    return b'\0' * 12 + b'\x08\x00' + ip + tcp + payload
+
+def ts_frame(packet):
+    body = json.dumps(packet).encode()
+    return struct.pack('!I', len(body)) + body
+
+def write_pcap(path, records, magic=analyzer.PCAP_MAGIC_USEC, endian='<'):
+    with open(path, 'wb') as f:
+        f.write(struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, analyzer.LINKTYPE_ETHERNET))
+        for ts_sec, ts_frac, frame in records:
+            f.write(struct.pack(endian + 'IIII', ts_sec, ts_frac, len(frame), len(frame)))
+            f.write(frame)
+
+def pcapng_block(block_type, body):
+    body += b'\0' * (-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+def pcapng_shb():
+    return pcapng_block(analyzer.PCAPNG_SHB, struct.pack('<IHHq', analyzer.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+
+def pcapng_idb(tsresol=None):
+    options = b''
+    if tsresol is not None:
+        options = struct.pack('<HHB3x', 9, 1, tsresol) + struct.pack('<HH', 0, 0)
+    return pcapng_block(analyzer.PCAPNG_IDB, struct.pack('<HHI', analyzer.LINKTYPE_ETHERNET, 0, 65535) + options)
+
+def pcapng_epb(interface_id, timestamp_units, frame):
+    header = struct.pack('<IIIII', interface_id, timestamp_units >> 32, timestamp_units & 0xFFFFFFFF,
+                         len(frame), len(frame))
+    return pcapng_block(analyzer.PCAPNG_EPB, header + frame)
+
+def temp_capture(data):
+    fd, path = tempfile.mkstemp(suffix='.pcap')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+def read_all(path):
+    reader = analyzer.PcapReader(path)
+    return reader, list(reader)
+
+def test_classic_pcap_microseconds_and_nanoseconds():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'x')
+    for magic, frac, expected in ((analyzer.PCAP_MAGIC_USEC, 250000, 10.25),
+                                  (analyzer.PCAP_MAGIC_NSEC, 500000000, 10.5)):
+        for endian in ('<', '>'):
+            path = temp_capture(b'')
+            try:
+                write_pcap(path, [(10, frac, frame)], magic, endian)
+                _, records = read_all(path)
+                assert len(records) == 1
+                timestamp, linktype, data = records[0]
+                assert abs(timestamp - expected) < 1e-9
+                assert linktype == analyzer.LINKTYPE_ETHERNET
+                assert data == frame
+            finally:
+                os.remove(path)
+
+def test_classic_pcap_truncated_record_stops():
+    path = temp_capture(b'')
+    try:
+        frame = tcp_frame(CLIENT, SERVER, 1, b'abc')
+        write_pcap(path, [(1, 0, frame), (2, 0, frame)])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 5)
+        reader, records = read_all(path)
+        assert len(records) == 1
+        assert reader.warned
+    finally:
+        os.remove(path)
+
+def test_pcapng_resolution_and_packets():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'hello')
+    path = temp_capture(pcapng_shb() + pcapng_idb() + pcapng_idb(tsresol=9)
+                        + pcapng_epb(0, 1500000, frame) + pcapng_epb(1, 2500000000, frame))
+    try:
+        _, records = read_all(path)
+        assert [round(timestamp, 6) for timestamp, _, _ in records] == [1.5, 2.5]
+        assert all(data == frame for _, _, data in records)
+    finally:
+        os.remove(path)
+
+def test_pcapng_undeclared_interface_is_skipped():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'hello')
+    path = temp_capture(pcapng_shb() + pcapng_idb() + pcapng_epb(3, 1000000, frame)
+                        + pcapng_epb(0, 2000000, frame))
+    try:
+        reader, records = read_all(path)
+        assert len(records) == 1
+        assert reader.skipped == 1
+    finally:
+        os.remove(path)
+
+def test_pcapng_packet_before_interface_is_skipped():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'hello')
+    path = temp_capture(pcapng_shb() + pcapng_epb(0, 1000000, frame))
+    try:
+        reader, records = read_all(path)
+        assert records == []
+        assert reader.skipped == 1
+    finally:
+        os.remove(path)
+
+def test_pcapng_corrupt_block_length_stops():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'hello')
+    good = pcapng_shb() + pcapng_idb() + pcapng_epb(0, 1000000, frame)
+    for bad_length in (0, 4, 8, 37):
+        bad_block = struct.pack('<II', analyzer.PCAPNG_EPB, bad_length) + b'\0' * 40
+        path = temp_capture(good + bad_block + pcapng_epb(0, 2000000, frame))
+        try:
+            reader, records = read_all(path)
+            assert len(records) == 1, bad_length
+            assert reader.warned
+        finally:
+            os.remove(path)
+
+def test_pcapng_truncated_block_stops():
+    frame = tcp_frame(CLIENT, SERVER, 1, b'hello')
+    path = temp_capture(pcapng_shb() + pcapng_idb() + pcapng_epb(0, 1000000, frame)[:-10])
+    try:
+        _, records = read_all(path)
+        assert records == []
+    finally:
+        os.remove(path)
+
+def test_decode_tcp_segment():
+    frame = tcp_frame(CLIENT, SERVER, 7, b'payload')
+    assert analyzer.decode_tcp_segment(analyzer.LINKTYPE_ETHERNET, frame) == (
+        CLIENT[0], CLIENT[1], SERVER[0], SERVER[1], 7, 0x18, b'payload')
+
+    # Ethernet padding past the IP total length is not payload
+    assert analyzer.decode_tcp_segment(analyzer.LINKTYPE_ETHERNET, frame + b'\0' * 6)[-1] == b'payload'
+
+    # Offloaded segments carry a zero total length
+    offloaded = tcp_frame(CLIENT, SERVER, 7, b'payload', total_length=0)
+    assert analyzer.decode_tcp_segment(analyzer.LINKTYPE_ETHERNET, offloaded)[-1] == b'payload'
+
+def test_decode_tcp_segment_rejects_truncated_frames():
+    frame = tcp_frame(CLIENT, SERVER, 7, b'payload')
+    header_length = 14 + 20 + 20
+    for length in range(header_length):
+        assert analyzer.decode_tcp_segment(analyzer.LINKTYPE_ETHERNET, frame[:length]) is None
+
+def test_reassembly_handles_order_retransmits_and_split_frames():
+    reassembler = analyzer.TCPStreamReassembler()
+    key = (CLIENT[0], CLIENT[1], SERVER[0], SERVER[1])
+    stream = ts_frame({'type': 'cmd'}) + ts_frame({'type': 'list'})
+
+    assert reassembler.add_segment(key, 99, reassembler.TCP_SYN, b'') == []
+    first, second, third = stream[:10], stream[10:25], stream[25:]
+
+    # Out of order: nothing is complete until the gap is filled
+    assert reassembler.add_segment(key, 100 + 25, 0x18, third) == []
+    frames = reassembler.add_segment(key, 100, 0x18, first)
+    assert frames == []
+    frames = reassembler.add_segment(key, 100 + 10, 0x18, second)
+    assert [json.loads(frame)['type'] for frame in frames] == ['cmd', 'list']
+
+    # A retransmission of delivered data yields nothing new
+    assert reassembler.add_segment(key, 100, 0x18, first) == []
+
+def test_reassembly_wraps_sequence_numbers():
+    reassembler = analyzer.TCPStreamReassembler()
+    key = (CLIENT[0], CLIENT[1], SERVER[0], SERVER[1])
+    data = ts_frame({'type': 'hb'})
+    start = 0xFFFFFFFF - 5
+
+    reassembler.add_segment(key, start - 1, reassembler.TCP_SYN, b'')
+    assert reassembler.add_segment(key, start, 0x18, data[:8]) == []
+    frames = reassembler.add_segment(key, (start + 8) & 0xFFFFFFFF, 0x18, data[8:])
+    assert [json.loads(frame)['type'] for frame in frames] == ['hb']
+
+def test_pcap_analysis_pairs_requests_and_responses():
+    request = ts_frame({'type': 'cmd', 'session_id': 'dev', 'packet_id': 'p1'})
+    response = ts_frame({'type': 'res', 'session_id': 'dev', 'reply_to': 'p1'})
+    path = temp_capture(b'')
+    try:
+        write_pcap(path, [
+            (100, 0, tcp_frame(CLIENT, SERVER, 1000, request)),
+            (100, 250000, tcp_frame(SERVER, CLIENT, 5000, response)),
+            # Garbage that is not TCP at all
+            (101, 0, b'\0' * 17),
+        ])
+        pcap = analyzer.PcapTrafficAnalyzer(path)
+        pcap.ingest()
+        stats = pcap.get_stats()
+
+        assert pcap.captured_frames == 3
+        assert stats['total_packets'] == 2
+        assert stats['packet_types'] == {'cmd': 1, 'res': 1}
+        assert abs(stats['avg_response_time'] - 0.25) < 1e-6
+    finally:
+        os.remove(path)
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
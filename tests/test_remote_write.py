@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Test the Prometheus remote_write decoding and receiver in the metric labeling engine
+"""
+
+import asyncio
+import struct
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def field(number, wire_type, payload):
+    key = varint(number << 3 | wire_type)
+    if wire_type == 2:
+        return key + varint(len(payload)) + payload
+    return key + payload
+
+def write_request(series):
+    """WriteRequest protobuf for [(labels, [(timestamp ms, value), ...]), ...]"""
+    body = b''
+    for labels, samples in series:
+        message = b''
+        for name, value in labels.items():
+            message += field(1, 2, field(1, 2, name.encode()) + field(2, 2, value.encode()))
+        for timestamp, value in samples:
+            sample = field(1, 1, struct.pack('<d', value)) + field(2, 0, varint(timestamp & (1 << 64) - 1))
+            message += field(2, 2, sample)
+        body += field(1, 2, message)
+    return body
+
+def snappy_literal(data):
+    """Uncompressed snappy block: one literal element"""
+    size = len(data) - 1
+    if size < 60:
+        tag = bytes([size << 2])
+    else:
+        extra = (size.bit_length() + 7) // 8
+        tag = bytes([(59 + extra) << 2]) + size.to_bytes(extra, 'little')
+    return varint(len(data)) + tag + data
+
+def pure_python_snappy(fn):
+    """Run fn with the optional python-snappy binding disabled"""
+    def wrapper():
+        saved, engine.snappy = engine.snappy, None
+        try:
+            fn()
+        finally:
+            engine.snappy = saved
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
+def test_varint():
+    for value in (0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1):
+        assert engine.read_varint(varint(value) + b'rest', 0) == (value, len(varint(value)))
+    for bad in (b'', b'\x80', b'\xff' * 11):
+        try:
+            engine.read_varint(bad, 0)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} must be rejected")
+
+@pure_python_snappy
+def test_snappy_literals():
+    for data in (b'a', b'x' * 59, b'y' * 60, bytes(range(256)) * 300):
+        assert engine.snappy_decompress(snappy_literal(data)) == data
+
+@pure_python_snappy
+def test_snappy_copies():
+    # "abcd" literal, then a 1-byte-offset copy of 8 bytes at offset 4 (overlapping)
+    block = varint(12) + bytes([3 << 2]) + b'abcd' + bytes([0b001 | (8 - 4) << 2, 4])
+    assert engine.snappy_decompress(block) == b'abcdabcdabcd'
+
+    # 2-byte-offset copy of 3 bytes from offset 2 (overlapping by one)
+    block = varint(5) + bytes([1 << 2]) + b'ab' + bytes([0b10 | (3 - 1) << 2]) + (2).to_bytes(2, 'little')
+    assert engine.snappy_decompress(block) == b'ababa'
+
+    # 4-byte-offset copy
+    block = varint(6) + bytes([2 << 2]) + b'xyz' + bytes([0b11 | (3 - 1) << 2]) + (3).to_bytes(4, 'little')
+    assert engine.snappy_decompress(block) == b'xyzxyz'
+
+@pure_python_snappy
+def test_snappy_rejects_corrupt_blocks():
+    corrupt = [
+        varint(10) + bytes([9 << 2]) + b'short',                    # truncated literal
+        varint(4) + bytes([0b001 | (4 - 4) << 2, 1]),               # copy before any output
+        varint(3) + bytes([1 << 2]) + b'ab',                        # wrong declared length
+    ]
+    for block in corrupt:
+        try:
+            engine.snappy_decompress(block)
+        except ValueError:
+            continue
+        raise AssertionError(f"{block!r} must be rejected")
+
+def test_parse_write_request():
+    body = write_request([
+        ({'__name__': 'http_requests_total', 'job': 'api', 'instance': 'a'},
+         [(1700000000000, 1.5), (1700000015000, 2.5)]),
+        ({'__name__': 'up', 'job': 'api'}, [(-1000, 1.0)]),
+        # Series without a name or without samples are dropped
+        ({'job': 'orphan'}, [(0, 1.0)]),
+        ({'__name__': 'empty'}, []),
+    ])
+    # Unknown WriteRequest fields (e.g. metadata) are skipped
+    body += field(3, 2, b'\x0a\x03foo')
+
+    series = engine.parse_write_request(body)
+    assert series == [
+        ({'__name__': 'http_requests_total', 'job': 'api', 'instance': 'a'},
+         [1700000000.0, 1700000015.0], [1.5, 2.5]),
+        ({'__name__': 'up', 'job': 'api'}, [-1.0], [1.0]),
+    ]
+    assert engine.series_key(series[0][0]) == 'http_requests_total{instance="a",job="api"}'
+
+def test_parse_write_request_rejects_truncation():
+    body = write_request([({'__name__': 'up'}, [(1000, 1.0)])])
+    try:
+        engine.parse_write_request(body[:-3])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a truncated WriteRequest must be rejected")
+
+class StubEngine:
+    def __init__(self):
+        self.pushed = []
+
+    def ingest_pushed_series(self, series, now):
+        self.pushed.extend(series)
+        return {labels['__name__']: labels for labels, _, _ in series}
+
+class StubRequest:
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+
+    async def read(self):
+        return self.body
+
+@pure_python_snappy
+def test_receiver_accepts_and_rejects_writes():
+    stub = StubEngine()
+    receiver = engine.RemoteWriteReceiver(stub)
+    body = write_request([({'__name__': 'up', 'job': 'a'}, [(1000, 1.0), (2000, 0.0)])])
+
+    response = asyncio.run(receiver.handle_write(StubRequest(snappy_literal(body))))
+    assert response.status == 204
+    assert receiver.pending == {'up': {'__name__': 'up', 'job': 'a'}}
+    assert receiver.stats['samples'] == 2
+
+    # Uncompressed bodies are accepted when declared
+    response = asyncio.run(receiver.handle_write(StubRequest(body, {'Content-Encoding': 'identity'})))
+    assert response.status == 204 and len(stub.pushed) == 2
+
+    response = asyncio.run(receiver.handle_write(StubRequest(b'\x05garbage')))
+    assert response.status == 400
+    assert receiver.stats == {'requests': 3, 'rejected': 1, 'series': 2, 'samples': 4, 'labeled': 0}
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
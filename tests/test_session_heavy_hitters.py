@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test the Space-Saving session top-K tracker in the packet traffic analyzer
+"""
+
+import random
+from collections import Counter
+
+from agent_modules import load_agent
+
+analyzer = load_agent('agents/packet-traffic-analyzer.py')
+
+def check_invariants(tracker):
+    """Buckets mirror counts and min_count is the smallest tracked count"""
+    assert len(tracker) <= tracker.capacity
+    rebuilt = {}
+    for session_id, count in tracker.counts.items():
+        rebuilt.setdefault(count, set()).add(session_id)
+    assert {count: set(bucket) for count, bucket in tracker.buckets.items()} == rebuilt
+    if tracker.counts:
+        assert tracker.min_count == min(tracker.counts.values())
+
+def test_exact_below_capacity():
+    tracker = analyzer.SessionHeavyHitters(capacity=10)
+    stream = ['a'] * 5 + ['b'] * 3 + ['c']
+    for session_id in stream:
+        tracker.add(session_id, 100)
+
+    top = tracker.top(3)
+    assert [(entry['session'], entry['packets'], entry['error']) for entry in top] == [
+        ('a', 5, 0), ('b', 3, 0), ('c', 1, 0)]
+    assert top[0]['bytes'] == 500
+    assert tracker.evictions == 0
+    check_invariants(tracker)
+
+def test_memory_is_bounded_and_heavy_hitters_survive():
+    rng = random.Random(7)
+    tracker = analyzer.SessionHeavyHitters(capacity=16)
+    truth = Counter()
+
+    # Three heavy sessions buried in a long tail of one-off sessions
+    stream = [f'heavy{i}' for i in range(3) for _ in range(400)] + [f'tail{i}' for i in range(3000)]
+    rng.shuffle(stream)
+    for session_id in stream:
+        tracker.add(session_id)
+        truth[session_id] += 1
+
+    check_invariants(tracker)
+    assert len(tracker) == 16
+    assert tracker.evictions > 0
+    assert {entry['session'] for entry in tracker.top(3)} == {'heavy0', 'heavy1', 'heavy2'}
+
+def test_counts_bound_true_frequency():
+    rng = random.Random(11)
+    tracker = analyzer.SessionHeavyHitters(capacity=8)
+    truth = Counter()
+    for _ in range(5000):
+        session_id = f's{min(int(rng.expovariate(0.3)), 60)}'
+        tracker.add(session_id)
+        truth[session_id] += 1
+        if rng.random() < 0.01:
+            check_invariants(tracker)
+
+    # Space-Saving guarantee: count - error <= true count <= count
+    for session_id, count in tracker.counts.items():
+        assert count - tracker.errors[session_id] <= truth[session_id] <= count
+    assert sum(tracker.counts.values()) == sum(truth.values())
+
+def test_rtt_is_averaged_for_tracked_sessions_only():
+    tracker = analyzer.SessionHeavyHitters(capacity=2)
+    tracker.add('a')
+    tracker.add_rtt('a', 0.1)
+    tracker.add_rtt('a', 0.3)
+    tracker.add_rtt('untracked', 5.0)
+
+    assert abs(tracker.top(1)[0]['avg_rtt'] - 0.2) < 1e-12
+    assert 'untracked' not in tracker
+
+def test_eviction_replaces_oldest_minimum():
+    tracker = analyzer.SessionHeavyHitters(capacity=2)
+    tracker.add('a')
+    tracker.add('b')
+    tracker.add('b')
+    tracker.add('c', 40)
+
+    assert 'a' not in tracker
+    assert tracker.counts['c'] == 2 and tracker.errors['c'] == 1
+    # Bytes are counted from when the session started being tracked
+    assert tracker.bytes['c'] == 40
+    check_invariants(tracker)
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test shard membership and state handoff in the metric labeling engine
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+def series_metric(name, start, count):
+    timestamps = np.arange(start, start + count, dtype=np.float64)
+    return {'name': name, 'values': np.sin(timestamps), 'timestamps': timestamps}
+
+def test_static_members_are_sorted_and_required():
+    shard = engine.ShardMembership('b', members=['c', 'a', 'b', 'a'])
+    assert shard.live_members() == ['a', 'b', 'c']
+
+    try:
+        engine.ShardMembership('x', members=['a', 'b'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an instance missing from the member list must be rejected")
+
+def test_missing_directories_are_logged_not_raised():
+    directory = tempfile.mkdtemp()
+    try:
+        shard = engine.ShardMembership('a', directory=directory)
+        shutil.rmtree(directory)
+
+        assert list(shard.read_handoffs()) == []
+        assert shard.live_members() == ['a']
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def test_handoff_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        sender = engine.ShardMembership('a', directory=directory)
+        receiver = engine.ShardMembership('b', directory=directory)
+        assert sender.write_handoff('b', {'label_state': {'cpu': {'emitted_at': 1}}})
+
+        payloads = list(receiver.read_handoffs())
+        assert payloads == [{'label_state': {'cpu': {'emitted_at': 1}}}]
+        # Handoffs are consumed once
+        assert list(receiver.read_handoffs()) == []
+    finally:
+        shutil.rmtree(directory)
+
+def test_stale_label_state_does_not_roll_back():
+    store = engine.LabelStateStore(None)
+    store.state['cpu'] = {'signature': 'new', 'emitted_at': 200.0, 'severity': 'high'}
+
+    store.import_state({
+        'cpu': {'signature': 'old', 'emitted_at': 100.0, 'severity': 'low'},
+        'mem': {'signature': 'm', 'emitted_at': 50.0, 'severity': 'low'}
+    })
+    assert store.state['cpu']['signature'] == 'new'
+    assert store.state['mem']['signature'] == 'm'
+
+    store.import_state({'cpu': {'signature': 'newer', 'emitted_at': 300.0, 'severity': 'low'}})
+    assert store.state['cpu']['signature'] == 'newer'
+
+def test_stale_series_state_does_not_roll_back():
+    old = engine.StreamingStatsStore(None)
+    old.ingest(series_metric('cpu', 0, 50), 50)
+    stale = old.export(['cpu'])
+
+    current = engine.StreamingStatsStore(None)
+    current.ingest(series_metric('cpu', 0, 100), 100)
+    current.import_state(stale)
+
+    state = current.series[current.metric_series['cpu'][0]]
+    assert state.count == 100
+    assert state.last_timestamp == 99
+    assert current.fetched_until['cpu'] == 100
+    assert current.metric_series['cpu'] == ['cpu']
+
+    # A fresher handoff replaces the local series
+    newer = engine.StreamingStatsStore(None)
+    newer.ingest(series_metric('cpu', 0, 150), 150)
+    current.import_state(newer.export(['cpu']))
+    assert current.series['cpu'].count == 150
+    assert current.fetched_until['cpu'] == 150
+
+def test_stale_model_history_does_not_roll_back():
+    store = engine.AnomalyModelStore(None)
+    store.history['cpu'] = engine.array('d', [1.0, 2.0, 3.0])
+    store.last_timestamp['cpu'] = 300.0
+    store.index['cpu'] = {'version': 2, 'trained_at': 500.0, 'samples': 3, 'file': None}
+
+    store.import_state({'cpu': {
+        'history': engine.array('d', [9.0]),
+        'last_timestamp': 100.0,
+        'entry': {'version': 1, 'trained_at': 400.0, 'samples': 1, 'file': None},
+        'model': object()
+    }})
+    assert list(store.history['cpu']) == [1.0, 2.0, 3.0]
+    assert store.last_timestamp['cpu'] == 300.0
+    assert store.index['cpu']['version'] == 2
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test streaming per-series statistics (Welford, EWMA, t-digest) in the metric labeling engine
+"""
+
+import numpy as np
+
+from agent_modules import load_agent
+
+engine = load_agent('agents/metric-labeling-engine.py')
+
+def iterative_ewma(values, alpha):
+    ewma = values[0]
+    for value in values:
+        ewma = alpha * value + (1 - alpha) * ewma
+    return ewma
+
+def feed(state, values, batch_sizes, alpha=0.1):
+    timestamps = np.arange(len(values), dtype=np.float64)
+    start = 0
+    for size in batch_sizes:
+        state.update(timestamps[start:start + size], values[start:start + size], -np.inf, alpha)
+        start += size
+
+def test_batched_updates_match_whole_series():
+    rng = np.random.default_rng(1)
+    values = rng.normal(50, 7, size=1000)
+    state = engine.SeriesState()
+    feed(state, values, [1, 9, 90, 400, 500], alpha=0.2)
+
+    assert state.count == 1000
+    assert abs(state.mean - values.mean()) < 1e-9
+    assert abs(state.m2 / state.count - values.var()) < 1e-9
+    assert abs(state.ewma - iterative_ewma(values, 0.2)) < 1e-9
+    assert state.minimum == values.min() and state.maximum == values.max()
+
+def test_non_finite_samples_are_not_counted():
+    values = np.array([1.0, np.nan, 3.0, np.inf, 5.0])
+    state = engine.SeriesState()
+    feed(state, values, [5])
+
+    assert state.count == 3
+    assert abs(state.mean - 3.0) < 1e-12
+    # Non-finite samples still advance the series and stay in the window
+    assert state.last_timestamp == 4
+    assert len(state.window_values) == 5
+
+def test_only_newer_samples_are_ingested():
+    state = engine.SeriesState()
+    timestamps = np.arange(10, dtype=np.float64)
+    values = timestamps * 2
+    state.update(timestamps, values, -np.inf, 0.1)
+
+    # An overlapping refetch adds only the samples past the last one seen
+    added_timestamps, added_values = state.update(timestamps + 5, values + 10, -np.inf, 0.1)
+    assert added_timestamps.tolist() == [10, 11, 12, 13, 14]
+    assert added_values.tolist() == [20, 22, 24, 26, 28]
+    assert state.count == 15
+
+    empty_timestamps, _ = state.update(timestamps, values, -np.inf, 0.1)
+    assert len(empty_timestamps) == 0 and state.count == 15
+
+def test_out_of_order_batch_is_sorted():
+    state = engine.SeriesState()
+    state.update(np.array([3.0, 1.0, 2.0]), np.array([30.0, 10.0, 20.0]), -np.inf, 1.0)
+    assert list(state.window_timestamps) == [1, 2, 3]
+    assert state.last_timestamp == 3
+    # With alpha = 1 the EWMA is the latest sample
+    assert state.ewma == 30.0
+
+def test_window_is_trimmed():
+    state = engine.SeriesState()
+    timestamps = np.arange(100, dtype=np.float64)
+    state.update(timestamps, timestamps, 60.0, 0.1)
+    assert list(state.window_timestamps) == list(range(60, 100))
+    assert list(state.window_values) == list(range(60, 100))
+    # Long-window statistics still cover every sample
+    assert state.count == 100 and state.minimum == 0
+
+def test_tdigest_quantiles():
+    rng = np.random.default_rng(2)
+    values = rng.lognormal(0, 1, size=20000)
+    digest = engine.TDigest(compression=100)
+    for batch in np.array_split(values, 37):
+        digest.update(batch)
+    digest.compress()
+
+    means, weights = digest.centroids()
+    assert len(means) <= 2 * digest.compression
+    assert weights.sum() == len(values)
+    assert np.all(np.diff(means) >= 0)
+
+    qs = (0.01, 0.5, 0.95, 0.99)
+    estimates = engine.TDigest.quantiles(means, weights, qs)
+    # Compare in rank space: the estimate must sit close to the requested quantile
+    for q, estimate in zip(qs, estimates):
+        rank = np.searchsorted(np.sort(values), estimate) / len(values)
+        assert abs(rank - q) < 0.01, (q, rank)
+
+def test_tdigest_empty():
+    digest = engine.TDigest()
+    means, weights = digest.centroids()
+    assert all(np.isnan(engine.TDigest.quantiles(means, weights, (0.5, 0.9))))
+
+def test_store_ingests_deltas_and_combines_series():
+    store = engine.StreamingStatsStore(None, window=50)
+    rng = np.random.default_rng(3)
+    a, b = rng.normal(10, 1, 100), rng.normal(20, 2, 100)
+    timestamps = np.arange(100, dtype=np.float64)
+
+    metric = {'name': 'cpu', 'values': np.concatenate([a, b]),
+              'timestamps': np.concatenate([timestamps, timestamps]),
+              'series': [('cpu{i="a"}', 100), ('cpu{i="b"}', 100)]}
+    new_values, _ = store.ingest(metric, end=100)
+    assert len(new_values) == 200
+    assert store.fetch_start('cpu', 200) == 150
+    assert store.fetch_start('cpu', 120) == 100
+    # The metric now holds its labeling window only
+    assert len(metric['values']) == 2 * 50
+
+    baseline = store.baseline('cpu')
+    both = np.concatenate([a, b])
+    assert baseline['count'] == 200
+    assert abs(baseline['mean'] - both.mean()) < 1e-9
+    assert abs(baseline['std'] - both.std()) < 1e-9
+    assert baseline['min'] == both.min() and baseline['max'] == both.max()
+    assert abs(baseline['p50'] - np.median(both)) < 1.0
+
+    # Refetching the same range ingests nothing
+    new_values, _ = store.ingest(dict(metric, values=np.concatenate([a, b]),
+                                      timestamps=np.concatenate([timestamps, timestamps])), end=100)
+    assert len(new_values) == 0
+    assert store.baseline('cpu')['count'] == 200
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Test the binary traffic log recorder, reader and replayer in the packet traffic analyzer
+"""
+
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+
+from agent_modules import load_agent
+
+analyzer = load_agent('agents/packet-traffic-analyzer.py')
+
+class FrameServer:
+    """Minimal length-prefixed JSON server that answers every frame with an ack"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.frames = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.connections += 1
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def serve(self, client):
+        with client:
+            while True:
+                header = client.recv(4, socket.MSG_WAITALL)
+                if len(header) < 4:
+                    return
+                length = struct.unpack('!I', header)[0]
+                body = client.recv(length, socket.MSG_WAITALL)
+                with self.lock:
+                    self.frames.append((4 + length, json.loads(body)))
+                reply = json.dumps({'type': 'ack'}).encode()
+                client.sendall(struct.pack('!I', len(reply)) + reply)
+
+    def close(self):
+        self.sock.close()
+
+def recorded_log(events, **kwargs):
+    directory = tempfile.mkdtemp()
+    recorder = analyzer.TrafficRecorder(directory, **kwargs)
+    for event in events:
+        recorder.record(**event)
+    recorder.close()
+    return directory
+
+def test_round_trip():
+    directory = recorded_log([
+        {'packet_type': 'cmd', 'session_id': 'dev', 'size': 120, 'timestamp': 10.0},
+        {'packet_type': 'res', 'session_id': 'dev', 'size': 80, 'response_time': 0.05, 'timestamp': 10.05},
+        {'packet_type': 'hb', 'session_id': None, 'size': 40, 'timestamp': 11.0},
+    ])
+    try:
+        reader = analyzer.TrafficLogReader(directory)
+        records = list(reader)
+        assert len(reader) == 3
+        assert [(r['type'], r['session'], r['size']) for r in records] == [
+            ('cmd', 'dev', 120), ('res', 'dev', 80), ('hb', '', 40)]
+        assert records[0]['direction'] == analyzer.DIRECTION_REQUEST
+        assert records[1]['direction'] == analyzer.DIRECTION_RESPONSE
+        assert records[0]['response_time'] is None
+        assert abs(records[1]['response_time'] - 0.05) < 1e-6
+        assert reader[-1]['type'] == 'hb'
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_segments_rotate_by_size_and_resume():
+    record_size = analyzer.TRAFFIC_LOG_RECORD.size
+    segment_bytes = analyzer.TRAFFIC_LOG_HEADER.size + 10 * record_size
+    events = [{'packet_type': 'cmd', 'session_id': f's{i % 3}', 'size': i, 'timestamp': float(i)}
+              for i in range(25)]
+    directory = recorded_log(events, segment_bytes=segment_bytes)
+    try:
+        assert len(analyzer.traffic_log_segments(directory)) == 3
+
+        # Reopening continues in a new segment after the existing ones
+        recorder = analyzer.TrafficRecorder(directory, segment_bytes=segment_bytes)
+        recorder.record('list', 'late', 1, timestamp=100.0)
+        recorder.close()
+
+        reader = analyzer.TrafficLogReader(directory)
+        assert [r['size'] for r in reader][:25] == list(range(25))
+        assert reader[25]['session'] == 'late'
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_string_table_is_bounded_per_segment():
+    events = [{'packet_type': 'cmd', 'session_id': f'auto-{i}', 'size': 1, 'timestamp': float(i)}
+              for i in range(50)]
+    directory = recorded_log(events, max_strings=10)
+    try:
+        segments = analyzer.traffic_log_segments(directory)
+        assert len(segments) > 1
+        for segment in segments:
+            with open(analyzer.traffic_log_strings_path(segment)) as f:
+                assert sum(1 for _ in f) <= 10
+
+        reader = analyzer.TrafficLogReader(directory)
+        assert [r['session'] for r in reader] == [f'auto-{i}' for i in range(50)]
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_legacy_shared_string_table_is_read():
+    directory = recorded_log([{'packet_type': 'cmd', 'session_id': 'old', 'size': 5, 'timestamp': 1.0}])
+    try:
+        segment = analyzer.traffic_log_segments(directory)[0]
+        os.rename(analyzer.traffic_log_strings_path(segment),
+                  os.path.join(directory, analyzer.TRAFFIC_LOG_STRINGS))
+        reader = analyzer.TrafficLogReader(directory)
+        assert reader[0]['session'] == 'old' and reader[0]['type'] == 'cmd'
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_torn_trailing_record_is_ignored():
+    directory = recorded_log([{'packet_type': 'cmd', 'session_id': 's', 'size': i, 'timestamp': float(i)}
+                              for i in range(3)])
+    try:
+        segment = analyzer.traffic_log_segments(directory)[0]
+        with open(segment, 'ab') as f:
+            f.write(b'\0' * (analyzer.TRAFFIC_LOG_RECORD.size // 2))
+        reader = analyzer.TrafficLogReader(directory)
+        assert len(reader) == 3
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_replay_frames_match_recorded_size():
+    replayer = analyzer.TrafficReplayer(reader=[])
+    for size in (180, 500, 4096):
+        frame = replayer._build_frame({'type': 'cmd', 'session': 'dev', 'size': size}, 1)
+        assert len(frame) == size
+        assert struct.unpack('!I', frame[:4])[0] == size - 4
+
+    # Frames too small to fit the padding field are sent unpadded
+    for size in (10, 150):
+        frame = replayer._build_frame({'type': 'cmd', 'session': 'dev', 'size': size}, 1)
+        assert 'replay_padding' not in json.loads(frame[4:])['data']
+
+def test_replay_skips_state_changing_types_by_default():
+    events = [{'packet_type': packet_type, 'session_id': f'live{i % 4}', 'size': 200, 'timestamp': i * 0.001}
+              for i, packet_type in enumerate(['cmd', 'list', 'hb', 'create', 'kill', 'res'] * 10)]
+    directory = recorded_log(events)
+    server = FrameServer()
+    try:
+        reader = analyzer.TrafficLogReader(directory)
+        result = analyzer.TrafficReplayer(reader, '127.0.0.1', server.port, speed=0).replay()
+        reader.close()
+
+        assert result['errors'] == 0
+        assert result['sent'] == 20
+        assert {packet['type'] for _, packet in server.frames} == {'list', 'hb'}
+    finally:
+        server.close()
+        shutil.rmtree(directory)
+
+def test_replay_sandbox_rewrites_sessions_over_several_connections():
+    events = [{'packet_type': 'cmd', 'session_id': f'live{i % 8}', 'size': 300, 'timestamp': i * 0.001}
+              for i in range(80)]
+    directory = recorded_log(events)
+    server = FrameServer()
+    try:
+        reader = analyzer.TrafficLogReader(directory)
+        result = analyzer.TrafficReplayer(reader, '127.0.0.1', server.port, speed=0,
+                                          connections=4, sandbox='replay-').replay()
+        reader.close()
+
+        assert result['sent'] == 80 and result['errors'] == 0
+        assert server.connections == 4
+        assert all(packet['session_id'].startswith('replay-live') for _, packet in server.frames)
+        assert all(size == 300 for size, _ in server.frames)
+
+        # Each session keeps its recorded order
+        for session in {packet['session_id'] for _, packet in server.frames}:
+            ids = [int(packet['packet_id'].split('_')[1]) for _, packet in server.frames
+                   if packet['session_id'] == session]
+            assert ids == sorted(ids)
+    finally:
+        server.close()
+        shutil.rmtree(directory)
+
+def main():
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+
+if __name__ == "__main__":
+    main()